@@ -1,8 +1,211 @@
 from django.contrib import admin
-from .models import Film, UserFilm
+from django.contrib.admin.views.main import PAGE_VAR, SEARCH_VAR, ChangeList
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import Film, UserFilm, Job, PairwiseComparison, normalize_title
+from .sharding import enabled, shard_for_user, shards, use_user_shard
 
 # Register your models here.
 
+AFTER_VAR = "after"
+ESTIMATE_ABOVE = 100_000  # below this many rows an exact COUNT(*) is cheap enough
+SEARCH_FILMS = 500  # a title search matches at most this many films (e.g. "the")
+
+
+def estimated_rows(model, using: str) -> int | None:
+    """
+    Row count from the planner's statistics, without scanning the table.
+    SQLite only has them after ANALYZE (or PRAGMA optimize) has run.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                counts = [int(stat.split()[0]) for (stat,) in cursor.fetchall()]
+                return max(counts) if counts else None
+    except DatabaseError:
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Unfiltered change lists of big tables show the estimated size instead of
+    running COUNT(*) over every row; filtered ones (one user's rows, which
+    are indexed) are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_ABOVE:
+                return estimate
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Adds "?after=<pk>": the page of rows just below that id (newest first),
+    fetched with an indexed range instead of an OFFSET that gets slower the
+    deeper you page.
+    """
+    def __init__(self, request, *args, **kwargs):
+        after = request.GET.get(AFTER_VAR, "")
+        self.after = int(after) if after.isdigit() else None
+        self.next_after_url = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        super().get_results(request)
+        if self.after is not None:
+            self.result_list = self.queryset.filter(pk__lt=self.after)[:self.list_per_page]
+            self.multi_page = True
+
+        rows = list(self.result_list)
+        if len(rows) >= self.list_per_page:
+            self.next_after_url = self.get_query_string({AFTER_VAR: rows[-1].pk}, remove=[PAGE_VAR])
+
+
+class UserFilter(admin.SimpleListFilter):
+    """
+    Filter by exact username typed into a box, instead of a sidebar listing
+    every user on the site.
+    """
+    title = "user"
+    parameter_name = "user"
+    template = "admin/core/input_filter.html"
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        # hidden inputs that keep the other filters when the box is submitted
+        yield {
+            "preserved": [
+                (key, value)
+                for key, value in changelist.params.items()
+                if key not in (self.parameter_name, AFTER_VAR)
+            ],
+        }
+
+    def user_id(self):
+        if not self.value():
+            return None
+        return get_user_model().objects.filter(username=self.value()).values_list("id", flat=True).first()
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        user_id = self.user_id()
+        return queryset.filter(user_id=user_id) if user_id is not None else queryset.none()
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    Which shard to browse when no user is selected (see UserDataAdmin).
+    """
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shards()]
+
+    def queryset(self, request, queryset):
+        return queryset  # routing happens in UserDataAdmin.get_queryset
+
+
+class UserDataAdmin(admin.ModelAdmin):
+    """
+    Base for the big per-user tables: user box filter, newest first, estimated
+    counts and keyset paging. With sharding on, the list shows the selected
+    user's shard (or the ?shard= one) and related rows are prefetched from
+    the catalog instead of joined.
+    """
+    list_per_page = 50
+    ordering = ("-pk",)
+    sortable_by = ()
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    change_list_template = "admin/core/keyset_change_list.html"
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_list_filter(self, request):
+        return (UserFilter, ShardFilter) if enabled() else (UserFilter,)
+
+    def get_list_select_related(self, request):
+        # () rather than False, which would select_related() every FK in list_display
+        return () if enabled() else self.list_select_related
+
+    def _shard(self, request) -> str:
+        # the filtered (or searched-for) user's shard, else the one picked
+        username = request.GET.get(UserFilter.parameter_name) or request.GET.get(SEARCH_VAR, "").strip()
+        if username:
+            user_id = get_user_model().objects.filter(username=username).values_list("id", flat=True).first()
+            if user_id is not None:
+                return shard_for_user(user_id)
+        alias = request.GET.get(ShardFilter.parameter_name)
+        return alias if alias in shards() else shards()[0]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if enabled():
+            queryset = queryset.using(self._shard(request)).prefetch_related(*self.list_select_related)
+        return queryset
+
+    def get_object(self, request, object_id, from_field=None):
+        if not enabled():
+            return super().get_object(request, object_id, from_field)
+        # ids don't overlap between shards, so look in each
+        for alias in shards():
+            obj = self.model._default_manager.using(alias).filter(pk=object_id).first()
+            if obj is not None:
+                return obj
+        return None
+
+    def save_model(self, request, obj, form, change):
+        with use_user_shard(obj.user_id):
+            super().save_model(request, obj, form, change)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Film title prefix (through the indexed title key) or exact username,
+        resolved against the catalog first so the big table is only probed
+        by id. Only the first SEARCH_FILMS matching films are looked for.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        film_ids = list(
+            Film.objects.filter(title_key__startswith=normalize_title(term)).values_list("id", flat=True)[:SEARCH_FILMS]
+        )
+        user_id = get_user_model().objects.filter(username=term).values_list("id", flat=True).first()
+        return queryset.filter(self.search_filter(film_ids) | Q(user_id=user_id)), False
+
+    def search_filter(self, film_ids) -> Q:
+        return Q(film_id__in=film_ids)
+
+
 @admin.register(Film)
 class FilmAdmin(admin.ModelAdmin):
     list_display = ("title", "year")
@@ -10,7 +213,28 @@ class FilmAdmin(admin.ModelAdmin):
 
 
 @admin.register(UserFilm)
-class UserFilmAdmin(admin.ModelAdmin):
-    list_display = ("user", "film", "position", "watched_at", "created_at")
-    list_filter = ("user",)
-    search_fields = ("film__title", "user__username")
\ No newline at end of file
+class UserFilmAdmin(UserDataAdmin):
+    list_display = ("user", "film", "position", "preference", "watched_at", "created_at")
+    list_select_related = ("user", "film")
+    autocomplete_fields = ("user", "film")
+    search_fields = ("film__title",)
+    search_help_text = f"Film title (prefix; first {SEARCH_FILMS} matching films) or exact username"
+
+
+@admin.register(PairwiseComparison)
+class PairwiseComparisonAdmin(UserDataAdmin):
+    list_display = ("user", "winner", "loser", "created_at")
+    list_select_related = ("user", "winner", "loser")
+    autocomplete_fields = ("user", "winner", "loser")
+    search_fields = ("winner__title",)
+    search_help_text = f"Film title (prefix, winner or loser; first {SEARCH_FILMS} matching films) or exact username"
+
+    def search_filter(self, film_ids) -> Q:
+        return Q(winner_id__in=film_ids) | Q(loser_id__in=film_ids)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("kind", "status", "priority", "attempts", "run_after", "created_at")
+    list_filter = ("status", "kind")
+    search_fields = ("dedup_key",)
@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import jobs  # noqa: F401  (registers job handlers)
+
+        post_migrate.connect(_prepare_shard, sender=self)
+
+
+def _prepare_shard(sender, using, **kwargs):
+    from django.db import connections
+
+    from .sharding import shards, seed_id_ranges
+
+    if using in shards():
+        seed_id_ranges(using)
+        # migrate turns foreign key checks back on for the connection it used,
+        # and a shard's foreign keys point at tables it doesn't have
+        connections[using].disable_constraint_checking()
@@ -2,6 +2,8 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from .models import Film, UserFilm
+from .services import stats
+from .services.lists import append_to_list
 
 
 class SignUpForm(UserCreationForm):
@@ -74,29 +76,34 @@ class AddFilmForm(forms.Form):
                 },
             )
         else:
-            film, _ = Film.objects.get_or_create(title=title, year=year)
-
-        # Determine the next position (append to end)
-        last_entry = (
-            UserFilm.objects.filter(user=self.user)
-            .order_by("-position")
-            .first()
-        )
-        next_position = (last_entry.position + 1) if last_entry else 1
-
-        user_film, created = UserFilm.objects.get_or_create(
-            user=self.user,
-            film=film,
-            defaults={
-                "position": next_position,
-                "watched_at": watched_at,
-            },
+            # "the matrix" and "The Matrix " are the same film
+            film = Film.objects.matching_title(title, year).first()
+            if film is None:
+                film = Film.objects.create(title=title, year=year)
+
+        user_film, created = append_to_list(
+            self.user.id,
+            film,
+            on_add=stats.on_added,
+            watched_at=watched_at,
+            tmdb_id=film.tmdb_id,
+            poster_path=film.poster_path,
         )
 
         if not created:
+            update_fields = []
             # If it already existed, we might update watched_at
             if watched_at:
                 user_film.watched_at = watched_at
-                user_film.save()
+                update_fields.append("watched_at")
+            # keep the denormalized TMDB columns in sync with the film
+            if user_film.tmdb_id != film.tmdb_id:
+                user_film.tmdb_id = film.tmdb_id
+                update_fields.append("tmdb_id")
+            if not user_film.poster_path and film.poster_path:
+                user_film.poster_path = film.poster_path
+                update_fields.append("poster_path")
+            if update_fields:
+                user_film.save(update_fields=update_fields)
 
         return user_film
\ No newline at end of file
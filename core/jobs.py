@@ -0,0 +1,101 @@
+"""
+Background job handlers. Imported from CoreConfig.ready() so every process
+(web and `run_workers`) knows about them.
+"""
+from django.contrib.auth import get_user_model
+
+from .models import Film, UserFilm
+from .services import leaderboard, recommendations, stats
+from .services.jobs import handler, enqueue, PRIORITY_HIGH, PRIORITY_LOW
+from .services.lists import normalize_positions
+from .services.pairwise import outcomes
+from .services.ratings import bt_fit
+from .services.tmdb import get_director
+from .sharding import use_user_shard
+
+GLOBAL_REFIT_DELAY = 10 * 60
+
+
+def schedule_director_lookup(film):
+    if film.director or not film.tmdb_id:
+        return
+    enqueue(
+        "fetch_director",
+        {"film_id": film.id},
+        dedup_key=f"director:{film.id}",
+        priority=PRIORITY_HIGH,
+    )
+
+
+def schedule_list_upkeep(user):
+    enqueue(
+        "refit_ratings",
+        {"user_id": user.id},
+        dedup_key=f"refit:{user.id}",
+        priority=PRIORITY_LOW,
+    )
+    # one site-wide refit absorbs every placement made while it waits
+    enqueue(
+        "refit_global_bt",
+        dedup_key="refit_global_bt",
+        priority=PRIORITY_LOW,
+        delay=GLOBAL_REFIT_DELAY,
+    )
+    enqueue(
+        "refresh_recommendations",
+        dedup_key="refresh_recommendations",
+        priority=PRIORITY_LOW,
+        delay=GLOBAL_REFIT_DELAY,
+    )
+
+
+@handler("fetch_director")
+def fetch_director(film_id: int):
+    film = Film.objects.filter(pk=film_id).first()
+    if film is None or film.director or not film.tmdb_id:
+        return
+
+    director = get_director(film.tmdb_id)
+    if director and Film.objects.filter(pk=film_id, director__isnull=True).update(director=director):
+        stats.on_director_set(film_id, director)
+
+
+# Placements keep positions contiguous themselves now; this stays available as
+# a repair job (and for jobs queued before that change).
+@handler("normalize_positions")
+def normalize_positions_job(user_id: int):
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is not None:
+        with use_user_shard(user_id):
+            normalize_positions(user)
+
+
+@handler("refit_ratings")
+def refit_ratings(user_id: int):
+    """
+    Full Bradley-Terry fit over the user's compacted pairwise stats.
+    """
+    with use_user_shard(user_id):
+        strengths = bt_fit(outcomes(user_id=user_id))
+
+        user_films = list(UserFilm.objects.filter(user_id=user_id).only("id", "film_id", "bt"))
+        changed = []
+        for uf in user_films:
+            bt = strengths.get(uf.film_id, 0.0)
+            if uf.bt != bt:
+                uf.bt = bt
+                changed.append(uf)
+
+        UserFilm.objects.bulk_update(changed, ["bt"], batch_size=500)
+
+
+@handler("refit_global_bt")
+def refit_global_bt():
+    leaderboard.refit_global_bt()
+
+
+@handler("refresh_recommendations")
+def refresh_recommendations():
+    film_ids = recommendations.stale_film_ids()
+    if film_ids:
+        recommendations.build(film_ids)
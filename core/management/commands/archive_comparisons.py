@@ -0,0 +1,80 @@
+import gzip
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import PairwiseComparison
+from core.sharding import user_databases
+
+
+class Command(BaseCommand):
+    help = (
+        "Move raw PairwiseComparison rows older than N days into a gzipped JSON-lines "
+        "file. Totals are kept in PairwiseStat, so ratings are unaffected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than", type=int, default=settings.COMPARISON_ARCHIVE_AFTER_DAYS,
+            help="Archive rows older than this many days (default: COMPARISON_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument("--dir", default=settings.COMPARISON_ARCHIVE_DIR, help="Directory for archive files.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would move.")
+
+    def handle(self, *args, **options):
+        days = options["older_than"]
+        if days is None:
+            raise CommandError("Pass --older-than or set COMPARISON_ARCHIVE_AFTER_DAYS.")
+
+        cutoff = timezone.now() - timedelta(days=days)
+        databases = user_databases()
+
+        if options["dry_run"]:
+            count = sum(
+                PairwiseComparison.objects.using(alias).filter(created_at__lt=cutoff).count()
+                for alias in databases
+            )
+            self.stdout.write(f"{count} comparison(s) older than {days} day(s).")
+            return
+
+        archive_dir = Path(options["dir"])
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        path = archive_dir / f"comparisons-{timezone.now():%Y%m%dT%H%M%S}.jsonl.gz"
+
+        moved = 0
+        with gzip.open(path, "wt", encoding="utf-8") as fh:
+            for alias in databases:
+                moved += self._archive(fh, alias, cutoff, options["batch_size"])
+
+        if not moved:
+            path.unlink()
+            self.stdout.write("Nothing to archive.")
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} comparison(s) to {path}"))
+
+    def _archive(self, fh, alias, cutoff, batch_size) -> int:
+        old = PairwiseComparison.objects.using(alias).filter(created_at__lt=cutoff).order_by("id")
+        moved = 0
+        last_id = 0
+        while True:
+            batch = list(
+                old.filter(id__gt=last_id)
+                .values("id", "user_id", "winner_id", "loser_id", "created_at")[:batch_size]
+            )
+            if not batch:
+                return moved
+
+            for row in batch:
+                row["created_at"] = row["created_at"].isoformat()
+                fh.write(json.dumps(row) + "\n")
+            fh.flush()
+
+            last_id = batch[-1]["id"]
+            PairwiseComparison.objects.using(alias).filter(id__in=[row["id"] for row in batch]).delete()
+            moved += len(batch)
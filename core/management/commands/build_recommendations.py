@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.services import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the film-to-film neighbor table behind 'you might like'."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--changed", action="store_true",
+            help=(
+                "Only rebuild films whose aggregates changed since their neighbors were built, "
+                "and their entries in other films' lists. Still loads every ranking."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        film_ids = recommendations.stale_film_ids() if options["changed"] else None
+        if film_ids == []:
+            self.stdout.write("Nothing changed.")
+            return
+
+        refreshed, updated = recommendations.build(film_ids)
+        message = f"Refreshed neighbors for {refreshed} film(s)"
+        if film_ids is not None:
+            message += f" and updated {updated} other film(s) that list them"
+        self.stdout.write(self.style.SUCCESS(message + "."))
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Lag, RowNumber
+
+from core.models import PairwiseStat, UserFilm
+from core.services.lists import TIER_ORDER, ListConflict, repair_positions
+from core.sharding import use_shard, user_databases
+
+
+class ListReport:
+    """
+    Problems found in one user's list. `start` is the first row (0-based, in
+    position order) a repair has to touch; everything above it is fine.
+    """
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.gaps = 0
+        self.duplicates = 0
+        self.inversions = 0
+        self.start = None
+        # first row whose tier sorts below each tier, for placing an inverted row
+        self._first_below = {}
+
+    def add(self, index: int, position: int, rank: int, prev_position, prev_rank, copies: int):
+        for below in range(rank):
+            self._first_below.setdefault(below, index)
+
+        if prev_position is None and position > 0 or prev_position is not None and position > prev_position + 1:
+            self.gaps += 1
+            self._mark(index)
+        if copies > 1 and position == prev_position:
+            self.duplicates += 1
+            self._mark(index)
+        if prev_rank is not None and rank < prev_rank:
+            # the row belongs above the first row of any lower tier
+            self.inversions += 1
+            self._mark(self._first_below[rank])
+
+    def _mark(self, index: int):
+        self.start = index if self.start is None else min(self.start, index)
+
+    def __bool__(self):
+        return self.start is not None
+
+    def __str__(self):
+        return (
+            f"{self.gaps} gap(s), {self.duplicates} duplicate position(s), "
+            f"{self.inversions} tier inversion(s); out of order from row {self.start}"
+        )
+
+
+def scan(alias: str, user_ids=None):
+    """
+    One pass over every list in `alias`, in (user, position) order, with the
+    neighbouring-row comparisons done by window functions in the database.
+    Yields a ListReport for each list with a problem.
+    """
+    by_user = {"partition_by": [F("user_id")], "order_by": [F("position").asc(), F("id").asc()]}
+    rows = (
+        UserFilm.objects.using(alias)
+        .annotate(rank=Case(
+            *[When(preference=tier, then=Value(i)) for i, tier in enumerate(TIER_ORDER)],
+            default=Value(len(TIER_ORDER)),  # untiered rows wait at the bottom, as in tier_rank()
+        ))
+        .annotate(
+            index=Window(RowNumber(), **by_user),
+            prev_position=Window(Lag("position"), **by_user),
+            prev_rank=Window(Lag("rank"), **by_user),
+            copies=Window(Count("id"), partition_by=[F("user_id"), F("position")]),
+        )
+        .order_by("user_id", "position", "id")
+        .values_list("user_id", "index", "position", "rank", "prev_position", "prev_rank", "copies")
+    )
+    if user_ids:
+        rows = rows.filter(user_id__in=user_ids)
+
+    report = None
+    for user_id, index, position, rank, prev_position, prev_rank, copies in rows.iterator(chunk_size=5000):
+        if report is None or report.user_id != user_id:
+            if report:
+                yield report
+            report = ListReport(user_id)
+        report.add(index - 1, position, rank, prev_position, prev_rank, copies)
+    if report:
+        yield report
+
+
+def contradictions(alias: str, user_ids=None):
+    """
+    Compacted comparisons whose net winner sits below the loser in the same
+    tier. Not repaired: a later placement or re-tier can legitimately
+    override an old comparison.
+    """
+    def entry(film):
+        return UserFilm.objects.using(alias).filter(user_id=OuterRef("user_id"), film_id=OuterRef(film))
+
+    pairs = (
+        PairwiseStat.objects.using(alias)
+        .annotate(
+            position_a=Subquery(entry("film_a_id").values("position")[:1]),
+            position_b=Subquery(entry("film_b_id").values("position")[:1]),
+            tier_a=Subquery(entry("film_a_id").values("preference")[:1]),
+            tier_b=Subquery(entry("film_b_id").values("preference")[:1]),
+        )
+        .filter(tier_a=F("tier_b"))
+        .filter(
+            Q(wins_a__gt=F("wins_b"), position_a__gt=F("position_b"))
+            | Q(wins_b__gt=F("wins_a"), position_b__gt=F("position_a"))
+        )
+        .order_by("user_id", "film_a_id", "film_b_id")
+        .values_list("user_id", "film_a_id", "film_b_id", "wins_a", "wins_b", "position_a", "position_b")
+    )
+    if user_ids:
+        pairs = pairs.filter(user_id__in=user_ids)
+    return pairs.iterator(chunk_size=2000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Check every user's list: positions contiguous and unique, tiers in order, and no "
+        "same-tier pair ranked against its comparison record. With --repair, rewrite only "
+        "the rows from the first out-of-order one down, putting films stranded below a lower "
+        "tier back into their own by their comparison record."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="Only check this user id (repeatable).")
+        parser.add_argument("--repair", action="store_true", help="Fix position and tier-order problems.")
+        parser.add_argument("--jobs", type=int, default=1, help="Repair this many lists in parallel.")
+        parser.add_argument("--skip-comparisons", action="store_true", help="Don't look for contradicting comparisons.")
+
+    def handle(self, *args, **options):
+        broken = repaired = contradicted = 0
+        for alias in user_databases():
+            reports = []
+            for report in scan(alias, options["user"]):
+                self.stdout.write(f"user {report.user_id} ({alias}): {report}")
+                reports.append(report)
+            broken += len(reports)
+
+            if options["repair"] and reports:
+                if options["jobs"] > 1:
+                    with ThreadPoolExecutor(max_workers=options["jobs"]) as pool:
+                        results = list(pool.map(lambda r: self._repair_in_worker(alias, r), reports))
+                else:
+                    results = [self._repair(alias, report) for report in reports]
+
+                for report, (result, problem) in zip(reports, results):
+                    if problem:
+                        self.stderr.write(f"user {report.user_id}: {problem}, skipped")
+                        continue
+                    moved, guessed = result
+                    repaired += 1
+                    line = f"user {report.user_id}: moved {moved} row(s)"
+                    if guessed:
+                        line += (
+                            f"; {guessed} film(s) moved back into their tier without a comparison "
+                            f"record to place them by, at its bottom: they may need ranking again"
+                        )
+                    self.stdout.write(line)
+
+            if not options["skip_comparisons"]:
+                for user_id, film_a, film_b, wins_a, wins_b, position_a, position_b in contradictions(alias, options["user"]):
+                    winner, loser = (film_a, film_b) if wins_a > wins_b else (film_b, film_a)
+                    self.stdout.write(
+                        f"user {user_id} ({alias}): film {winner} beat film {loser} "
+                        f"{max(wins_a, wins_b)}-{min(wins_a, wins_b)} but is ranked below it "
+                        f"(#{max(position_a, position_b) + 1} vs #{min(position_a, position_b) + 1})"
+                    )
+                    contradicted += 1
+
+        summary = f"{broken} list(s) with position problems, {contradicted} contradicting comparison(s)"
+        if options["repair"]:
+            summary += f", {repaired} list(s) repaired"
+        style = self.style.SUCCESS if not broken or repaired == broken else self.style.WARNING
+        self.stdout.write(style(summary + "."))
+
+    def _repair(self, alias: str, report: ListReport):
+        """
+        (repair_positions() result, None), or (None, why it was skipped).
+        """
+        try:
+            with use_shard(alias, report.user_id):
+                return repair_positions(report.user_id, report.start), None
+        except ListConflict:
+            return None, "list kept changing"
+        except OperationalError as exc:
+            # e.g. "database is locked" when --jobs workers share one SQLite file
+            return None, f"database error ({exc})"
+
+    def _repair_in_worker(self, alias: str, report: ListReport):
+        try:
+            return self._repair(alias, report)
+        finally:
+            # each worker thread opened its own connections
+            connections.close_all()
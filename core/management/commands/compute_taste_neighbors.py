@@ -0,0 +1,87 @@
+import multiprocessing
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.models import UserFilm
+from core.services.taste import correlation, shrunk_score, store_neighbors
+from core.sharding import user_databases
+
+# Filled in by handle() before any worker is forked, so workers share it
+# copy-on-write instead of receiving it through pickling.
+_LISTS = {}
+_POSTINGS = {}
+
+
+def _neighbors_for(args):
+    user_id, top, min_overlap, sample_films, max_candidates = args
+    ranks = _LISTS[user_id]
+
+    # Find candidates through the user's rarest films: they have the shortest
+    # posting lists and say the most about shared taste.
+    sample = sorted(ranks, key=lambda film_id: len(_POSTINGS[film_id]))[:sample_films]
+    co_counts = Counter()
+    for film_id in sample:
+        co_counts.update(_POSTINGS[film_id])
+    del co_counts[user_id]
+
+    scored = []
+    for other_id, _ in co_counts.most_common(max_candidates):
+        result = correlation(ranks, _LISTS[other_id])
+        if result["overlap"] < min_overlap or result["tau"] is None:
+            continue
+        scored.append((other_id, result["tau"], result["overlap"]))
+
+    scored.sort(key=lambda row: shrunk_score(row[1], row[2]), reverse=True)
+    return user_id, scored[:top]
+
+
+class Command(BaseCommand):
+    help = "Precompute each user's most similar users by Kendall tau over shared films."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20, help="Neighbors to keep per user.")
+        parser.add_argument("--min-overlap", type=int, default=10, help="Minimum films in common.")
+        parser.add_argument(
+            "--sample-films", type=int, default=64,
+            help="Films per user used to find candidate neighbors.",
+        )
+        parser.add_argument("--max-candidates", type=int, default=200, help="Candidates scored exactly per user.")
+        parser.add_argument("--jobs", type=int, default=1, help="Worker processes.")
+
+    def handle(self, *args, **options):
+        _LISTS.clear()
+        _POSTINGS.clear()
+
+        lists = defaultdict(dict)
+        postings = defaultdict(list)
+        for alias in user_databases():
+            rows = UserFilm.objects.using(alias).values_list("user_id", "film_id", "position")
+            for user_id, film_id, position in rows.iterator(chunk_size=5000):
+                lists[user_id][film_id] = position
+                postings[film_id].append(user_id)
+        _LISTS.update(lists)
+        _POSTINGS.update(postings)
+
+        tasks = [
+            (user_id, options["top"], options["min_overlap"], options["sample_films"], options["max_candidates"])
+            for user_id in _LISTS
+        ]
+
+        if options["jobs"] > 1:
+            connections.close_all()  # don't share DB handles with forked workers
+            with multiprocessing.get_context("fork").Pool(options["jobs"]) as pool:
+                results = pool.imap_unordered(_neighbors_for, tasks, chunksize=16)
+                stored = self._store(results)
+        else:
+            stored = self._store(map(_neighbors_for, tasks))
+
+        self.stdout.write(self.style.SUCCESS(f"Stored taste neighbors for {stored} user(s)."))
+
+    def _store(self, results) -> int:
+        stored = 0
+        for user_id, neighbors in results:
+            store_neighbors(user_id, neighbors)
+            stored += 1
+        return stored
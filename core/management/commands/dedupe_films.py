@@ -0,0 +1,133 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from core.models import Film, FilmAggregate, PairwiseComparison, PairwiseStat, RankEvent, UserFilm
+from core.services import history, leaderboard, stats
+from core.services.lists import bump_list_version, remove_from_list, sync_film_columns
+from core.services.pairwise import add_outcome
+from core.sharding import use_shard, user_databases
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge films that share a normalized title and year into one row (the TMDB-backed "
+        "one when there is one), moving list entries and comparisons over in bulk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list the duplicates that would be merged.")
+
+    def handle(self, *args, **options):
+        buckets = (
+            Film.objects
+            .exclude(title_key="")
+            .values("title_key", "year")
+            .annotate(n=Count("id"))
+            .filter(n__gt=1)
+            .order_by("title_key", "year")
+        )
+
+        merged = skipped = titles = 0
+        keepers = []
+        for bucket in buckets:
+            films = list(
+                Film.objects
+                .filter(title_key=bucket["title_key"], year=bucket["year"])
+                .order_by(F("tmdb_id").asc(nulls_last=True), "id")
+            )
+            tmdb_ids = {film.tmdb_id for film in films if film.tmdb_id}
+            if len(tmdb_ids) > 1:
+                # different TMDB entries with the same title and year are different films
+                self.stdout.write(f"skip {films[0]}: {len(tmdb_ids)} distinct TMDB ids")
+                skipped += 1
+                continue
+
+            keeper, duplicates = films[0], films[1:]
+            titles += 1
+            self.stdout.write(f"{keeper} (#{keeper.pk}) <- {', '.join(f'#{dup.pk}' for dup in duplicates)}")
+            if options["dry_run"]:
+                continue
+
+            for dup in duplicates:
+                self._merge(dup, keeper)
+            merged += len(duplicates)
+            keepers.append(keeper.pk)
+
+        if merged:
+            # counts moved between films; neighbors of the survivors need a rebuild
+            leaderboard.rebuild()
+            FilmAggregate.objects.filter(film_id__in=keepers).update(neighbors_built_at=None)
+
+        verb = "would merge" if options["dry_run"] else "merged"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} duplicates of {titles} title(s) ({merged} film row(s) removed), "
+            f"{skipped} ambiguous title(s) skipped."
+        ))
+
+    def _merge(self, dup, keeper):
+        backfill = {}
+        for field in ("tmdb_id", "poster_path", "director"):
+            if not getattr(keeper, field) and getattr(dup, field):
+                backfill[field] = getattr(dup, field)
+        if backfill:
+            Film.objects.filter(pk=keeper.pk).update(**backfill)
+            for field, value in backfill.items():
+                setattr(keeper, field, value)
+
+        for alias in user_databases():
+            self._merge_user_rows(alias, dup, keeper)
+        if backfill:
+            # entries that were already on the keeper
+            sync_film_columns(keeper)
+        dup.delete()
+
+    def _merge_user_rows(self, alias, dup, keeper):
+        entries = UserFilm.objects.using(alias)
+        dup_users = set(entries.filter(film=dup).values_list("user_id", flat=True))
+        comparison_users = set(
+            PairwiseStat.objects.using(alias)
+            .filter(Q(film_a=dup) | Q(film_b=dup))
+            .values_list("user_id", flat=True)
+        )
+        if not dup_users and not comparison_users:
+            return
+
+        # a user with both rows keeps the one for the surviving film
+        both = dup_users & set(entries.filter(film=keeper, user_id__in=dup_users).values_list("user_id", flat=True))
+        for user_film in entries.filter(film=dup, user_id__in=both):
+            with use_shard(alias, user_film.user_id):
+                remove_from_list(user_film)
+
+        with use_shard(alias), transaction.atomic(using=alias):
+            entries.filter(film=dup).update(
+                film=keeper, tmdb_id=keeper.tmdb_id or F("tmdb_id"), poster_path=keeper.poster_path or F("poster_path"),
+            )
+
+            comparisons = PairwiseComparison.objects.using(alias)
+            comparisons.filter(Q(winner=dup, loser=keeper) | Q(winner=keeper, loser=dup)).delete()
+            comparisons.filter(winner=dup).update(winner=keeper)
+            comparisons.filter(loser=dup).update(loser=keeper)
+
+            # compacted pairs are keyed by (film_a < film_b), so fold them into the new pairs
+            pairs = PairwiseStat.objects.using(alias).filter(Q(film_a=dup) | Q(film_b=dup))
+            moved = list(pairs.values_list("user_id", "film_a_id", "film_b_id", "wins_a", "wins_b"))
+            pairs.delete()
+            for user_id, a, b, wins_a, wins_b in moved:
+                a, b = (keeper.pk if a == dup.pk else a), (keeper.pk if b == dup.pk else b)
+                if a == b:
+                    continue
+                if wins_a:
+                    add_outcome(user_id, a, b, wins_a)
+                if wins_b:
+                    add_outcome(user_id, b, a, wins_b)
+
+            # older keyframes still name the duplicate; start each history afresh
+            RankEvent.objects.using(alias).filter(film=dup).update(film=keeper)
+            for user_id in dup_users:
+                history.keyframe(user_id)
+                # the keeper's year or director may differ from the duplicate's
+                stats.rebuild(user_id)
+
+            for user_id in dup_users | comparison_users:
+                bump_list_version(user_id)
@@ -0,0 +1,377 @@
+import json
+import os
+import random
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import Resolver404, resolve, reverse
+
+from core.management.commands.rebalance_shards import USER_MODELS
+from core.models import UserFilm
+from core.services import leaderboard
+from core.services.lists import TIER_ORDER
+from core.sharding import use_user_shard
+
+PASSWORD = "load-test-Pa55word"
+STUB_DIRECTORS = ("Agnès Varda", "Akira Kurosawa", "Chantal Akerman", "Wong Kar-wai", "Céline Sciamma")
+
+
+class StubTMDB(BaseHTTPRequestHandler):
+    """
+    Just enough of the TMDB API for the add-film flow: any search returns the
+    same few films for that query, and every film has a director.
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query).get("query", [""])[0]
+        if url.path.endswith("/search/movie"):
+            base = zlib.crc32(query.lower().encode()) % 100_000 * 10
+            body = {"results": [
+                {
+                    "id": base + i,
+                    "title": f"{query.title()} {i or ''}".strip(),
+                    "release_date": f"{1950 + (base + i) % 75}-01-01",
+                    "poster_path": f"/stub{base + i}.jpg",
+                }
+                for i in range(3)
+            ]}
+        elif url.path.endswith("/credits"):
+            movie_id = int(url.path.split("/")[-2])
+            body = {"crew": [{"job": "Director", "name": STUB_DIRECTORS[movie_id % len(STUB_DIRECTORS)]}]}
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Recorder:
+    """
+    Thread-safe tally of every request the simulated users make.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.lock_errors = 0
+        self.transport_errors = Counter()
+
+    def add(self, name: str, seconds: float, status: int, locked: bool):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            self.statuses[name][status] += 1
+            self.lock_errors += locked
+
+    def failed(self, name: str, exc: Exception):
+        with self._lock:
+            self.transport_errors[f"{name}: {type(exc).__name__}"] += 1
+
+
+class SimulatedUser:
+    """
+    One browser session: sign up, then for each film search TMDB, add it,
+    pick a tier, answer comparisons until it's placed and look at the list.
+    """
+    def __init__(self, base_url: str, username: str, films: int, recorder: Recorder, rng: random.Random):
+        self.client = httpx.Client(base_url=base_url, timeout=60)
+        self.username = username
+        self.films = films
+        self.recorder = recorder
+        self.rng = rng
+        self.placed = set()
+
+    def request(self, method: str, path: str, **kwargs) -> httpx.Response | None:
+        try:
+            name = resolve(urlsplit(path).path).url_name
+        except Resolver404:
+            name = path
+        if method == "POST":
+            kwargs.setdefault("headers", {})["X-CSRFToken"] = self.client.cookies.get("csrftoken", "")
+
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as exc:
+            self.recorder.failed(name, exc)
+            return None
+        elapsed = time.perf_counter() - started
+
+        locked = response.status_code >= 500 and b"database is locked" in response.content
+        self.recorder.add(name, elapsed, response.status_code, locked)
+        return response
+
+    def run(self):
+        try:
+            self.request("GET", reverse("account_signup"))
+            response = self.request("POST", reverse("account_signup"), data={
+                "username": self.username, "email": f"{self.username}@example.com",
+                "password1": PASSWORD, "password2": PASSWORD,
+            })
+            if response is None or response.status_code != 302:
+                return
+            for _ in range(self.films):
+                self.add_and_rank()
+        finally:
+            self.client.close()
+
+    def add_and_rank(self):
+        query = f"load film {self.rng.randrange(200)}"
+        response = self.request("GET", reverse("tmdb_search"), params={"q": query})
+        if response is None or response.status_code != 200:
+            return
+        results = response.json()["results"]
+        if not results:
+            return
+        film = self.rng.choice(results)
+        response = self.request("POST", reverse("add_tmdb_film", args=[film["tmdb_id"]]), data={
+            "title": film["title"], "year": film["year"] or "", "poster_path": film["poster_path"] or "",
+        })
+        if response is None or response.status_code != 302:
+            return
+        rank_url = response.headers["location"]
+
+        response = self.request("POST", rank_url, data={"preference": self.rng.choice(TIER_ORDER)})
+        # each comparison halves the tier, so this is far more than a list will ever need
+        for _ in range(40):
+            if response is None:
+                return
+            if response.status_code == 302 and response.headers["location"] != rank_url:
+                break  # placed; the browser lands on the list
+            response = self.request("GET", rank_url)
+            if response is None or response.status_code != 200:
+                continue
+            if b'name="choice"' not in response.content:
+                return
+            response = self.request("POST", rank_url, data={"choice": self.rng.choice(("new", "comparison"))})
+        else:
+            return
+
+        self.placed.add(film["tmdb_id"])
+        self.request("GET", reverse("film_list"))
+
+
+def list_problems(user_id: int, expected_tmdb_ids: set) -> list[str]:
+    with use_user_shard(user_id):
+        rows = list(
+            UserFilm.objects.filter(user_id=user_id)
+            .order_by("position", "id")
+            .values_list("position", "preference", "tmdb_id")
+        )
+    problems = []
+    positions = [position for position, _, _ in rows]
+    if positions != list(range(len(rows))):
+        problems.append(f"positions not contiguous: {positions}")
+    tiers = [TIER_ORDER.index(preference) for _, preference, _ in rows if preference in TIER_ORDER]
+    if tiers != sorted(tiers):
+        problems.append("tiers out of order")
+    missing = expected_tmdb_ids - {tmdb_id for _, _, tmdb_id in rows}
+    if missing:
+        problems.append(f"{len(missing)} placed film(s) missing from the list")
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive many simulated users through signup, add film, the rank_film comparison loop and "
+        "the film list concurrently against a running server, with TMDB stubbed, and report "
+        "throughput, latency percentiles per URL, lock errors and list consistency. The server "
+        "must use the same database as this command for the consistency check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server to load (default: %(default)s).")
+        parser.add_argument("--users", type=int, default=20, help="Simulated users, one thread each.")
+        parser.add_argument("--films", type=int, default=10, help="Films each user adds and ranks.")
+        parser.add_argument("--stub-port", type=int, default=8765, help="Port for the stub TMDB API.")
+        parser.add_argument(
+            "--start-server", action="store_true",
+            help="Start `runserver` at --url, pointed at the stub, instead of using one that's already up.",
+        )
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable runs.")
+        parser.add_argument(
+            "--stats-token", default=os.environ.get("ORION_OPS_TOKEN", ""),
+            help="The server's ORION_OPS_TOKEN, to report its coalescing counters (generated with --start-server).",
+        )
+        parser.add_argument(
+            "--keep-users", action="store_true",
+            help="Leave the simulated accounts and their lists in the database afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        stub = ThreadingHTTPServer(("127.0.0.1", options["stub_port"]), StubTMDB)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        stub_url = f"http://127.0.0.1:{stub.server_port}/3"
+
+        server = None
+        if options["start_server"]:
+            options["stats_token"] = options["stats_token"] or secrets.token_urlsafe()
+            server = self._start_server(options["url"], stub_url, options["stats_token"])
+        else:
+            self.stdout.write(f"Stub TMDB at {stub_url}; the server needs TMDB_API_BASE_URL={stub_url} and a TMDB_API_KEY.")
+
+        try:
+            self._run(options)
+        finally:
+            stub.shutdown()
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    def _start_server(self, url: str, stub_url: str, stats_token: str) -> subprocess.Popen:
+        address = urlsplit(url).netloc
+        env = {
+            **os.environ,
+            "TMDB_API_BASE_URL": stub_url,
+            "TMDB_API_KEY": os.environ.get("TMDB_API_KEY", "stub"),
+            "ORION_OPS_TOKEN": stats_token,
+        }
+        server = subprocess.Popen(
+            [sys.executable, "manage.py", "runserver", "--noreload", address],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                httpx.get(url, timeout=1)
+                return server
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError(f"runserver did not come up at {url}")
+
+    def _run(self, options):
+        recorder = Recorder()
+        run_id = f"{int(time.time()):x}"
+        seed = options["seed"] if options["seed"] is not None else random.randrange(2**32)
+        users = [
+            SimulatedUser(options["url"], f"load-{run_id}-{i}", options["films"], recorder, random.Random(seed + i))
+            for i in range(options["users"])
+        ]
+        try:
+            self._load(options, users, recorder, seed)
+        finally:
+            if not options["keep_users"]:
+                self._delete_users([user.username for user in users])
+
+    def _load(self, options, users: list[SimulatedUser], recorder: Recorder, seed: int):
+        threads = [threading.Thread(target=user.run) for user in users]
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        total = sum(len(values) for values in recorder.latencies.values())
+        self.stdout.write(
+            f"{options['users']} users x {options['films']} films (seed {seed}): "
+            f"{total} requests in {wall:.1f}s = {total / wall:.1f} req/s"
+        )
+        self.stdout.write(f"{'url':<20}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+        for name, values in sorted(recorder.latencies.items()):
+            values.sort()
+            statuses = ", ".join(f"{status}x{n}" for status, n in sorted(recorder.statuses[name].items()))
+            self.stdout.write(
+                f"{name:<20}{len(values):>7}"
+                + "".join(f"{percentile(values, p) * 1000:>10.1f}" for p in (50, 95, 99))
+                + f"  {statuses}"
+            )
+
+        errors = sum(n for counts in recorder.statuses.values() for status, n in counts.items() if status >= 500)
+        self.stdout.write(f"server errors: {errors} ({recorder.lock_errors} 'database is locked')")
+        for failure, n in recorder.transport_errors.most_common():
+            self.stdout.write(f"transport error {failure} x{n}")
+
+        self._report_coalescing(options["url"], options["stats_token"])
+        self._check_lists(users)
+
+    def _report_coalescing(self, base_url: str, token: str):
+        """
+        The server's single-flight counters (see /ops/coalescing/).
+        Cumulative since the server started.
+        """
+        if not token:
+            self.stdout.write("coalescing stats skipped: pass --stats-token (the server's ORION_OPS_TOKEN).")
+            return
+        try:
+            response = httpx.get(
+                base_url + reverse("coalescing_stats"), headers={"Authorization": f"Bearer {token}"}, timeout=60,
+            )
+        except httpx.HTTPError as exc:
+            self.stdout.write(self.style.WARNING(f"coalescing stats unavailable: {exc}"))
+            return
+        if response.status_code != 200 or "json" not in response.headers.get("content-type", ""):
+            self.stdout.write(self.style.WARNING(f"coalescing stats unavailable: HTTP {response.status_code}"))
+            return
+
+        for service, flights in response.json().items():
+            for name, counts in flights.items():
+                self.stdout.write(
+                    f"coalescing {service} {name}: {counts['calls']} calls, {counts['fetched']} fetched, "
+                    f"{counts['coalesced_local']} shared in-process, {counts['coalesced_remote']} shared "
+                    f"across processes, {counts['fallbacks']} fallback(s)"
+                )
+
+    def _check_lists(self, users: list[SimulatedUser]):
+        accounts = dict(
+            get_user_model().objects
+            .filter(username__in=[user.username for user in users])
+            .values_list("username", "id")
+        )
+        bad = 0
+        for user in users:
+            if user.username not in accounts:
+                self.stdout.write(self.style.WARNING(f"{user.username}: not found in this database"))
+                bad += 1
+                continue
+            for problem in list_problems(accounts[user.username], user.placed):
+                self.stdout.write(self.style.ERROR(f"{user.username}: {problem}"))
+                bad += 1
+
+        placed = sum(len(user.placed) for user in users)
+        if bad:
+            self.stdout.write(self.style.ERROR(f"{bad} consistency problem(s) across {len(users)} list(s)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(users)} list(s) consistent, {placed} placement(s) checked."))
+
+    def _delete_users(self, usernames: list[str]):
+        """
+        Remove the run's accounts, their list data (wherever it's sharded)
+        and their contribution to the leaderboard.
+        """
+        accounts = get_user_model().objects.filter(username__in=usernames)
+        for user_id in accounts.values_list("id", flat=True):
+            with use_user_shard(user_id) as alias, transaction.atomic(using=alias):
+                for user_film in UserFilm.objects.filter(user_id=user_id):
+                    leaderboard.on_removed(user_film)
+                for model in USER_MODELS:
+                    model.objects.filter(user_id=user_id).delete()
+        deleted = accounts.delete()[1].get(get_user_model()._meta.label, 0)
+        leaderboard.invalidate_pages()
+        self.stdout.write(f"deleted {deleted} load-test account(s).")
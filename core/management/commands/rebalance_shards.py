@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import (
+    ListVersion, PairwiseComparison, PairwiseStat, RankEvent, UserDecadeStat, UserDirectorStat, UserFilm, UserShard,
+    UserTierDay,
+)
+from core.sharding import enabled, hashed_shard, shard_for_user
+
+# every model whose rows belong to one user and live in that user's shard
+USER_MODELS = (
+    ListVersion, UserFilm, PairwiseStat, PairwiseComparison, RankEvent, UserDirectorStat, UserDecadeStat, UserTierDay,
+)
+
+
+def _auto_dates(model) -> list[str]:
+    return [
+        field.name for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' list data to the shard their id hashes to (after changing ORION_SHARDS), "
+        "or out of the catalog database after turning sharding on. Run during low traffic: "
+        "placements a user makes while being moved can be lost."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-default", action="store_true",
+            help="Move rows created in 'default' before sharding was enabled.",
+        )
+        parser.add_argument("--user", type=int, action="append", help="Only move this user id (repeatable).")
+        parser.add_argument("--dry-run", action="store_true", help="Only report who would move where.")
+
+    def handle(self, *args, **options):
+        if not enabled():
+            raise CommandError("Sharding is off; set ORION_SHARDS first.")
+
+        if options["from_default"]:
+            moves = [(user_id, "default", shard_for_user(user_id)) for user_id in self._legacy_users()]
+        else:
+            moves = [
+                (user_id, alias, hashed_shard(user_id))
+                for user_id, alias in UserShard.objects.values_list("user_id", "alias")
+                if alias != hashed_shard(user_id)
+            ]
+
+        if options["user"]:
+            wanted = set(options["user"])
+            moves = [move for move in moves if move[0] in wanted]
+
+        for user_id, src, dst in moves:
+            if options["dry_run"]:
+                self.stdout.write(f"user {user_id}: {src} -> {dst}")
+                continue
+            copied = self._move(user_id, src, dst)
+            self.stdout.write(f"user {user_id}: moved {copied} row(s) {src} -> {dst}")
+
+        verb = "would move" if options["dry_run"] else "moved"
+        self.stdout.write(self.style.SUCCESS(f"{len(moves)} user(s) {verb}."))
+
+    def _legacy_users(self) -> list[int]:
+        user_ids = set()
+        for model in USER_MODELS:
+            user_ids.update(model.objects.using("default").values_list("user_id", flat=True).distinct())
+        return sorted(user_ids)
+
+    def _move(self, user_id: int, src: str, dst: str) -> int:
+        copied = 0
+        # copy first, keeping primary keys; ids are allocated per shard range
+        # so they can't collide in the destination
+        with transaction.atomic(using=dst):
+            for model in USER_MODELS:
+                rows = list(model.objects.using(src).filter(user_id=user_id))
+                stamped = _auto_dates(model)
+                dates = [[getattr(row, name) for name in stamped] for row in rows]
+                model.objects.using(dst).bulk_create(rows, batch_size=500)
+                if stamped:
+                    # bulk_create sets auto_now(_add) fields to the current time
+                    for row, values in zip(rows, dates):
+                        for name, value in zip(stamped, values):
+                            setattr(row, name, value)
+                    model.objects.using(dst).bulk_update(rows, stamped, batch_size=500)
+                copied += len(rows)
+
+        UserShard.objects.update_or_create(user_id=user_id, defaults={"alias": dst})
+
+        with transaction.atomic(using=src):
+            for model in USER_MODELS:
+                model.objects.using(src).filter(user_id=user_id).delete()
+        return copied
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import stats
+from core.sharding import use_user_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-user stats rows (directors, decades, tier split over time) from each "
+        "user's list and rank history. For backfill after deploying them, or repair."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Users to rebuild (default: everyone).")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("id")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+            missing = set(options["usernames"]) - set(users.values_list("username", flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        rebuilt = 0
+        for user_id in users.values_list("id", flat=True).iterator():
+            with use_user_shard(user_id):
+                stats.rebuild(user_id)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} user(s)."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.services import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Refit global Bradley-Terry strengths for the top films page (run periodically, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Also recompute counts and mean scores from every user's list.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            leaderboard.rebuild()
+            self.stdout.write("Rebuilt film aggregates.")
+
+        leaderboard.refit_global_bt()
+        self.stdout.write(self.style.SUCCESS("Refit global strengths."))
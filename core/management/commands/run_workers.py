@@ -0,0 +1,70 @@
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from core.services.jobs import claim, run_job, requeue_stale
+
+
+class Command(BaseCommand):
+    help = "Run background job workers (director lookups, list renumbering, rating refits)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of worker threads.")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Drain the queue and exit.")
+        parser.add_argument(
+            "--stale-after", type=int, default=300,
+            help="Requeue running jobs locked for longer than this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale(timedelta(seconds=options["stale_after"]))
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
+
+        stop = threading.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(f"{prefix}:{i}", stop, options["poll"], options["once"]),
+                daemon=True,
+            )
+            for i in range(max(1, options["workers"]))
+        ]
+        for t in threads:
+            t.start()
+
+        self.stdout.write(f"Started {len(threads)} worker(s). Ctrl-C to stop.")
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def _work(self, worker_id, stop, poll, once):
+        done = failed = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = claim(worker_id)
+                if job is None:
+                    if once:
+                        break
+                    stop.wait(poll)
+                    continue
+
+                if run_job(job):
+                    done += 1
+                else:
+                    failed += 1
+        finally:
+            connection.close()
+            self.stdout.write(f"[{worker_id}] finished: {done} done, {failed} failed")
@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+import requests
+
+from core.models import UserFilm
+from core.services import posters
+from core.sharding import use_user_shard
+
+
+class Command(BaseCommand):
+    help = "Fetch poster thumbnails for every film on the given users' lists into the local poster cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Users whose lists to warm (default: everyone).")
+        parser.add_argument(
+            "--width", type=int, action="append", choices=posters.WIDTHS,
+            help=f"Thumbnail width, repeatable (default: {posters.DEFAULT_WIDTH}).",
+        )
+
+    def handle(self, *args, **options):
+        widths = options["width"] or [posters.DEFAULT_WIDTH]
+
+        users = get_user_model().objects.order_by("id")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+            missing = set(options["usernames"]) - set(users.values_list("username", flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        names = set()
+        for user_id in users.values_list("id", flat=True):
+            with use_user_shard(user_id):
+                paths = UserFilm.objects.filter(user_id=user_id).values_list("poster_path", flat=True)
+                names.update(filter(None, map(posters.poster_name, paths)))
+
+        fetched = cached = failed = 0
+        for name in sorted(names):
+            for width in widths:
+                if posters.cache_path(width, name).exists():
+                    cached += 1
+                    continue
+                try:
+                    if posters.get(width, name) is None:
+                        failed += 1
+                    else:
+                        fetched += 1
+                except requests.RequestException as exc:
+                    failed += 1
+                    self.stderr.write(f"w{width}/{name}: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{fetched} fetched, {cached} already cached, {failed} failed ({len(names)} poster(s))."
+        ))
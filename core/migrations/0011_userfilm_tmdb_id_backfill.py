@@ -0,0 +1,44 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_userfilm_tmdb(apps, schema_editor):
+    """
+    Copy tmdb_id / poster_path from Film onto UserFilm rows that predate
+    the denormalized columns being kept in sync.
+    """
+    Film = apps.get_model("core", "Film")
+    UserFilm = apps.get_model("core", "UserFilm")
+    db = schema_editor.connection.alias
+
+    film = Film.objects.using(db).filter(pk=OuterRef("film_id"))
+
+    UserFilm.objects.using(db).filter(
+        tmdb_id__isnull=True, film__tmdb_id__isnull=False,
+    ).update(tmdb_id=Subquery(film.values("tmdb_id")[:1]))
+
+    UserFilm.objects.using(db).filter(
+        poster_path__isnull=True, film__poster_path__isnull=False,
+    ).update(poster_path=Subquery(film.values("poster_path")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userfilm',
+            index=models.Index(fields=['user', 'tmdb_id'], name='core_userfi_user_id_dab7af_idx'),
+        ),
+        migrations.RunPython(
+            backfill_userfilm_tmdb, migrations.RunPython.noop,
+            hints={"model_name": "film"},  # joins Film, so only where the catalog lives
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def compact_comparisons(apps, schema_editor):
+    PairwiseComparison = apps.get_model("core", "PairwiseComparison")
+    PairwiseStat = apps.get_model("core", "PairwiseStat")
+    db = schema_editor.connection.alias
+
+    stats = {}
+    grouped = (
+        PairwiseComparison.objects.using(db)
+        .values_list("user_id", "winner_id", "loser_id")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for user_id, winner_id, loser_id, n in grouped.iterator():
+        if winner_id == loser_id:
+            continue
+        a, b = sorted((winner_id, loser_id))
+        row = stats.setdefault((user_id, a, b), [0, 0])
+        row[0 if winner_id == a else 1] += n
+
+    PairwiseStat.objects.using(db).bulk_create(
+        [
+            PairwiseStat(user_id=user_id, film_a_id=a, film_b_id=b, wins_a=wins_a, wins_b=wins_b)
+            for (user_id, a, b), (wins_a, wins_b) in stats.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_userfilm_tmdb_id_backfill'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairwiseStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wins_a', models.PositiveIntegerField(default=0)),
+                ('wins_b', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('film_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.film')),
+                ('film_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.film')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'film_b'], name='core_pairwi_user_id_73dd88_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'film_a', 'film_b'), name='core_pairwisestat_unique_pair')],
+            },
+        ),
+        migrations.RunPython(compact_comparisons, migrations.RunPython.noop),
+    ]
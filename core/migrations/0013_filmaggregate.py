@@ -0,0 +1,58 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import math
+
+
+def build_film_aggregates(apps, schema_editor):
+    UserFilm = apps.get_model("core", "UserFilm")
+    FilmAggregate = apps.get_model("core", "FilmAggregate")
+    db = schema_editor.connection.alias
+
+    aggregates = {}
+    ranked = (
+        UserFilm.objects.using(db)
+        .filter(preference__isnull=False)
+        .values_list("film_id", "preference", "elo")
+    )
+    for film_id, preference, elo in ranked.iterator():
+        agg = aggregates.get(film_id)
+        if agg is None:
+            agg = aggregates[film_id] = FilmAggregate(film_id=film_id)
+        agg.num_ranked += 1
+        agg.score_sum += 10.0 / (1.0 + math.exp(-(elo - 1500.0) / 200.0))
+        setattr(agg, f"{preference}_count", getattr(agg, f"{preference}_count") + 1)
+
+    FilmAggregate.objects.using(db).bulk_create(aggregates.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_pairwisestat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmAggregate',
+            fields=[
+                ('film', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='core.film')),
+                ('num_ranked', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0.0)),
+                ('liked_count', models.PositiveIntegerField(default=0)),
+                ('ok_count', models.PositiveIntegerField(default=0)),
+                ('disliked_count', models.PositiveIntegerField(default=0)),
+                ('global_bt', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-global_bt'], name='core_filmag_global__ec6096_idx')],
+            },
+        ),
+        migrations.RunPython(
+            build_film_aggregates, migrations.RunPython.noop,
+            hints={"model_name": "filmaggregate"},
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_filmaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filmaggregate',
+            name='neighbors_built_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='FilmNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('support', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='core.film')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.film')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['film', '-score'], name='core_filmne_film_id_f48684_idx')],
+                'constraints': [models.UniqueConstraint(fields=('film', 'neighbor'), name='core_filmneighbor_unique_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+import re
+import unicodedata
+
+
+def backfill_title_keys(apps, schema_editor):
+    Film = apps.get_model("core", "Film")
+    db = schema_editor.connection.alias
+
+    # same rules as core.models.normalize_title at the time of writing
+    def normalize(title):
+        decomposed = unicodedata.normalize("NFKD", title or "")
+        stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+        return " ".join(re.sub(r"[^\w]+", " ", stripped.casefold()).split())
+
+    batch = []
+    for film in Film.objects.using(db).only("id", "title").iterator(chunk_size=2000):
+        film.title_key = normalize(film.title)
+        batch.append(film)
+        if len(batch) >= 2000:
+            Film.objects.using(db).bulk_update(batch, ["title_key"])
+            batch = []
+    Film.objects.using(db).bulk_update(batch, ["title_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_usershard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='title_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(
+            backfill_title_keys, migrations.RunPython.noop,
+            hints={"model_name": "film"},
+        ),
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['title_key', 'year'], name='core_film_title_k_cb45f4_idx'),
+        ),
+    ]
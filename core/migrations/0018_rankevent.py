@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-19 07:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_film_title_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('from_position', models.PositiveIntegerField(blank=True, null=True)),
+                ('to_position', models.PositiveIntegerField(blank=True, null=True)),
+                ('preference', models.CharField(blank=True, choices=[('liked', 'I liked it'), ('ok', 'It was ok'), ('disliked', "I didn't like it")], max_length=10, null=True)),
+                ('keyframe', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('film', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.film')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='core_rankev_user_id_b944cc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'seq'), name='core_rankevent_unique_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+from django.db.models import Max
+
+TIER_ORDER = ("liked", "ok", "disliked")
+
+
+def normalize_positions(apps, schema_editor):
+    """
+    Renumber every list 0..n-1 in tier order (untiered films last), keeping
+    the current order within a tier. Lists from before placement kept them
+    contiguous can start at 1 or have gaps.
+    """
+    UserFilm = apps.get_model("core", "UserFilm")
+    RankEvent = apps.get_model("core", "RankEvent")
+    db = schema_editor.connection.alias
+
+    def tier_rank(preference):
+        return TIER_ORDER.index(preference) if preference in TIER_ORDER else len(TIER_ORDER)
+
+    user_ids = UserFilm.objects.using(db).values_list("user_id", flat=True).distinct().order_by()
+    for user_id in user_ids.iterator():
+        rows = list(
+            UserFilm.objects.using(db)
+            .filter(user_id=user_id)
+            .order_by("position", "id")
+            .values_list("id", "position", "film_id", "preference")
+        )
+        rows.sort(key=lambda row: tier_rank(row[3]))
+        changed = [(pk, i) for i, (pk, position, _, _) in enumerate(rows) if position != i]
+        if not changed:
+            continue
+        for pk, i in changed:
+            UserFilm.objects.using(db).filter(pk=pk).update(position=i)
+
+        # deltas recorded before this point no longer line up with the list
+        events = RankEvent.objects.using(db).filter(user_id=user_id)
+        last = events.aggregate(Max("seq"))["seq__max"]
+        if last is not None:
+            RankEvent.objects.using(db).create(
+                user_id=user_id, seq=last + 1,
+                keyframe=[[film_id, preference] for _, _, film_id, preference in rows],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_user_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            normalize_positions, migrations.RunPython.noop,
+            hints={"model_name": "userfilm"},  # runs on every shard holding lists
+        ),
+    ]
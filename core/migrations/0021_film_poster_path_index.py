@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-19 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_normalize_positions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['poster_path'], name='core_film_poster__2db007_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 import math
+import re
+import unicodedata
 
 # Create your models here.
 
@@ -11,15 +14,51 @@ PREFERENCE_CHOICES = [
     ("disliked", "I didn't like it")
 ]
 
+def normalize_title(title: str) -> str:
+    """
+    Lookup key for a title: case, accents, punctuation and spacing ignored.
+    "  Amélie " and "amelie" share a key.
+    """
+    decomposed = unicodedata.normalize("NFKD", title or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w]+", " ", stripped.casefold()).split())
+
+
+class FilmQuerySet(models.QuerySet):
+    def matching_title(self, title, year):
+        """
+        Films with the same normalized title and year (indexed), TMDB-backed
+        rows first.
+        """
+        return (
+            self.filter(title_key=normalize_title(title), year=year)
+            .order_by(models.F("tmdb_id").asc(nulls_last=True), "id")
+        )
+
+
 class Film(models.Model):
     title = models.CharField(max_length=255)
+    title_key = models.CharField(max_length=255, default="", editable=False)
     year = models.PositiveIntegerField(blank=True, null=True)
     tmdb_id = models.PositiveIntegerField(blank=True, null=True)
     poster_path = models.CharField(max_length=255, blank=True, null=True)
     director = models.CharField(max_length=255, blank=True, null=True)
 
+    objects = FilmQuerySet.as_manager()
+
     class Meta:
         ordering = ["title"]
+        indexes = [
+            models.Index(fields=["title_key", "year"]),
+            models.Index(fields=["poster_path"]),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.title_key = normalize_title(self.title)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "title" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "title_key"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         if self.year:
@@ -27,6 +66,19 @@ class Film(models.Model):
         return self.title
 
 
+class UserFilmQuerySet(models.QuerySet):
+    def owned_tmdb(self, user, tmdb_ids):
+        """
+        (tmdb_id, preference) pairs for the given TMDB ids that `user` already
+        has. Uses the denormalized UserFilm.tmdb_id, so the cost depends on the
+        number of ids asked about, not on the size of the user's list.
+        """
+        return (
+            self.filter(user=user, tmdb_id__in=list(tmdb_ids))
+            .values_list("tmdb_id", "preference")
+        )
+
+
 class UserFilm(models.Model):
     """
     A film in a given user's personal list.
@@ -48,6 +100,8 @@ class UserFilm(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = UserFilmQuerySet.as_manager()
+
     @property
     def score10(self):
         """
@@ -64,6 +118,9 @@ class UserFilm(models.Model):
     class Meta:
         unique_together = ("user", "film")
         ordering = ["position", "-created_at"]
+        indexes = [
+            models.Index(fields=["user", "tmdb_id"]),
+        ]
 
     def __str__(self):
         return f"{self.user.username} · {self.film} (#{self.position})"
@@ -78,4 +135,278 @@ class PairwiseComparison(models.Model):
         indexes = [
             models.Index(fields=["user", "created_at"]),
             models.Index(fields=["user", "winner", "loser"]),
-        ]
\ No newline at end of file
+        ]
+
+class Job(models.Model):
+    """
+    A unit of deferred work picked up by `manage.py run_workers`.
+    Successful jobs are deleted; failed ones stay around for inspection.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, blank=True)
+    dedup_key = models.CharField(max_length=255, blank=True, null=True)
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-priority", "run_after"]),
+        ]
+        constraints = [
+            # at most one *waiting* job per dedup key; a running job may
+            # have a fresh one queued behind it
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=models.Q(status="queued"),
+                name="core_job_unique_queued_dedup_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} [{self.status}] #{self.pk}"
+
+
+class PairwiseStat(models.Model):
+    """
+    Head-to-head record for one unordered film pair, per user.
+    The compacted form of PairwiseComparison: film_a is always the film with
+    the lower id, so each pair has exactly one row.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    film_a = models.ForeignKey("Film", on_delete=models.CASCADE, related_name="+")
+    film_b = models.ForeignKey("Film", on_delete=models.CASCADE, related_name="+")
+    wins_a = models.PositiveIntegerField(default=0)
+    wins_b = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "film_a", "film_b"], name="core_pairwisestat_unique_pair"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "film_b"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.film_a_id} {self.wins_a}–{self.wins_b} {self.film_b_id}"
+
+
+class FilmAggregate(models.Model):
+    """
+    Site-wide totals for one film across every user's list. Maintained
+    incrementally from the ranking write paths; global_bt is refreshed by a
+    periodic batch fit (see core/services/leaderboard.py).
+    """
+    film = models.OneToOneField(Film, on_delete=models.CASCADE, primary_key=True, related_name="aggregate")
+    num_ranked = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0.0)  # sum of score10 over ranked UserFilms
+    liked_count = models.PositiveIntegerField(default=0)
+    ok_count = models.PositiveIntegerField(default=0)
+    disliked_count = models.PositiveIntegerField(default=0)
+    global_bt = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+    neighbors_built_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-global_bt"]),
+        ]
+
+    @property
+    def mean_score10(self):
+        if not self.num_ranked:
+            return None
+        return round(self.score_sum / self.num_ranked, 2)
+
+    def __str__(self):
+        return f"{self.film} · {self.num_ranked} ranked"
+
+
+class FilmNeighbor(models.Model):
+    """
+    Precomputed "people who rank `film` highly also rank `neighbor` highly"
+    edge. Each film keeps its top-K neighbors; rebuilt in batch by
+    `manage.py build_recommendations`.
+    """
+    film = models.ForeignKey(Film, on_delete=models.CASCADE, related_name="neighbors")
+    neighbor = models.ForeignKey(Film, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    support = models.PositiveIntegerField(default=0)  # users who ranked both
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["film", "neighbor"], name="core_filmneighbor_unique_pair"),
+        ]
+        indexes = [
+            models.Index(fields=["film", "-score"]),
+        ]
+
+    def __str__(self):
+        return f"{self.film_id} → {self.neighbor_id} ({self.score:.3f})"
+
+
+class ListVersion(models.Model):
+    """
+    Per-user counter bumped whenever the user's list changes (films added,
+    placed, moved or removed). Anything derived from a list can key its cache
+    on this instead of re-reading the list.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="list_version",
+    )
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+
+class TasteNeighbor(models.Model):
+    """
+    Precomputed "users whose rankings agree with yours", from
+    `manage.py compute_taste_neighbors`.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="taste_neighbors")
+    other = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    tau = models.FloatField()
+    overlap = models.PositiveIntegerField()
+    score = models.FloatField()  # tau shrunk towards 0 for small overlaps; used for ordering
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "other"], name="core_tasteneighbor_unique_pair"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-score"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} ~ {self.other_id} (τ={self.tau:.2f}, n={self.overlap})"
+
+
+class UserShard(models.Model):
+    """
+    Directory entry: which shard database holds this user's list data.
+    Only used when sharding is on (see core/sharding.py).
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="shard",
+    )
+    alias = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.user_id} → {self.alias}"
+
+
+class RankEvent(models.Model):
+    """
+    One entry in a user's rank history (see core/services/history.py).
+
+    A delta: `film` moved from `from_position` to `to_position`, where None
+    means "not on the list" (an insert or a removal) and the rows in between
+    shifted by one. Or a keyframe: the whole list as [[film_id, preference], ...]
+    just before the next delta.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    seq = models.PositiveIntegerField()
+    # history outlives films (e.g. merged by dedupe_films), so no cascade
+    film = models.ForeignKey(
+        Film, on_delete=models.DO_NOTHING, db_constraint=False, blank=True, null=True, related_name="+",
+    )
+    from_position = models.PositiveIntegerField(blank=True, null=True)
+    to_position = models.PositiveIntegerField(blank=True, null=True)
+    preference = models.CharField(max_length=10, choices=PREFERENCE_CHOICES, blank=True, null=True)
+    keyframe = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "seq"], name="core_rankevent_unique_seq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+        ]
+
+    def __str__(self):
+        if self.keyframe is not None:
+            return f"{self.user_id} #{self.seq} keyframe ({len(self.keyframe)} films)"
+        return f"{self.user_id} #{self.seq} film {self.film_id}: {self.from_position} → {self.to_position}"
+
+
+class UserDirectorStat(models.Model):
+    """
+    One user's ranked films by one director, maintained incrementally (see
+    core/services/stats.py) for the stats page.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    director = models.CharField(max_length=255)
+    num_ranked = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0.0)  # sum of score10, as in FilmAggregate
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "director"], name="core_userdirectorstat_unique"),
+        ]
+
+    @property
+    def mean_score10(self):
+        if not self.num_ranked:
+            return None
+        return round(self.score_sum / self.num_ranked, 2)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.director} · {self.num_ranked} ranked"
+
+
+class UserDecadeStat(models.Model):
+    """
+    How many films from one decade are on a user's list.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    decade = models.PositiveSmallIntegerField()  # e.g. 1990
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "decade"], name="core_userdecadestat_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.decade}s × {self.count}"
+
+
+class UserTierDay(models.Model):
+    """
+    A user's tier split at the end of one day. A row is only written on days
+    the split changed; the days in between carry the previous row forward.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    day = models.DateField()
+    liked_count = models.PositiveIntegerField(default=0)
+    ok_count = models.PositiveIntegerField(default=0)
+    disliked_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day"], name="core_usertierday_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day}: {self.liked_count}/{self.ok_count}/{self.disliked_count}"
@@ -0,0 +1,112 @@
+"""
+Primary / read-replica database routing.
+
+Writes always go to "default". Reads go to a replica (settings.DATABASE_REPLICAS)
+only inside views wrapped with @read_replica, and only while the client isn't
+pinned to the primary. A client gets pinned for a few seconds after any
+successful write request, so people always see their own placements.
+"""
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = "orion_primary_until"
+
+_use_replica = ContextVar("orion_use_replica", default=False)
+_pinned = ContextVar("orion_pinned_to_primary", default=False)
+
+
+def _replicas() -> list[str]:
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = _replicas()
+        if replicas and _use_replica.get() and not _pinned.get():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {"default", *_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary; never migrate them directly
+        if db in _replicas():
+            return False
+        return None
+
+
+def read_replica(view):
+    """
+    Let a read-heavy view's queries go to a replica.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _use_replica.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+    return wrapper
+
+
+def _is_pinned(request) -> bool:
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _pin_after_write(request, response):
+    if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+        return
+    seconds = settings.REPLICA_PIN_SECONDS
+    response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite="Lax")
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+    """
+    Read-your-writes: after a successful POST (placing a film, deleting one...)
+    keep the client on the primary until replicas have caught up.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _pinned.set(_is_pinned(request))
+            try:
+                response = await get_response(request)
+            finally:
+                _pinned.reset(token)
+            _pin_after_write(request, response)
+            return response
+    else:
+        def middleware(request):
+            token = _pinned.set(_is_pinned(request))
+            try:
+                response = get_response(request)
+            finally:
+                _pinned.reset(token)
+            _pin_after_write(request, response)
+            return response
+    return middleware
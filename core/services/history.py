@@ -0,0 +1,179 @@
+"""
+Rank history: how each user's list order changed over time, stored as
+deltas rather than snapshots.
+
+Every list edit (append, placement, tier move, removal) records one
+RankEvent saying which film moved from where to where; everything between
+the two positions shifted by one, so that is all that needs storing. Every
+KEYFRAME_EVERY events (and before a user's first event) the whole list is
+stored as a keyframe. Rebuilding the list at any moment is then one keyframe
+lookup plus at most KEYFRAME_EVERY replayed deltas.
+
+record() must run inside the same transaction as the edit, before its writes.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+
+from core.models import RankEvent, UserFilm
+from core.sharding import current_db
+
+KEYFRAME_EVERY = 50
+
+
+def _snapshot(user_id: int, exclude_film_id=None) -> list:
+    rows = UserFilm.objects.filter(user_id=user_id).order_by("position", "id")
+    if exclude_film_id is not None:
+        rows = rows.exclude(film_id=exclude_film_id)
+    return [[film_id, preference] for film_id, preference in rows.values_list("film_id", "preference")]
+
+
+def _append(user_id: int, **fields):
+    events = RankEvent.objects.filter(user_id=user_id)
+    for _ in range(3):
+        last = events.order_by("-seq").values_list("seq", flat=True).first() or 0
+        try:
+            with transaction.atomic(using=current_db()):
+                return RankEvent.objects.create(user_id=user_id, seq=last + 1, **fields)
+        except IntegrityError:
+            continue  # a concurrent edit took the number; read it again
+    raise IntegrityError(f"could not allocate a rank history entry for user {user_id}")
+
+
+def keyframe(user_id: int, exclude_film_id=None) -> RankEvent:
+    """
+    Store the user's whole list as it currently is in the database.
+    """
+    return _append(user_id, keyframe=_snapshot(user_id, exclude_film_id))
+
+
+def record(user_id: int, film_id: int, from_position, to_position, preference=None):
+    """
+    Log that `film_id` moves from `from_position` to `to_position` (None for
+    "not on the list"). Call before the edit's own writes; for an append
+    whose row already exists, the keyframe leaves that film out.
+    """
+    last_keyframe = (
+        RankEvent.objects
+        .filter(user_id=user_id, keyframe__isnull=False)
+        .order_by("-seq")
+        .values_list("seq", flat=True)
+        .first()
+    )
+    if last_keyframe is None or RankEvent.objects.filter(user_id=user_id, seq__gt=last_keyframe).count() >= KEYFRAME_EVERY:
+        keyframe(user_id, exclude_film_id=film_id if from_position is None else None)
+
+    return _append(
+        user_id, film_id=film_id, from_position=from_position, to_position=to_position, preference=preference,
+    )
+
+
+def _apply(entries: list, event: RankEvent):
+    if event.keyframe is not None:
+        entries[:] = [list(entry) for entry in event.keyframe]
+        return
+    preference = event.preference
+    if event.from_position is not None and event.from_position < len(entries):
+        _, old_preference = entries.pop(event.from_position)
+        preference = preference or old_preference
+    if event.to_position is not None:
+        entries.insert(min(event.to_position, len(entries)), [event.film_id, preference])
+
+
+def _events_from_keyframe(user_id: int, at=None):
+    """
+    The last keyframe at or before `at`, followed by the deltas after it.
+    """
+    events = RankEvent.objects.filter(user_id=user_id)
+    if at is not None:
+        events = events.filter(created_at__lte=at)
+    start = (
+        events.filter(keyframe__isnull=False)
+        .order_by("-seq")
+        .values_list("seq", flat=True)
+        .first()
+    )
+    if start is None:
+        return events.none()
+    return events.filter(seq__gte=start).order_by("seq")
+
+
+def list_at(user_id: int, at=None) -> list[tuple[int, str | None]]:
+    """
+    The user's list as (film_id, preference) pairs in rank order at time
+    `at` (default: now), rebuilt from the nearest keyframe.
+    """
+    entries = []
+    for event in _events_from_keyframe(user_id, at).iterator():
+        _apply(entries, event)
+    return [tuple(entry) for entry in entries]
+
+
+def replay(user_id: int):
+    """
+    Yield (event, entries) for every recorded event in order, `entries` being
+    the list as (film_id, preference) pairs just after it. The same list is
+    updated in place between steps; copy it to keep it.
+    """
+    entries = []
+    for event in RankEvent.objects.filter(user_id=user_id).order_by("seq").iterator():
+        _apply(entries, event)
+        yield event, entries
+
+
+def film_series(user_id: int, film_id: int, since=None) -> list[dict]:
+    """
+    How one film's position (0-based) and score10 changed on the user's
+    list: one point per change, starting at `since` (default: the first
+    recorded history). Position and score are None while it's off the list.
+
+    Replay starts at the last keyframe before `since`. Only this film is
+    scored: its place within its tier and the tier sizes are adjusted by
+    one per delta, and counted afresh only at keyframes and at the film's
+    own moves.
+    """
+    from core.services.lists import tier_score  # lists records into this module
+
+    events = RankEvent.objects.filter(user_id=user_id).order_by("seq")
+    if since is not None:
+        base = _events_from_keyframe(user_id, since).values_list("seq", flat=True).first()
+        if base is not None:
+            events = events.filter(seq__gte=base)
+
+    entries = []
+    sizes = Counter()
+    position = tier = above = None  # the film's index, tier and same-tier films above it
+    points = []
+    last = None
+    for event in events.iterator():
+        if event.keyframe is not None or event.film_id == film_id:
+            _apply(entries, event)
+            sizes = Counter(preference or "ok" for _, preference in entries)
+            position = next((i for i, (fid, _) in enumerate(entries) if fid == film_id), None)
+            if position is not None:
+                tier = entries[position][1] or "ok"
+                above = sum(1 for _, preference in entries[:position] if (preference or "ok") == tier)
+        else:
+            removed = event.from_position if event.from_position is not None and event.from_position < len(entries) else None
+            old_preference = (entries[removed][1] or "ok") if removed is not None else None
+            _apply(entries, event)
+            if removed is not None:
+                sizes[old_preference] -= 1
+                if position is not None and removed < position:
+                    position -= 1
+                    above -= old_preference == tier
+            if event.to_position is not None:
+                inserted = min(event.to_position, len(entries) - 1)
+                new_preference = entries[inserted][1] or "ok"
+                sizes[new_preference] += 1
+                if position is not None and inserted <= position:
+                    position += 1
+                    above += new_preference == tier
+
+        if since is not None and event.created_at < since:
+            continue
+        score = tier_score(tier, above, sizes[tier]) if position is not None else None
+        if (position, score) != last:
+            points.append({"at": event.created_at, "position": position, "score": score})
+            last = (position, score)
+    return points
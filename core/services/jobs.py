@@ -0,0 +1,165 @@
+"""
+A small DB-backed job queue.
+
+Jobs are rows in `core.Job`. Handlers are plain functions registered with
+`@handler("kind")` and called with the job payload as keyword arguments.
+Workers (`manage.py run_workers`) claim jobs with a conditional UPDATE, so
+several worker processes can share one database without double-running a job.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 15 * 60
+
+_HANDLERS = {}
+
+
+def handler(kind: str):
+    def register(fn):
+        _HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind: str, payload: dict | None = None, *, dedup_key: str | None = None,
+            priority: int = PRIORITY_NORMAL, max_attempts: int = 5, delay: float = 0) -> Job:
+    """
+    Queue a job. If a job with the same `dedup_key` is already waiting, that
+    job is returned instead (its priority is raised if ours is higher).
+    """
+    payload = payload or {}
+    run_after = timezone.now() + timedelta(seconds=delay)
+
+    job = None
+    if dedup_key:
+        job = _existing(dedup_key, priority)
+
+    if job is None:
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    kind=kind,
+                    payload=payload,
+                    dedup_key=dedup_key,
+                    priority=priority,
+                    max_attempts=max_attempts,
+                    run_after=run_after,
+                )
+        except IntegrityError:
+            # someone queued the same key between our check and insert
+            job = _existing(dedup_key, priority)
+
+    if getattr(settings, "JOBS_EAGER", False):
+        transaction.on_commit(lambda: _run_eagerly(job.pk))
+
+    return job
+
+
+def _existing(dedup_key: str, priority: int) -> Job | None:
+    job = Job.objects.filter(dedup_key=dedup_key, status=Job.QUEUED).first()
+    if job is not None and job.priority < priority:
+        Job.objects.filter(pk=job.pk).update(priority=priority)
+        job.priority = priority
+    return job
+
+
+def _run_eagerly(job_id: int):
+    job = claim(worker_id="eager", job_ids=[job_id])
+    if job is not None:
+        run_job(job)
+
+
+def claim(worker_id: str, *, job_ids=None) -> Job | None:
+    """
+    Atomically take the highest-priority runnable job, or None if there is
+    nothing to do.
+    """
+    now = timezone.now()
+
+    if job_ids is None:
+        job_ids = list(
+            Job.objects
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by("-priority", "run_after", "id")
+            .values_list("id", flat=True)[:10]
+        )
+
+    for job_id in job_ids:
+        taken = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if taken:
+            return Job.objects.get(pk=job_id)
+
+    return None
+
+
+def run_job(job: Job) -> bool:
+    fn = _HANDLERS.get(job.kind)
+    try:
+        if fn is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        fn(**job.payload)
+    except Exception:
+        logger.exception("Job %s failed (attempt %s/%s)", job.pk, job.attempts, job.max_attempts)
+        _fail(job, traceback.format_exc())
+        return False
+
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def _fail(job: Job, error: str):
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, locked_by=None)
+        return
+
+    backoff = min(RETRY_BASE_SECONDS * 2 ** (job.attempts - 1), RETRY_MAX_SECONDS)
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED,
+                last_error=error,
+                locked_by=None,
+                locked_at=None,
+                run_after=timezone.now() + timedelta(seconds=backoff),
+            )
+    except IntegrityError:
+        # a newer job with the same dedup key is already waiting; it will do the work
+        Job.objects.filter(pk=job.pk).delete()
+
+
+def requeue_stale(older_than: timedelta) -> int:
+    """
+    Put back jobs whose worker died mid-run.
+    """
+    cutoff = timezone.now() - older_than
+    requeued = 0
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff)
+    for job in stale:
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                    status=Job.QUEUED, locked_by=None, locked_at=None,
+                )
+        except IntegrityError:
+            Job.objects.filter(pk=job.pk).delete()
+    return requeued
@@ -0,0 +1,183 @@
+"""
+Site-wide "top films" leaderboard.
+
+FilmAggregate rows are kept current by the ranking write paths:
+
+* a film counts towards its aggregate once the user has given it a tier;
+* every Elo change moves score_sum by the change in score10;
+* removing a ranked film takes its contribution back out.
+
+global_bt comes from a Bradley-Terry fit over every user's PairwiseStat rows.
+That is a batch job (`refit_global_bt`, or `manage.py refresh_leaderboard`),
+not something done per request. Rendered pages are cached and the cache
+version is bumped after each fit.
+"""
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import FilmAggregate, UserFilm
+from core.services.pairwise import all_outcomes
+from core.services.ratings import bt_fit, elo_to_10
+from core.sharding import user_databases
+
+PAGE_SIZE = 50
+MIN_RANKED = 1
+PAGE_CACHE_SECONDS = 60
+
+_VERSION_KEY = "leaderboard:version"
+_ZERO = {"num_ranked": 0, "score_sum": 0.0, "liked_count": 0, "ok_count": 0, "disliked_count": 0}
+
+
+def _apply(film_id: int, **deltas):
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not updates:
+        return
+    updates["updated_at"] = timezone.now()  # .update() skips auto_now
+
+    aggregate = FilmAggregate.objects.filter(film_id=film_id)
+    if aggregate.update(**updates):
+        return
+
+    try:
+        with transaction.atomic():
+            FilmAggregate.objects.create(film_id=film_id, **deltas)
+    except IntegrityError:
+        aggregate.update(**updates)
+
+
+def on_tier_set(user_film, old_tier: str | None):
+    """
+    Call after user_film.preference has been saved.
+    """
+    new_tier = user_film.preference
+    if old_tier == new_tier:
+        return
+
+    deltas = {f"{new_tier}_count": 1}
+    if old_tier is None:
+        deltas["num_ranked"] = 1
+        deltas["score_sum"] = elo_to_10(user_film.elo)
+    else:
+        deltas[f"{old_tier}_count"] = -1
+    _apply(user_film.film_id, **deltas)
+
+
+def on_elo_change(user_film, old_elo: float):
+    if user_film.preference is None:
+        return
+    _apply(user_film.film_id, score_sum=elo_to_10(user_film.elo) - elo_to_10(old_elo))
+
+
+def on_removed(user_film):
+    if user_film.preference is None:
+        return
+    _apply(
+        user_film.film_id,
+        num_ranked=-1,
+        score_sum=-elo_to_10(user_film.elo),
+        **{f"{user_film.preference}_count": -1},
+    )
+
+
+def refit_global_bt():
+    """
+    Bradley-Terry fit over all users' compacted comparisons.
+    """
+    strengths = bt_fit(all_outcomes())
+
+    existing = set(FilmAggregate.objects.values_list("film_id", flat=True))
+    FilmAggregate.objects.bulk_create(
+        [FilmAggregate(film_id=film_id) for film_id in strengths if film_id not in existing],
+        batch_size=1000,
+    )
+
+    aggregates = list(FilmAggregate.objects.only("film_id", "global_bt"))
+    changed = []
+    for agg in aggregates:
+        bt = strengths.get(agg.film_id, 0.0)
+        if agg.global_bt != bt:
+            agg.global_bt = bt
+            changed.append(agg)
+    FilmAggregate.objects.bulk_update(changed, ["global_bt"], batch_size=1000)
+
+    invalidate_pages()
+
+
+def rebuild():
+    """
+    Recompute the incremental columns from scratch (backfill / repair).
+    """
+    totals = {}
+    for alias in user_databases():
+        ranked = (
+            UserFilm.objects.using(alias)
+            .filter(preference__isnull=False)
+            .values_list("film_id", "preference", "elo")
+        )
+        for film_id, preference, elo in ranked.iterator(chunk_size=2000):
+            row = totals.setdefault(film_id, dict(_ZERO))
+            row["num_ranked"] += 1
+            row["score_sum"] += elo_to_10(elo)
+            row[f"{preference}_count"] += 1
+
+    with transaction.atomic():
+        aggregates = {agg.film_id: agg for agg in FilmAggregate.objects.all()}
+        for film_id in totals.keys() - aggregates.keys():
+            aggregates[film_id] = FilmAggregate.objects.create(film_id=film_id)
+        for film_id, agg in aggregates.items():
+            for field, value in totals.get(film_id, _ZERO).items():
+                setattr(agg, field, value)
+        FilmAggregate.objects.bulk_update(aggregates.values(), list(_ZERO), batch_size=1000)
+
+    invalidate_pages()
+
+
+def invalidate_pages():
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        cache.set(_VERSION_KEY, 1, None)
+
+
+def page(number: int) -> dict:
+    """
+    One leaderboard page as plain data, served from the cache when possible.
+    """
+    version = cache.get_or_set(_VERSION_KEY, 1, None)
+    key = f"leaderboard:v{version}:page:{number}"
+    return cache.get_or_set(key, lambda: _build_page(number), PAGE_CACHE_SECONDS)
+
+
+def _build_page(number: int) -> dict:
+    offset = (number - 1) * PAGE_SIZE
+    rows = list(
+        FilmAggregate.objects
+        .filter(num_ranked__gte=MIN_RANKED)
+        .select_related("film")
+        .order_by("-global_bt", "-score_sum", "film_id")[offset:offset + PAGE_SIZE + 1]
+    )
+
+    entries = []
+    for rank, agg in enumerate(rows[:PAGE_SIZE], start=offset + 1):
+        film = agg.film
+        entries.append({
+            "rank": rank,
+            "title": film.title,
+            "year": film.year,
+            "director": film.director,
+            "mean_score10": agg.mean_score10,
+            "num_ranked": agg.num_ranked,
+            "liked": agg.liked_count,
+            "ok": agg.ok_count,
+            "disliked": agg.disliked_count,
+            "global_bt": round(agg.global_bt, 3),
+        })
+
+    return {
+        "entries": entries,
+        "number": number,
+        "has_previous": number > 1,
+        "has_next": len(rows) > PAGE_SIZE,
+    }
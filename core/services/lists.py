@@ -0,0 +1,463 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Q
+
+from core.models import ListVersion, UserFilm
+from core.services import history, pairwise
+from core.sharding import current_db, group_by_shard, user_databases
+
+EDIT_ATTEMPTS = 5
+TIER_ORDER = ("liked", "ok", "disliked")
+
+
+class ListConflict(Exception):
+    """
+    The list kept changing underneath an edit (see edit_list).
+    """
+
+BANDS = {
+    "liked":    (6.67, 10.00),
+    "ok":       (3.33, 6.67),
+    "disliked": (0.00, 3.33),
+}
+
+
+def tier_score(preference, index: int, size: int) -> float:
+    """
+    score10 of the `index`-th best of `size` films in a tier (see rank_scores).
+    """
+    band_lo, band_hi = BANDS[preference if preference in BANDS else "ok"]
+    if size == 1:
+        return round((band_lo + band_hi) / 2.0, 2)
+    t = index / (size - 1)  # 0 for best -> 1 for worst
+    return round(band_hi - t * (band_hi - band_lo), 2)
+
+
+def rank_scores(entries) -> dict:
+    """
+    Rank-based tier-banded scores (Beli-like).
+    `entries` is (key, preference) pairs in list order; returns {key: score10}.
+    Films without a tier are scored as "ok".
+    """
+    tiers = {"liked": [], "ok": [], "disliked": []}
+    for key, preference in entries:
+        tier = preference if preference in tiers else "ok"
+        tiers[tier].append(key)
+
+    scores = {}
+    for tier, keys in tiers.items():
+        # best in tier (earlier in list) gets band_hi, worst gets band_lo
+        for idx, key in enumerate(keys):
+            scores[key] = tier_score(tier, idx, len(keys))
+
+    return scores
+
+
+def bump_list_version(user_id: int):
+    versions = ListVersion.objects.filter(user_id=user_id)
+    if versions.update(version=F("version") + 1):
+        return
+
+    try:
+        with transaction.atomic(using=current_db()):
+            ListVersion.objects.create(user_id=user_id, version=1)
+    except IntegrityError:
+        versions.update(version=F("version") + 1)
+
+
+def list_versions(user_ids) -> dict:
+    """
+    {user_id: version}; users whose list never changed are at version 0.
+    """
+    user_ids = list(user_ids)
+    found = {}
+    for alias, ids in group_by_shard(user_ids).items():
+        found.update(
+            ListVersion.objects.using(alias)
+            .filter(user_id__in=ids)
+            .values_list("user_id", "version")
+        )
+    return {user_id: found.get(user_id, 0) for user_id in user_ids}
+
+
+def list_version(user_id: int) -> int:
+    version = ListVersion.objects.filter(user_id=user_id).values_list("version", flat=True).first()
+    return version or 0
+
+
+def _claim_version(user_id: int, expected: int) -> bool:
+    """
+    Compare-and-swap the list version from `expected` to `expected + 1`.
+    """
+    if expected:
+        return bool(ListVersion.objects.filter(user_id=user_id, version=expected).update(version=expected + 1))
+    try:
+        with transaction.atomic(using=current_db()):
+            ListVersion.objects.create(user_id=user_id, version=1)
+    except IntegrityError:
+        return False
+    return True
+
+
+def edit_list(user_id: int, read, write, *, attempts: int = EDIT_ATTEMPTS):
+    """
+    Optimistic edit of a user's list positions.
+
+    read() runs outside any transaction and returns whatever write() needs.
+    write(state) then runs in a short transaction that first claims the next
+    list version; if another request changed the list since read(), the claim
+    fails, nothing is written and both steps run again on fresh data.
+    Every other writer of positions must bump the version too.
+    """
+    for _ in range(attempts):
+        version = list_version(user_id)
+        state = read()
+        with transaction.atomic(using=current_db()):
+            if _claim_version(user_id, version):
+                return write(state)
+    raise ListConflict(f"list of user {user_id} changed {attempts} times during one edit")
+
+
+def _shift(rows, pk, current: int, target: int):
+    if target < current:
+        rows.filter(position__gte=target, position__lt=current).update(position=F("position") + 1)
+    elif target > current:
+        rows.filter(position__gt=current, position__lte=target).update(position=F("position") - 1)
+    rows.filter(pk=pk).update(position=target)
+
+
+def move_to(user_film, position):
+    """
+    Move a film to `position` (0-based), shifting only the rows between its
+    old and new place. `position` may be a callable, re-evaluated against
+    the current list on every attempt.
+    """
+    rows = UserFilm.objects.filter(user_id=user_film.user_id)
+
+    def read():
+        current, preference = rows.filter(pk=user_film.pk).values_list("position", "preference").first() or (None, None)
+        target = position() if callable(position) else position
+        return current, preference, target
+
+    def write(state):
+        current, preference, target = state
+        if current is None:  # removed in the meantime
+            return
+        history.record(user_film.user_id, user_film.film_id, current, target, preference)
+        _shift(rows, user_film.pk, current, target)
+        user_film.position = target
+
+    edit_list(user_film.user_id, read, write)
+
+
+def tier_start(user_id: int, tier: str, moving=None) -> int:
+    """
+    Position where `tier` begins once `moving` (if given) has left its
+    current slot.
+    """
+    above = TIER_ORDER[:TIER_ORDER.index(tier)]
+    if not above:
+        return 0
+
+    # the tier starts right after the last item in tiers above
+    rows = UserFilm.objects.filter(user_id=user_id, preference__in=above)
+    if moving is not None:
+        rows = rows.exclude(pk=moving.pk)
+    last_pos = rows.aggregate(Max("position"))["position__max"]
+    if last_pos is None:
+        return 0
+    if moving is not None:
+        # the moving film's own slot closes up when it leaves, which pulls
+        # everything after it (including the tier boundary) up by one
+        current = UserFilm.objects.filter(pk=moving.pk).values_list("position", flat=True).first()
+        if current is not None and current < last_pos:
+            return last_pos
+    return last_pos + 1
+
+
+def retier(user_film, tier: str, placement: str = "predicted", on_change=None):
+    """
+    Move a ranked film into another tier without re-running the comparison
+    search. `placement` is "top" or "bottom" of the new tier, or
+    "predicted": below every film of the tier with a higher Elo.
+
+    Only the rows between the old and new position are rewritten.
+    on_change(user_film, old_tier) runs in the same transaction, after the
+    film's preference has been saved.
+    """
+    rows = UserFilm.objects.filter(user_id=user_film.user_id)
+
+    def read():
+        current = rows.filter(pk=user_film.pk).values_list("position", "elo").first()
+        if current is None:
+            return None
+        position, elo = current
+        others = list(
+            rows.filter(preference=tier)
+            .exclude(pk=user_film.pk)
+            .order_by("position")
+            .values_list("position", "elo")
+        )
+        if not others:
+            return position, tier_start(user_film.user_id, tier, moving=user_film)
+
+        if placement == "top":
+            index = 0
+        elif placement == "bottom":
+            index = len(others)
+        else:
+            index = sum(1 for _, other_elo in others if other_elo > elo)
+
+        if index < len(others):
+            return position, _slot(position, others[index][0], above=True)
+        return position, _slot(position, others[-1][0], above=False)
+
+    def write(state):
+        if state is None:
+            return
+        current, target = state
+        _enter_tier(rows, user_film, tier, current, target, on_change)
+
+    edit_list(user_film.user_id, read, write)
+
+
+def place_in_tier(user_film, tier: str, candidates: list, index: int, on_change=None):
+    """
+    Finish a comparison search: give the film `tier` and put it just above
+    candidates[index], the first film it ranks ahead of (or just below
+    candidates[index - 1]). `candidates` are the tier's UserFilm ids as they
+    stood when the search began; the target is worked out from where those
+    films are now, so films added to or moved in the tier meanwhile (say,
+    from another tab) don't throw it off. on_change(user_film, old_tier)
+    runs as in retier().
+    """
+    rows = UserFilm.objects.filter(user_id=user_film.user_id)
+
+    def read():
+        current = rows.filter(pk=user_film.pk).values_list("position", "elo").first()
+        if current is None:
+            return None
+        position, elo = current
+        members = dict(
+            rows.filter(preference=tier).exclude(pk=user_film.pk).values_list("id", "position")
+        )
+        # the nearest candidate that is still in the tier, on the side the search ended
+        for pk in candidates[index:]:
+            if pk in members:
+                return position, _slot(position, members[pk], above=True), elo
+        for pk in reversed(candidates[:index]):
+            if pk in members:
+                return position, _slot(position, members[pk], above=False), elo
+        # none of them are left: the top of the tier, or its bottom if it beat nothing
+        if index and members:
+            return position, _slot(position, max(members.values()), above=False), elo
+        return position, tier_start(user_film.user_id, tier, user_film), elo
+
+    def write(state):
+        if state is None:
+            return
+        current, target, elo = state
+        user_film.elo = elo  # the last comparison updated it on another instance
+        _enter_tier(rows, user_film, tier, current, target, on_change)
+
+    edit_list(user_film.user_id, read, write)
+
+
+def _slot(current: int, anchor: int, above: bool) -> int:
+    """
+    Target position for the film at `current` to land just above (or below)
+    the film now at `anchor`, once its own slot has closed up.
+    """
+    if above:
+        return anchor if anchor < current else anchor - 1
+    return anchor + 1 if anchor < current else anchor
+
+
+def _enter_tier(rows, user_film, tier: str, current: int, target: int, on_change=None):
+    history.record(user_film.user_id, user_film.film_id, current, target, tier)
+    old_tier = user_film.preference
+    user_film.preference = tier
+    user_film.save(update_fields=["preference"])
+    _shift(rows, user_film.pk, current, target)
+    user_film.position = target
+    if on_change is not None:
+        on_change(user_film, old_tier)
+
+
+def remove_from_list(user_film, on_remove=None):
+    """
+    Delete a film from the list and close the gap it leaves. on_remove(user_film)
+    runs in the same transaction, just before the delete.
+    """
+    rows = UserFilm.objects.filter(user_id=user_film.user_id)
+
+    def read():
+        return rows.filter(pk=user_film.pk).values_list("position", flat=True).first()
+
+    def write(position):
+        if position is None:
+            return
+        history.record(user_film.user_id, user_film.film_id, position, None)
+        if on_remove is not None:
+            on_remove(user_film)
+        rows.filter(pk=user_film.pk).delete()
+        rows.filter(position__gt=position).update(position=F("position") - 1)
+
+    edit_list(user_film.user_id, read, write)
+
+
+def append_to_list(user_id: int, film, on_add=None, **defaults):
+    """
+    The user's entry for `film`, created at the end of the list if it isn't
+    there yet. A list edit like any other, so concurrent appends can't end
+    up sharing a position. on_add(user_film) runs in the same transaction
+    when a row is created. Returns (user_film, created).
+    """
+    rows = UserFilm.objects.filter(user_id=user_id)
+    existing = rows.filter(film=film).first()
+    if existing is not None:
+        return existing, False
+
+    def read():
+        last = rows.aggregate(Max("position"))["position__max"]
+        return last + 1 if last is not None else 0
+
+    def write(position):
+        user_film, created = UserFilm.objects.get_or_create(
+            user_id=user_id, film=film, defaults={"position": position, **defaults},
+        )
+        if created:
+            history.record(user_id, film.id, None, position)
+            if on_add is not None:
+                on_add(user_film)
+        return user_film, created
+
+    return edit_list(user_id, read, write)
+
+
+def sync_film_columns(film) -> int:
+    """
+    Copy the film's tmdb_id and poster_path onto every list entry for it
+    that doesn't have them yet, e.g. after they were backfilled on the film.
+    Returns how many rows changed.
+    """
+    updated = 0
+    for alias in user_databases():
+        entries = UserFilm.objects.using(alias).filter(film_id=film.pk)
+        if film.tmdb_id:
+            updated += entries.exclude(tmdb_id=film.tmdb_id).update(tmdb_id=film.tmdb_id)
+        if film.poster_path:
+            updated += entries.filter(Q(poster_path__isnull=True) | Q(poster_path="")).update(
+                poster_path=film.poster_path,
+            )
+    return updated
+
+
+def tier_rank(preference) -> int:
+    """
+    Sort key for tier order. Films not given a tier yet wait at the bottom,
+    where they were appended.
+    """
+    return TIER_ORDER.index(preference) if preference in TIER_ORDER else len(TIER_ORDER)
+
+
+def _stranded(rows) -> list[int]:
+    """
+    Indexes of the rows that sit below a row of a lower tier.
+    """
+    stranded = []
+    lowest = -1
+    for i, (_, _, preference, _) in enumerate(rows):
+        rank = tier_rank(preference)
+        if rank < lowest:
+            stranded.append(i)
+        lowest = max(lowest, rank)
+    return stranded
+
+
+def _place_by_record(row, kept: list, net: dict) -> tuple[int, bool]:
+    """
+    Index in `kept` (tier-ordered) for a stranded row: just below the last
+    film of its tier it lost to, and above the first one after that it
+    beat. Falls back to the bottom of the tier, reporting it as a guess,
+    when it has no record against any of them.
+    """
+    rank = tier_rank(row[2])
+    top = next((i for i, other in enumerate(kept) if tier_rank(other[2]) >= rank), len(kept))
+    bottom = next((i for i, other in enumerate(kept) if tier_rank(other[2]) > rank), len(kept))
+
+    record = [(i, net.get(kept[i][3], 0)) for i in range(top, bottom)]
+    last_loss = max((i for i, result in record if result < 0), default=None)
+    after = top if last_loss is None else last_loss + 1
+    first_win = next((i for i, result in record if result > 0 and i >= after), None)
+    if first_win is not None:
+        return first_win, False
+    if last_loss is not None:
+        return after, False
+    return bottom, True
+
+
+def repair_positions(user_id: int, start: int = 0) -> tuple[int, int]:
+    """
+    Make positions contiguous and tier-ordered from the `start`-th row (in
+    position order) down. Rows in their tier's block keep their relative
+    order; a row stranded below a lower tier is put back into its own tier
+    by its comparison record (see _place_by_record), which may mean reading
+    back above `start` to the top of that tier. Other rows above `start`
+    are neither read nor written, so the caller must know they are already
+    in order.
+
+    Returns (rows moved, stranded rows placed at the bottom of their tier
+    for want of a comparison record, which may need ranking again).
+    """
+    ordered = UserFilm.objects.filter(user_id=user_id).order_by("position", "id")
+    fields = ("id", "position", "preference", "film_id")
+
+    def read():
+        base = start
+        rows = list(ordered.values_list(*fields)[base:])
+        stranded = _stranded(rows)
+        if stranded:
+            tiers = {rows[i][2] for i in stranded}
+            first = ordered.filter(preference__in=tiers).values_list("position", flat=True).first()
+            reach = ordered.filter(position__lt=first).count()
+            if reach < base:
+                base = reach
+                rows = list(ordered.values_list(*fields)[base:])
+                stranded = _stranded(rows)
+
+        stranded = set(stranded)
+        moving = [row for i, row in enumerate(rows) if i in stranded]
+        kept = [row for i, row in enumerate(rows) if i not in stranded]
+        kept.sort(key=lambda row: tier_rank(row[2]))  # stable: keeps position order within a tier
+
+        net = pairwise.net_wins(user_id, [film_id for _, _, _, film_id in moving]) if moving else {}
+        guessed = 0
+        for row in moving:
+            index, guess = _place_by_record(row, kept, net[row[3]])
+            kept.insert(index, row)
+            guessed += guess
+
+        changes = [(pk, i) for i, (pk, position, _, _) in enumerate(kept, start=base) if position != i]
+        return changes, guessed
+
+    def write(state):
+        changes, guessed = state
+        for pk, i in changes:
+            UserFilm.objects.filter(pk=pk).update(position=i)
+        # a repair isn't a sequence of moves; restart the history from here
+        history.keyframe(user_id)
+        return len(changes), guessed
+
+    if not read()[0]:
+        return 0, 0
+    return edit_list(user_id, read, write)
+
+
+def normalize_positions(user):
+    """
+    Make positions contiguous 0..n-1 and enforce tier order.
+    Rank is truth. Edits go through edit_list() (append_to_list(),
+    place_in_tier(), retier(), ...) and keep the list contiguous, so this is
+    a repair pass rather than part of every placement.
+    """
+    repair_positions(user.id)
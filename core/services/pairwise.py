@@ -0,0 +1,130 @@
+"""
+Pairwise comparison bookkeeping.
+
+Every click is appended to the raw PairwiseComparison log and folded into the
+compacted PairwiseStat table in the same transaction. Anything that needs
+outcomes (rating fits, head-to-head lookups) reads PairwiseStat, which grows
+with the number of distinct pairs rather than the number of clicks, so the
+raw log can be archived without losing information.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import PairwiseComparison, PairwiseStat
+from core.sharding import current_db, user_databases
+
+
+def _ordered(winner_id: int, loser_id: int) -> tuple[int, int, str]:
+    if winner_id < loser_id:
+        return winner_id, loser_id, "wins_a"
+    return loser_id, winner_id, "wins_b"
+
+
+def add_outcome(user_id: int, winner_id: int, loser_id: int, n: int = 1):
+    a, b, field = _ordered(winner_id, loser_id)
+    pair = PairwiseStat.objects.filter(user_id=user_id, film_a_id=a, film_b_id=b)
+
+    bump = {field: F(field) + n, "updated_at": timezone.now()}
+    if pair.update(**bump):
+        return
+
+    try:
+        with transaction.atomic(using=current_db()):
+            PairwiseStat.objects.create(user_id=user_id, film_a_id=a, film_b_id=b, **{field: n})
+    except IntegrityError:
+        # a concurrent request created the row first
+        pair.update(**bump)
+
+
+def record_comparison(user, winner, loser) -> PairwiseComparison:
+    """
+    Log one comparison and update the pair's running totals atomically.
+    """
+    with transaction.atomic(using=current_db()):
+        comparison = PairwiseComparison.objects.create(user=user, winner=winner, loser=loser)
+        add_outcome(user.id, winner.id, loser.id)
+    return comparison
+
+
+def forget_film(user, film):
+    """
+    Drop every comparison (raw and compacted) the user made involving `film`.
+    """
+    with transaction.atomic(using=current_db()):
+        PairwiseComparison.objects.filter(user=user).filter(
+            Q(winner=film) | Q(loser=film)
+        ).delete()
+        PairwiseStat.objects.filter(user=user).filter(
+            Q(film_a=film) | Q(film_b=film)
+        ).delete()
+
+
+def outcomes(**filters):
+    """
+    (winner_id, loser_id, count) triples from the compacted table, in the
+    shape ratings.bt_fit() expects.
+    """
+    rows = (
+        PairwiseStat.objects
+        .filter(**filters)
+        .values_list("film_a_id", "film_b_id", "wins_a", "wins_b")
+    )
+    yield from _expand(rows)
+
+
+def all_outcomes():
+    """
+    outcomes() for every user, across all shards.
+    """
+    for alias in user_databases():
+        rows = PairwiseStat.objects.using(alias).values_list("film_a_id", "film_b_id", "wins_a", "wins_b")
+        yield from _expand(rows)
+
+
+def _expand(rows):
+    for a, b, wins_a, wins_b in rows.iterator(chunk_size=2000):
+        if wins_a:
+            yield a, b, wins_a
+        if wins_b:
+            yield b, a, wins_b
+
+
+def net_wins(user_id: int, film_ids) -> dict[int, dict[int, int]]:
+    """
+    {film_id: {opponent_id: wins - losses}} for each of `film_ids`, from the
+    user's compacted comparisons.
+    """
+    film_ids = set(film_ids)
+    rows = (
+        PairwiseStat.objects
+        .filter(user_id=user_id)
+        .filter(Q(film_a_id__in=film_ids) | Q(film_b_id__in=film_ids))
+        .values_list("film_a_id", "film_b_id", "wins_a", "wins_b")
+    )
+    net = {film_id: {} for film_id in film_ids}
+    for a, b, wins_a, wins_b in rows:
+        if a in net:
+            net[a][b] = wins_a - wins_b
+        if b in net:
+            net[b][a] = wins_b - wins_a
+    return net
+
+
+def head_to_head(user, film) -> list[dict]:
+    """
+    The user's record for `film` against each film it has been compared with.
+    """
+    rows = (
+        PairwiseStat.objects
+        .filter(user=user)
+        .filter(Q(film_a=film) | Q(film_b=film))
+        .values_list("film_a_id", "film_b_id", "wins_a", "wins_b")
+    )
+    record = []
+    for a, b, wins_a, wins_b in rows:
+        if a == film.id:
+            record.append({"opponent_id": b, "wins": wins_a, "losses": wins_b})
+        else:
+            record.append({"opponent_id": a, "wins": wins_b, "losses": wins_a})
+    return record
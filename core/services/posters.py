@@ -0,0 +1,108 @@
+"""
+Local poster thumbnails.
+
+Posters are served from /posters/w<width>/<name> (see views.poster) out of
+an on-disk cache under settings.POSTER_CACHE_DIR. A miss fetches TMDB's own
+pre-sized rendition (w92, w154, ...) once; concurrent misses for the same
+image share that fetch. Only posters of films we store are fetched, so the
+cache can't be filled with arbitrary TMDB images. Files never change for a given TMDB path, so
+responses can be cached by browsers for a year.
+
+settings.TMDB_IMAGE_BASE_URL can point at a local stub server for tests.
+"""
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import requests
+from django.conf import settings
+
+from core.models import Film, UserFilm
+
+from .singleflight import SingleFlight
+
+WIDTHS = (92, 154, 185, 342)
+DEFAULT_WIDTH = 92
+FETCH_TIMEOUT = 8
+
+# TMDB image paths look like "/kqjL17yufvn9OVLyXYpvtyrFfak.jpg"
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}\.(?:jpg|jpeg|png|webp)$")
+
+_fetch_flight = SingleFlight("poster")
+
+
+def coalescing_stats() -> dict:
+    return {"fetch": _fetch_flight.stats()}
+
+
+def poster_name(poster_path: str | None) -> str | None:
+    """
+    The file name part of a TMDB poster_path, or None if it isn't one.
+    """
+    if not poster_path:
+        return None
+    name = poster_path.lstrip("/")
+    return name if _NAME_RE.match(name) else None
+
+
+def is_valid(width: int, name: str) -> bool:
+    return width in WIDTHS and bool(_NAME_RE.match(name))
+
+
+def is_stored(name: str, user=None) -> bool:
+    """
+    Whether a film, or an entry on `user`'s own list, has this poster.
+    """
+    poster_path = f"/{name}"
+    if Film.objects.filter(poster_path=poster_path).exists():
+        return True
+    return (
+        user is not None and user.is_authenticated
+        and UserFilm.objects.filter(user=user, poster_path=poster_path).exists()
+    )
+
+
+def cache_path(width: int, name: str) -> Path:
+    return Path(settings.POSTER_CACHE_DIR) / f"w{width}" / name
+
+
+def _download(width: int, name: str) -> str | None:
+    path = cache_path(width, name)
+    if path.exists():
+        return str(path)
+
+    url = f"{settings.TMDB_IMAGE_BASE_URL.rstrip('/')}/w{width}/{name}"
+    resp = requests.get(url, timeout=FETCH_TIMEOUT)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+
+    # write to a temp file and rename, so readers never see half an image
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(resp.content)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return str(path)
+
+
+def get(width: int, name: str) -> Path | None:
+    """
+    Path of the cached thumbnail, fetching it on a miss. None if TMDB has no
+    such image. Raises requests exceptions if TMDB can't be reached.
+    """
+    path = cache_path(width, name)
+    if path.exists():
+        return path
+    found = _fetch_flight.do(f"{width}:{name}", lambda: _download(width, name))
+    return Path(found) if found else None
+
+
+def etag(path: Path) -> str:
+    stat = path.stat()
+    return f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
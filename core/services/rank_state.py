@@ -0,0 +1,42 @@
+"""
+Binary-search state for placing a film (rank_film), kept in the cache
+rather than the session.
+
+State is keyed by user and target film, so each comparison step costs one
+cache read/write instead of a django_session row update, and a user can
+rank several films in parallel tabs. The candidate films of the tier are
+snapshotted when the search starts; comparisons index into the snapshot
+instead of re-counting and offsetting the tier on every step.
+
+With more than one server process, point ORION_CACHE_BACKEND at a shared
+cache; a lost state just means the film is placed from scratch.
+"""
+from django.core.cache import cache
+
+STATE_SECONDS = 6 * 60 * 60
+
+
+def _key(user_id: int, user_film_id: int) -> str:
+    return f"rank_state:{user_id}:{user_film_id}"
+
+
+def start(user_film, tier: str, candidate_ids) -> dict:
+    """
+    Begin a search over `candidate_ids` (the tier's other films, best first).
+    """
+    candidates = list(candidate_ids)
+    state = {"tier": tier, "candidates": candidates, "lo": 0, "hi": len(candidates)}
+    save(user_film, state)
+    return state
+
+
+def load(user_film) -> dict | None:
+    return cache.get(_key(user_film.user_id, user_film.id))
+
+
+def save(user_film, state: dict):
+    cache.set(_key(user_film.user_id, user_film.id), state, STATE_SECONDS)
+
+
+def clear(user_film):
+    cache.delete(_key(user_film.user_id, user_film.id))
@@ -1,4 +1,5 @@
 import math
+from collections import defaultdict
 
 def elo_to_10(elo: float, midpoint: float = 1500.0, scale: float = 200.0) -> float:
     # logistic curve: midpoint maps to 5.00
@@ -14,4 +15,49 @@ def elo_update(winner: float, loser: float, k: float = 24.0, scale: float = 400.
     return (
         winner + k * (1.0 - e_w),
         loser + k * (0.0 - e_l),
-    )
\ No newline at end of file
+    )
+
+def bt_fit(outcomes, *, iterations: int = 200, prior: float = 0.5, tol: float = 1e-6) -> dict:
+    """
+    Bradley-Terry strengths via the MM algorithm (Hunter, 2004).
+
+    `outcomes` is an iterable of (winner, loser, count). Every item also plays
+    `prior` pseudo-wins and pseudo-losses against a virtual opponent of
+    strength 1, which keeps undefeated / winless items finite.
+    Returns {item: log-strength}, centred on 0.
+    """
+    wins = defaultdict(float)
+    games = defaultdict(lambda: defaultdict(float))
+
+    for winner, loser, count in outcomes:
+        if winner == loser or count <= 0:
+            continue
+        wins[winner] += count
+        wins.setdefault(loser, 0.0)
+        games[winner][loser] += count
+        games[loser][winner] += count
+
+    if not wins:
+        return {}
+
+    strength = {item: 1.0 for item in wins}
+
+    for _ in range(iterations):
+        updated = {}
+        for item, opponents in games.items():
+            denom = 2.0 * prior / (strength[item] + 1.0)
+            for other, n in opponents.items():
+                denom += n / (strength[item] + strength[other])
+            updated[item] = (wins[item] + prior) / denom
+
+        # pin the geometric mean to 1 so the scale doesn't drift
+        log_mean = sum(math.log(v) for v in updated.values()) / len(updated)
+        scale = math.exp(log_mean)
+        updated = {item: v / scale for item, v in updated.items()}
+
+        delta = max(abs(updated[item] - strength[item]) for item in updated)
+        strength = updated
+        if delta < tol:
+            break
+
+    return {item: math.log(v) for item, v in strength.items()}
@@ -0,0 +1,262 @@
+"""
+Item-item "you might like" recommendations.
+
+Every ranked UserFilm becomes a weight in [-1, 1] taken from its tier-banded
+score (10 → +1, 5 → 0, 0 → -1), which gives a sparse user × film matrix.
+Film similarity is the cosine between two film columns. It is computed one
+film at a time through an inverted index, which amounts to a sparse matrix
+product restricted to the rows that film appears in. Pairs that users keep
+finding hard to separate head-to-head get a small bonus on top.
+
+Only each film's top-K neighbors are stored (FilmNeighbor). Serving
+recommendations is then two indexed lookups.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from core.models import Film, FilmAggregate, FilmNeighbor, PairwiseStat, UserFilm
+from core.services.lists import rank_scores
+from core.sharding import user_databases
+
+TOP_K = 20
+MIN_SUPPORT = 2  # users who must have ranked both films
+MAX_FILMS_PER_USER = 300  # keep each user's strongest opinions; bounds the cost of very long lists
+H2H_WEIGHT = 0.1
+SEED_COUNT = 20
+
+
+def _user_vector(entries) -> dict:
+    scores = rank_scores(entries)
+    vector = {film_id: (score - 5.0) / 5.0 for film_id, score in scores.items()}
+    vector = {film_id: w for film_id, w in vector.items() if abs(w) > 0.01}
+    if len(vector) > MAX_FILMS_PER_USER:
+        strongest = sorted(vector, key=lambda film_id: abs(vector[film_id]), reverse=True)
+        vector = {film_id: vector[film_id] for film_id in strongest[:MAX_FILMS_PER_USER]}
+    return vector
+
+
+def _load_matrix():
+    by_user = {}
+    for alias in user_databases():
+        rows = (
+            UserFilm.objects.using(alias)
+            .filter(preference__isnull=False)
+            .order_by("user_id", "position")
+            .values_list("user_id", "film_id", "preference")
+        )
+
+        current, entries = None, []
+        for user_id, film_id, preference in rows.iterator(chunk_size=5000):
+            if user_id != current:
+                if entries:
+                    by_user[current] = _user_vector(entries)
+                current, entries = user_id, []
+            entries.append((film_id, preference))
+        if entries:
+            by_user[current] = _user_vector(entries)
+
+    by_film = defaultdict(list)
+    for user_id, vector in by_user.items():
+        for film_id, w in vector.items():
+            by_film[film_id].append((user_id, w))
+
+    norms = {
+        film_id: math.sqrt(sum(w * w for _, w in column))
+        for film_id, column in by_film.items()
+    }
+    return by_user, by_film, norms
+
+
+def _head_to_head_closeness() -> dict:
+    """
+    {film: {other: closeness}}: 1 for pairs users split evenly on, 0 for
+    one-sided ones, shrunk towards 0 when there are few comparisons.
+    """
+    pairs = defaultdict(lambda: [0, 0])
+    for alias in user_databases():
+        totals = (
+            PairwiseStat.objects.using(alias)
+            .values("film_a_id", "film_b_id")
+            .annotate(wins_a=Sum("wins_a"), wins_b=Sum("wins_b"))
+            .values_list("film_a_id", "film_b_id", "wins_a", "wins_b")
+        )
+        for a, b, wins_a, wins_b in totals.iterator(chunk_size=5000):
+            pairs[a, b][0] += wins_a
+            pairs[a, b][1] += wins_b
+
+    closeness = defaultdict(dict)
+    for (a, b), (wins_a, wins_b) in pairs.items():
+        total = wins_a + wins_b
+        if not total:
+            continue
+        c = (1.0 - abs(wins_a - wins_b) / total) * total / (total + 2.0)
+        closeness[a][b] = closeness[b][a] = c
+    return closeness
+
+
+def _similar(film_id, by_user, by_film, norms, closeness) -> dict[int, tuple[float, int]]:
+    """
+    {other: (score, support)} for every film similar enough to `film_id`
+    to be its neighbor. Symmetric: film_id's score in other's list is the same.
+    """
+    dots = defaultdict(float)
+    support = defaultdict(int)
+    for user_id, w in by_film[film_id]:
+        for other, w_other in by_user[user_id].items():
+            if other != film_id:
+                dots[other] += w * w_other
+                support[other] += 1
+
+    close = closeness.get(film_id, {})
+    similar = {}
+    for other, dot in dots.items():
+        if support[other] < MIN_SUPPORT:
+            continue
+        score = dot / (norms[film_id] * norms[other]) + H2H_WEIGHT * close.get(other, 0.0)
+        if score > 0:
+            similar[other] = (score, support[other])
+    return similar
+
+
+def _top(similar: dict) -> list[tuple[int, float, int]]:
+    scored = [(other, score, n) for other, (score, n) in similar.items()]
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:TOP_K]
+
+
+def _store(film_id, neighbors):
+    with transaction.atomic():
+        FilmNeighbor.objects.filter(film_id=film_id).delete()
+        FilmNeighbor.objects.bulk_create([
+            FilmNeighbor(film_id=film_id, neighbor_id=other, score=score, support=n)
+            for other, score, n in neighbors
+        ])
+
+
+def _refresh_reverse(similar: dict) -> int:
+    """
+    Bring other films' lists up to date with the changed films in `similar`
+    ({changed film: its _similar() map}): a changed film's score in another
+    film's list is replaced, added if it now makes that film's top-K, or
+    dropped. A slot left by a dropped one stays empty until the next full
+    build. Returns how many other films' lists changed.
+    """
+    changed = set(similar)
+    incoming = defaultdict(dict)  # other film -> {changed film: (score, support)}
+    for film_id, others in similar.items():
+        for other, entry in others.items():
+            if other not in changed:
+                incoming[other][film_id] = entry
+    # lists that point at a changed film which is no longer similar enough
+    pointing = FilmNeighbor.objects.filter(neighbor_id__in=changed).exclude(film_id__in=changed)
+    affected = set(incoming) | set(pointing.values_list("film_id", flat=True))
+
+    current = defaultdict(dict)
+    for film_id, other, score, n in (
+        FilmNeighbor.objects.filter(film_id__in=affected).values_list("film_id", "neighbor_id", "score", "support")
+        .iterator(chunk_size=5000)
+    ):
+        current[film_id][other] = (score, n)
+
+    updated = 0
+    for film_id in affected:
+        before = current[film_id]
+        after = {other: entry for other, entry in before.items() if other not in changed}
+        after.update(incoming.get(film_id, {}))
+        neighbors = _top(after)
+        if neighbors != _top(before):
+            _store(film_id, neighbors)
+            updated += 1
+    return updated
+
+
+def build(film_ids=None) -> tuple[int, int]:
+    """
+    Recompute neighbor lists for `film_ids` (default: every ranked film).
+    With `film_ids`, other films' lists are also updated where they hold,
+    or should now hold, one of those films. The whole rating matrix is
+    loaded either way. Returns (films rebuilt, other lists updated).
+    """
+    by_user, by_film, norms = _load_matrix()
+    closeness = _head_to_head_closeness()
+
+    built_at = timezone.now()
+    targets = set(by_film) if film_ids is None else set(film_ids)
+    similar = {}  # kept only for a partial build, to fix up the other lists
+    for film_id in targets:
+        found = _similar(film_id, by_user, by_film, norms, closeness) if film_id in by_film else {}
+        _store(film_id, _top(found))
+        if film_ids is not None:
+            similar[film_id] = found
+
+    updated = 0
+    if film_ids is None:
+        # films nobody ranks any more
+        FilmNeighbor.objects.exclude(film_id__in=targets).delete()
+    else:
+        updated = _refresh_reverse(similar)
+
+    # queryset.update() leaves updated_at alone, so this doesn't mark them stale again
+    built = FilmAggregate.objects.all() if film_ids is None else FilmAggregate.objects.filter(film_id__in=targets)
+    built.update(neighbors_built_at=built_at)
+
+    return len(targets), updated
+
+
+def stale_film_ids() -> list[int]:
+    """
+    Films whose aggregate changed after their neighbor list was last built.
+    """
+    return list(
+        FilmAggregate.objects
+        .filter(Q(neighbors_built_at__isnull=True) | Q(updated_at__gt=F("neighbors_built_at")))
+        .values_list("film_id", flat=True)
+    )
+
+
+def recommend_for(user, limit: int = 10) -> list[dict]:
+    """
+    Films similar to the user's top liked films that aren't on their list yet.
+    """
+    seeds = list(
+        UserFilm.objects
+        .filter(user=user, preference="liked")
+        .order_by("position")
+        .values_list("film_id", flat=True)[:SEED_COUNT]
+    )
+    if not seeds:
+        return []
+
+    # the user's films may live in a shard, so no cross-table subquery here
+    owned = UserFilm.objects.filter(user=user).values_list("film_id", flat=True)
+    edges = (
+        FilmNeighbor.objects
+        .filter(film_id__in=seeds)
+        .exclude(neighbor_id__in=list(owned))
+        .values_list("film_id", "neighbor_id", "score")
+    )
+
+    seed_weight = {film_id: 1.0 / (1.0 + 0.1 * rank) for rank, film_id in enumerate(seeds)}
+    totals = defaultdict(float)
+    because = {}
+    for seed_id, neighbor_id, score in edges:
+        contribution = seed_weight[seed_id] * score
+        totals[neighbor_id] += contribution
+        if contribution > because.get(neighbor_id, (None, 0.0))[1]:
+            because[neighbor_id] = (seed_id, contribution)
+
+    best = sorted(totals, key=totals.get, reverse=True)[:limit]
+    films = Film.objects.in_bulk(set(best) | {because[film_id][0] for film_id in best})
+
+    return [
+        {
+            "film": films[film_id],
+            "score": round(totals[film_id], 3),
+            "because": films[because[film_id][0]],
+        }
+        for film_id in best
+    ]
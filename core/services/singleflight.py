@@ -0,0 +1,213 @@
+"""
+Single-flight request coalescing.
+
+Concurrent calls for the same key share one in-flight fetch:
+
+* in-process, followers wait on the leader thread (or task) and reuse its result;
+* across processes, the leader holds a short lock in the cache backend and
+  publishes its result there, so followers elsewhere poll for it instead of
+  hitting the upstream API themselves.
+
+Cross-process coalescing needs a cache shared between processes (Redis,
+Memcached, database). With the default LocMemCache it degrades to
+in-process coalescing only.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _MISSING
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, namespace: str, *, lock_timeout: float = 15, result_ttl: float = 30,
+                 wait_timeout: float = 10, poll_interval: float = 0.05):
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = weakref.WeakKeyDictionary()  # event loop -> {key: Future}
+        self._stats = {
+            "calls": 0,
+            "fetched": 0,
+            "coalesced_local": 0,
+            "coalesced_remote": 0,
+            "fallbacks": 0,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _cache_keys(self, key) -> tuple[str, str]:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return (
+            f"singleflight:{self.namespace}:lock:{digest}",
+            f"singleflight:{self.namespace}:result:{digest}",
+        )
+
+    # ---- sync ----
+
+    def do(self, key, fn):
+        """
+        Return fn(), sharing the result with every concurrent caller using `key`.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # a leader that hangs or dies without a result (a BaseException
+            # such as KeyboardInterrupt) leaves the follower to fetch itself
+            if call.done.wait(self.lock_timeout) and (call.value is not _MISSING or call.error is not None):
+                self._count("coalesced_local")
+                if call.error is not None:
+                    raise call.error
+                return call.value
+            self._count("fallbacks")
+            self._count("fetched")
+            return fn()
+
+        try:
+            call.value = self._fetch_shared(key, fn)
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+        return call.value
+
+    def _fetch_shared(self, key, fn):
+        lock_key, result_key = self._cache_keys(key)
+
+        value = cache.get(result_key, _MISSING)
+        if value is not _MISSING:
+            self._count("coalesced_remote")
+            return value
+
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, self.lock_timeout):
+            try:
+                self._count("fetched")
+                value = fn()
+                cache.set(result_key, value, self.result_ttl)
+                return value
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        # another process is fetching; wait for it to publish
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = cache.get(result_key, _MISSING)
+            if value is not _MISSING:
+                self._count("coalesced_remote")
+                return value
+            if cache.get(lock_key) is None:
+                break  # leader gave up without a result
+
+        self._count("fallbacks")
+        self._count("fetched")
+        return fn()
+
+    # ---- async ----
+
+    async def ado(self, key, coro_fn):
+        """
+        Async twin of do(); `coro_fn` is a zero-argument coroutine function.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._stats["calls"] += 1
+            inflight = self._async_calls.setdefault(loop, {})
+            future = inflight.get(key)
+            leader = future is None
+            if leader:
+                future = inflight[key] = loop.create_future()
+
+        if not leader:
+            # asyncio.wait neither cancels the shared future on timeout nor
+            # raises when the leader cancelled it; in both cases fetch here
+            done, _ = await asyncio.wait({future}, timeout=self.lock_timeout)
+            if done and not future.cancelled():
+                self._count("coalesced_local")
+                return future.result()
+            self._count("fallbacks")
+            self._count("fetched")
+            return await coro_fn()
+
+        try:
+            value = await self._afetch_shared(key, coro_fn)
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                inflight.pop(key, None)
+            if not future.done():
+                # the leader itself was cancelled: release the followers
+                future.cancel()
+
+    async def _afetch_shared(self, key, coro_fn):
+        lock_key, result_key = self._cache_keys(key)
+
+        value = await cache.aget(result_key, _MISSING)
+        if value is not _MISSING:
+            self._count("coalesced_remote")
+            return value
+
+        token = uuid.uuid4().hex
+        if await cache.aadd(lock_key, token, self.lock_timeout):
+            try:
+                self._count("fetched")
+                value = await coro_fn()
+                await cache.aset(result_key, value, self.result_ttl)
+                return value
+            finally:
+                if await cache.aget(lock_key) == token:
+                    await cache.adelete(lock_key)
+
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            value = await cache.aget(result_key, _MISSING)
+            if value is not _MISSING:
+                self._count("coalesced_remote")
+                return value
+            if await cache.aget(lock_key) is None:
+                break
+
+        self._count("fallbacks")
+        self._count("fetched")
+        return await coro_fn()
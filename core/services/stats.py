@@ -0,0 +1,256 @@
+"""
+Per-user numbers for the stats page: average score by director, films per
+decade and the tier split over time.
+
+They live in small aggregate rows (UserDirectorStat, UserDecadeStat,
+UserTierDay) kept current by the list write paths, the same way
+FilmAggregate is for the leaderboard:
+
+* adding a film counts it towards its decade;
+* giving it its first tier counts it for its director; every tier change
+  moves the day's tier split;
+* every Elo change moves the director's score_sum by the change in score10;
+* removing a film takes its share back out;
+* a director that arrives later from TMDB credits every ranked row of
+  that film.
+
+The hooks run inside the list edit's transaction (edit_list's write, or
+the comparison's atomic block in rank_film), with the user's shard
+selected. They read the film's director from the database rather than
+from the instance they are given, which may predate a director lookup
+that landed since. rebuild() recomputes a user's rows from their list and rank
+history (backfill / repair, `manage.py rebuild_user_stats`).
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from core.models import Film, UserDecadeStat, UserDirectorStat, UserFilm, UserTierDay
+from core.services import history
+from core.services.lists import TIER_ORDER
+from core.services.ratings import elo_to_10
+from core.sharding import current_db, use_shard, user_databases
+
+TIER_FIELDS = tuple(f"{tier}_count" for tier in TIER_ORDER)
+
+
+def _decade(year):
+    return year // 10 * 10 if year else None
+
+
+def _updates(deltas: dict) -> dict:
+    # counts never go below zero, even for rows that predate a backfill
+    return {
+        field: Greatest(F(field) + delta, 0) if isinstance(delta, int) else F(field) + delta
+        for field, delta in deltas.items() if delta
+    }
+
+
+def _bump(model, lookup: dict, **deltas):
+    updates = _updates(deltas)
+    if not updates:
+        return
+
+    rows = model.objects.filter(**lookup)
+    if rows.update(**updates) or any(delta < 0 for delta in deltas.values()):
+        return
+
+    try:
+        with transaction.atomic(using=current_db()):
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        rows.update(**updates)
+
+
+def _bump_tier_day(user_id: int, **deltas):
+    updates = _updates(deltas)
+    if not updates:
+        return
+
+    today = timezone.localdate()
+    days = UserTierDay.objects.filter(user_id=user_id)
+    if days.filter(day=today).update(**updates):
+        return
+
+    # first change today: start from the last recorded split
+    carried = days.filter(day__lt=today).order_by("-day").values(*TIER_FIELDS).first() or dict.fromkeys(TIER_FIELDS, 0)
+    try:
+        with transaction.atomic(using=current_db()):
+            UserTierDay.objects.create(
+                user_id=user_id, day=today,
+                **{field: max(carried[field] + deltas.get(field, 0), 0) for field in TIER_FIELDS},
+            )
+    except IntegrityError:
+        days.filter(day=today).update(**updates)
+
+
+def _director(user_film) -> str | None:
+    return Film.objects.filter(pk=user_film.film_id).values_list("director", flat=True).first()
+
+
+def on_added(user_film):
+    decade = _decade(user_film.film.year)
+    if decade is not None:
+        _bump(UserDecadeStat, {"user_id": user_film.user_id, "decade": decade}, count=1)
+
+
+def on_tier_set(user_film, old_tier: str | None):
+    """
+    Call after user_film.preference has been saved.
+    """
+    new_tier = user_film.preference
+    if old_tier == new_tier:
+        return
+
+    deltas = {f"{new_tier}_count": 1}
+    if old_tier is None:
+        director = _director(user_film)
+        if director:
+            _bump(
+                UserDirectorStat, {"user_id": user_film.user_id, "director": director},
+                num_ranked=1, score_sum=elo_to_10(user_film.elo),
+            )
+    else:
+        deltas[f"{old_tier}_count"] = -1
+    _bump_tier_day(user_film.user_id, **deltas)
+
+
+def on_elo_change(user_film, old_elo: float):
+    if user_film.preference is None:
+        return
+    director = _director(user_film)
+    if director:
+        UserDirectorStat.objects.filter(user_id=user_film.user_id, director=director).update(
+            score_sum=F("score_sum") + (elo_to_10(user_film.elo) - elo_to_10(old_elo)),
+        )
+
+
+def on_removed(user_film):
+    film = user_film.film
+    decade = _decade(film.year)
+    if decade is not None:
+        _bump(UserDecadeStat, {"user_id": user_film.user_id, "decade": decade}, count=-1)
+
+    if user_film.preference is None:
+        return
+    director = _director(user_film)
+    if director:
+        _bump(
+            UserDirectorStat, {"user_id": user_film.user_id, "director": director},
+            num_ranked=-1, score_sum=-elo_to_10(user_film.elo),
+        )
+    _bump_tier_day(user_film.user_id, **{f"{user_film.preference}_count": -1})
+
+
+def on_director_set(film_id: int, director: str):
+    """
+    Credit `director` for every ranked row of a film whose director was
+    unknown until now.
+    """
+    for alias in user_databases():
+        ranked = (
+            UserFilm.objects.using(alias)
+            .filter(film_id=film_id, preference__isnull=False)
+            .values_list("user_id", "elo")
+        )
+        for user_id, elo in ranked:
+            with use_shard(alias, user_id):
+                _bump(
+                    UserDirectorStat, {"user_id": user_id, "director": director},
+                    num_ranked=1, score_sum=elo_to_10(elo),
+                )
+
+
+def _tier_days(user_id: int, current: tuple) -> list[tuple]:
+    """
+    (day, split) for every day the split changed, replayed from the rank
+    history and ending with today's actual split.
+    """
+    by_day = {}
+    for event, entries in history.replay(user_id):
+        counts = Counter(preference for _, preference in entries)
+        by_day[timezone.localdate(event.created_at)] = tuple(counts[tier] for tier in TIER_ORDER)
+    if not by_day or by_day[max(by_day)] != current:
+        by_day[timezone.localdate()] = current
+
+    days = []
+    for day, split in sorted(by_day.items()):
+        if not days or days[-1][1] != split:
+            days.append((day, split))
+    return days
+
+
+def rebuild(user_id: int):
+    """
+    Recompute one user's stats rows from scratch. Run with the user's shard
+    selected.
+    """
+    rows = list(UserFilm.objects.filter(user_id=user_id).values_list("film_id", "preference", "elo"))
+    films = {
+        film_id: (year, director)
+        for film_id, year, director in (
+            Film.objects.filter(id__in=[film_id for film_id, _, _ in rows]).values_list("id", "year", "director")
+        )
+    }
+
+    decades = Counter()
+    directors = {}
+    tiers = Counter()
+    for film_id, preference, elo in rows:
+        year, director = films.get(film_id, (None, None))
+        if year:
+            decades[_decade(year)] += 1
+        if preference is None:
+            continue
+        tiers[preference] += 1
+        if director:
+            num_ranked, score_sum = directors.get(director, (0, 0.0))
+            directors[director] = (num_ranked + 1, score_sum + elo_to_10(elo))
+
+    days = _tier_days(user_id, tuple(tiers[tier] for tier in TIER_ORDER))
+
+    with transaction.atomic(using=current_db()):
+        for model in (UserDecadeStat, UserDirectorStat, UserTierDay):
+            model.objects.filter(user_id=user_id).delete()
+        UserDecadeStat.objects.bulk_create(
+            [UserDecadeStat(user_id=user_id, decade=decade, count=count) for decade, count in decades.items()],
+        )
+        UserDirectorStat.objects.bulk_create(
+            [
+                UserDirectorStat(user_id=user_id, director=director, num_ranked=num_ranked, score_sum=score_sum)
+                for director, (num_ranked, score_sum) in directors.items()
+            ],
+            batch_size=500,
+        )
+        UserTierDay.objects.bulk_create(
+            [UserTierDay(user_id=user_id, day=day, **dict(zip(TIER_FIELDS, split))) for day, split in days],
+            batch_size=500,
+        )
+
+
+def top_directors(user_id: int, limit: int = 10) -> list:
+    return list(
+        UserDirectorStat.objects
+        .filter(user_id=user_id, num_ranked__gt=0)
+        .order_by((F("score_sum") / F("num_ranked")).desc(), "-num_ranked", "director")[:limit]
+    )
+
+
+def decade_counts(user_id: int) -> list[tuple[int, int]]:
+    return list(
+        UserDecadeStat.objects
+        .filter(user_id=user_id, count__gt=0)
+        .order_by("decade")
+        .values_list("decade", "count")
+    )
+
+
+def tier_history(user_id: int, limit: int = 30) -> list:
+    """
+    The last `limit` days the tier split changed, oldest first.
+    """
+    days = UserTierDay.objects.filter(user_id=user_id).order_by("-day")[:limit]
+    return list(reversed(days))
@@ -0,0 +1,121 @@
+"""
+Taste similarity between users: rank correlation over the films both users
+have on their lists, in list order.
+
+Kendall's tau is computed from a merge-sort inversion count, O(n log n) per
+pair, rather than by checking every pair of films. Per-pair results are cached
+under both users' list versions, so any change to either list invalidates them.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from core.models import TasteNeighbor, UserFilm
+from core.services.lists import list_versions
+from core.sharding import shard_for_user
+
+CACHE_SECONDS = 24 * 60 * 60
+SHRINK = 10  # overlap at which a pair's tau counts for half in neighbor ordering
+
+
+def count_inversions(seq) -> int:
+    """
+    Number of pairs i < j with seq[i] > seq[j] (bottom-up merge sort).
+    """
+    items = list(seq)
+    n = len(items)
+    buffer = [None] * n
+    inversions = 0
+    width = 1
+    while width < n:
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            i, j, k = lo, mid, lo
+            while i < mid and j < hi:
+                if items[j] < items[i]:
+                    buffer[k] = items[j]
+                    inversions += mid - i
+                    j += 1
+                else:
+                    buffer[k] = items[i]
+                    i += 1
+                k += 1
+            buffer[k:hi] = items[i:mid] if i < mid else items[j:hi]
+        items, buffer = buffer, items
+        width *= 2
+    return inversions
+
+
+def correlation(ranks_a: dict, ranks_b: dict) -> dict:
+    """
+    Kendall tau and Spearman rho between two {film_id: rank} maps, over the
+    films they share. Ranks only need to be ordered, not contiguous.
+    """
+    if len(ranks_b) < len(ranks_a):
+        shared = [film_id for film_id in ranks_b if film_id in ranks_a]
+    else:
+        shared = [film_id for film_id in ranks_a if film_id in ranks_b]
+
+    n = len(shared)
+    if n < 2:
+        return {"tau": None, "rho": None, "overlap": n}
+
+    # re-rank both sides 0..n-1 over the shared films only
+    shared.sort(key=ranks_a.__getitem__)
+    b_order = sorted(range(n), key=lambda i: ranks_b[shared[i]])
+    b_rank = [0] * n
+    for rank, i in enumerate(b_order):
+        b_rank[i] = rank
+
+    pairs = n * (n - 1) // 2
+    tau = 1.0 - 2.0 * count_inversions(b_rank) / pairs
+    d2 = sum((i - b_rank[i]) ** 2 for i in range(n))
+    rho = 1.0 - 6.0 * d2 / (n * (n * n - 1))
+
+    return {"tau": round(tau, 4), "rho": round(rho, 4), "overlap": n}
+
+
+def ranks_for(user_id: int) -> dict:
+    return dict(
+        UserFilm.objects.using(shard_for_user(user_id))
+        .filter(user_id=user_id)
+        .values_list("film_id", "position")
+    )
+
+
+def taste_match(user_a, user_b) -> dict:
+    """
+    Cached correlation between two users' lists.
+    """
+    a, b = sorted((user_a.id, user_b.id))
+    versions = list_versions([a, b])
+    key = f"taste:{a}:{b}:{versions[a]}:{versions[b]}"
+    return cache.get_or_set(key, lambda: correlation(ranks_for(a), ranks_for(b)), CACHE_SECONDS)
+
+
+def shrunk_score(tau: float, overlap: int) -> float:
+    return tau * overlap / (overlap + SHRINK)
+
+
+def similar_users(user, limit: int = 10):
+    return (
+        TasteNeighbor.objects
+        .filter(user=user)
+        .select_related("other")
+        .order_by("-score")[:limit]
+    )
+
+
+def store_neighbors(user_id: int, neighbors):
+    """
+    Replace a user's precomputed neighbors with (other_id, tau, overlap) rows.
+    """
+    with transaction.atomic():
+        TasteNeighbor.objects.filter(user_id=user_id).delete()
+        TasteNeighbor.objects.bulk_create([
+            TasteNeighbor(
+                user_id=user_id, other_id=other_id, tau=tau, overlap=overlap,
+                score=shrunk_score(tau, overlap),
+            )
+            for other_id, tau, overlap in neighbors
+        ])
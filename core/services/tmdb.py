@@ -1,47 +1,74 @@
 from django.conf import settings
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
 import requests
-from functools import lru_cache
 
-TMDB_SEARCH_URL = "https://api.themoviedb.org/3/search/movie"
-TMDB_CREDITS_URL = "https://api.themoviedb.org/3/movie/{movie_id}/credits"
+from .singleflight import SingleFlight
 
-@lru_cache(maxsize=512)
-def get_director(movie_id: int) -> str | None:
-    if not settings.TMDB_API_KEY:
-        raise RuntimeError("TMDB_API_KEY is not set in Django settings.")
+TMDB_SEARCH_PATH = "/search/movie"
+TMDB_CREDITS_PATH = "/movie/{movie_id}/credits"
+TMDB_TIMEOUT = 8
 
-    url = TMDB_CREDITS_URL.format(movie_id=movie_id)
-    resp = requests.get(url, params={"api_key": settings.TMDB_API_KEY}, timeout=8)
-    resp.raise_for_status()
-    data = resp.json()
+# directors never change, so keep a small process-wide cache shared by the
+# sync and async clients
+_DIRECTOR_CACHE_SIZE = 512
+_director_cache = OrderedDict()
+_director_cache_lock = threading.Lock()
+_MISSING = object()
+
+# identical concurrent lookups (e.g. everyone searching for a new release)
+# share a single upstream request
+_search_flight = SingleFlight("tmdb-search")
+_director_flight = SingleFlight("tmdb-director")
+
+
+def coalescing_stats() -> dict:
+    return {
+        "search": _search_flight.stats(),
+        "director": _director_flight.stats(),
+    }
 
+
+def _cached_director(movie_id: int):
+    with _director_cache_lock:
+        if movie_id in _director_cache:
+            _director_cache.move_to_end(movie_id)
+            return _director_cache[movie_id]
+    return _MISSING
+
+
+def _remember_director(movie_id: int, director: str | None):
+    with _director_cache_lock:
+        _director_cache[movie_id] = director
+        _director_cache.move_to_end(movie_id)
+        while len(_director_cache) > _DIRECTOR_CACHE_SIZE:
+            _director_cache.popitem(last=False)
+
+
+def _director_from_credits(data: dict) -> str | None:
     for person in data.get("crew", []):
         if person.get("job") == "Director":
             return person.get("name")
-
     return None
 
-def search_movies(query: str, year: int | None = None, *, limit: int = 8) -> list[dict]:
-    query = (query or "").strip()
-    if len(query) < 2:
-        return []
-    
-    if not settings.TMDB_API_KEY:
-            raise RuntimeError("TMDB_API_KEY is not set in Django settings")
-    
+
+def _search_params(query: str, year: int | None) -> dict:
     params = {
          "api_key": settings.TMDB_API_KEY,
          "query": query,
-         "include_adult": "false", 
+         "include_adult": "false",
          "language": "en-US",
     }
     if year:
         params["year"] = year
-    
-    resp = requests.get(TMDB_SEARCH_URL, params=params, timeout=8)
-    resp.raise_for_status()
-    data = resp.json()
+    return params
 
+
+def _parse_search_results(data: dict, limit: int) -> list[dict]:
     results = []
     for item in data.get("results", [])[:limit]:
         title = item.get("title")
@@ -61,4 +88,91 @@ def search_movies(query: str, year: int | None = None, *, limit: int = 8) -> lis
              "poster_path": poster_path,
         })
 
-    return results
\ No newline at end of file
+    return results
+
+
+def get_director(movie_id: int) -> str | None:
+    cached = _cached_director(movie_id)
+    if cached is not _MISSING:
+        return cached
+
+    if not settings.TMDB_API_KEY:
+        raise RuntimeError("TMDB_API_KEY is not set in Django settings.")
+
+    def fetch():
+        url = settings.TMDB_API_BASE_URL + TMDB_CREDITS_PATH.format(movie_id=movie_id)
+        resp = requests.get(url, params={"api_key": settings.TMDB_API_KEY}, timeout=TMDB_TIMEOUT)
+        resp.raise_for_status()
+        return _director_from_credits(resp.json())
+
+    director = _director_flight.do(movie_id, fetch)
+    _remember_director(movie_id, director)
+    return director
+
+def search_movies(query: str, year: int | None = None, *, limit: int = 8) -> list[dict]:
+    query = (query or "").strip()
+    if len(query) < 2:
+        return []
+
+    if not settings.TMDB_API_KEY:
+            raise RuntimeError("TMDB_API_KEY is not set in Django settings")
+
+    def fetch():
+        resp = requests.get(settings.TMDB_API_BASE_URL + TMDB_SEARCH_PATH, params=_search_params(query, year), timeout=TMDB_TIMEOUT)
+        resp.raise_for_status()
+        return _parse_search_results(resp.json(), limit)
+
+    return _search_flight.do((query.lower(), year, limit), fetch)
+
+
+# ---- async client ----
+# One pooled AsyncClient per event loop: connections are bound to the loop
+# that opened them, so a client can't be shared across loops.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=TMDB_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def aget_director(movie_id: int) -> str | None:
+    cached = _cached_director(movie_id)
+    if cached is not _MISSING:
+        return cached
+
+    if not settings.TMDB_API_KEY:
+        raise RuntimeError("TMDB_API_KEY is not set in Django settings.")
+
+    async def fetch():
+        url = settings.TMDB_API_BASE_URL + TMDB_CREDITS_PATH.format(movie_id=movie_id)
+        resp = await _async_client().get(url, params={"api_key": settings.TMDB_API_KEY})
+        resp.raise_for_status()
+        return _director_from_credits(resp.json())
+
+    director = await _director_flight.ado(movie_id, fetch)
+    _remember_director(movie_id, director)
+    return director
+
+
+async def asearch_movies(query: str, year: int | None = None, *, limit: int = 8) -> list[dict]:
+    query = (query or "").strip()
+    if len(query) < 2:
+        return []
+
+    if not settings.TMDB_API_KEY:
+        raise RuntimeError("TMDB_API_KEY is not set in Django settings")
+
+    async def fetch():
+        resp = await _async_client().get(settings.TMDB_API_BASE_URL + TMDB_SEARCH_PATH, params=_search_params(query, year))
+        resp.raise_for_status()
+        return _parse_search_results(resp.json(), limit)
+
+    return await _search_flight.ado((query.lower(), year, limit), fetch)
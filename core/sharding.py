@@ -0,0 +1,216 @@
+"""
+Opt-in user sharding (ORION_SHARDS=N).
+
+Each user's list data (UserFilm, PairwiseComparison, PairwiseStat,
+ListVersion, RankEvent and the per-user stats rows) lives in one shard
+database (shard0..shardN-1), so placements by
+different users don't queue on one SQLite write lock. Films, users, sessions,
+jobs and site-wide aggregates stay in "default", the catalog.
+
+Which shard a user lives on is recorded in the UserShard directory (catalog).
+New users are placed by a hash of their id. `manage.py rebalance_shards` moves
+users whose directory entry no longer matches the hash, e.g. after N changes.
+
+Queries on sharded models go to the shard selected for the current context:
+user_shard_middleware selects the signed-in user's shard for each request, and
+jobs/commands use `use_user_shard(user_id)` or `use_shard(alias)`. Sharded
+querysets can't join to catalog tables, so load films with with_film() rather
+than select_related("film").
+
+With sharding off, every helper here resolves to "default" and the router
+stays out of the way.
+"""
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connections
+from django.utils.decorators import sync_and_async_middleware
+
+SHARDED_MODELS = frozenset({
+    "userfilm", "pairwisecomparison", "pairwisestat", "listversion", "rankevent",
+    "userdirectorstat", "userdecadestat", "usertierday",
+})
+
+# (user_id or None, alias) for the code currently running
+_current = ContextVar("orion_user_shard", default=None)
+
+
+def shards() -> list[str]:
+    return getattr(settings, "USER_SHARDS", [])
+
+
+def enabled() -> bool:
+    return bool(shards())
+
+
+def user_databases() -> list[str]:
+    """
+    Every database that holds per-user rows.
+    """
+    return shards() or ["default"]
+
+
+def is_sharded(model) -> bool:
+    return model._meta.app_label == "core" and model._meta.model_name in SHARDED_MODELS
+
+
+def hashed_shard(user_id: int) -> str:
+    names = shards()
+    return names[zlib.crc32(str(user_id).encode()) % len(names)]
+
+
+def shard_for_user(user_id: int) -> str:
+    if not enabled():
+        return "default"
+
+    current = _current.get()
+    if current is not None and current[0] == user_id:
+        return current[1]
+
+    from core.models import UserShard
+
+    alias = (
+        UserShard.objects.using("default")
+        .filter(user_id=user_id)
+        .values_list("alias", flat=True)
+        .first()
+    )
+    if alias is None:
+        alias = hashed_shard(user_id)
+        try:
+            UserShard.objects.using("default").create(user_id=user_id, alias=alias)
+        except IntegrityError:
+            alias = UserShard.objects.using("default").get(user_id=user_id).alias
+    return alias
+
+
+def current_db() -> str:
+    """
+    Alias holding the current user's rows, e.g. for transaction.atomic(using=...).
+    """
+    current = _current.get()
+    return current[1] if current is not None else "default"
+
+
+@contextmanager
+def use_shard(alias: str, user_id: int | None = None):
+    token = _current.set((user_id, alias))
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def use_user_shard(user_id: int):
+    with use_shard(shard_for_user(user_id), user_id) as alias:
+        yield alias
+
+
+def group_by_shard(user_ids) -> dict:
+    grouped = {}
+    for user_id in user_ids:
+        grouped.setdefault(shard_for_user(user_id), []).append(user_id)
+    return grouped
+
+
+def with_film(queryset):
+    """
+    select_related("film") when films live in the same database, otherwise a
+    prefetch (one extra query against the catalog).
+    """
+    if enabled():
+        return queryset.prefetch_related("film")
+    return queryset.select_related("film")
+
+
+def seed_id_ranges(alias: str):
+    """
+    Start each shard's auto-increment ids in their own range so rows keep
+    their ids when a user moves between shards (and stay clear of ids created
+    in "default" before sharding was switched on).
+    """
+    from django.apps import apps
+
+    index = shards().index(alias)
+    floor = (index + 1) * 2 ** 40
+    with connections[alias].cursor() as cursor:
+        for model in apps.get_app_config("core").get_models():
+            if not is_sharded(model) or not model._meta.pk.get_internal_type().endswith("AutoField"):
+                continue
+            table = model._meta.db_table
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, floor])
+            elif row[0] < floor:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [floor, table])
+
+
+class UserShardRouter:
+    def _db(self, model, hints):
+        if not enabled():
+            return None
+
+        instance = hints.get("instance")
+        if not is_sharded(model):
+            # e.g. user_film.film: Django would otherwise look for the film
+            # in the shard the user_film came from
+            if instance is not None and instance._state.db in shards():
+                return "default"
+            return None
+
+        if instance is not None and instance._state.db in shards():
+            return instance._state.db
+
+        current = _current.get()
+        if current is None:
+            raise RuntimeError(
+                f"No user shard selected for {model.__name__}; "
+                "wrap the code in core.sharding.use_user_shard(user_id)."
+            )
+        return current[1]
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if enabled() and {obj1._state.db, obj2._state.db} <= {"default", *shards()}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in shards():
+            return None
+        # shards only carry the per-user tables
+        return app_label == "core" and model_name in SHARDED_MODELS
+
+
+@sync_and_async_middleware
+def user_shard_middleware(get_response):
+    """
+    Route the signed-in user's list queries to their shard for this request.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not enabled():
+                return await get_response(request)
+            user = await request.auser()
+            if not user.is_authenticated:
+                return await get_response(request)
+            alias = await sync_to_async(shard_for_user)(user.id)
+            with use_shard(alias, user.id):
+                return await get_response(request)
+    else:
+        def middleware(request):
+            if not enabled() or not request.user.is_authenticated:
+                return get_response(request)
+            with use_user_shard(request.user.id):
+                return get_response(request)
+    return middleware
@@ -0,0 +1,18 @@
+from django import template
+from django.urls import reverse
+
+from core.services.posters import DEFAULT_WIDTH, WIDTHS, poster_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def poster_url(poster_path, width=DEFAULT_WIDTH):
+    """
+    {% poster_url film.poster_path 154 %} -> local thumbnail URL, or "" when
+    the film has no (valid) poster.
+    """
+    name = poster_name(poster_path)
+    if name is None or width not in WIDTHS:
+        return ""
+    return reverse("poster", kwargs={"width": width, "name": name})
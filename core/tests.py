@@ -1,3 +1,1550 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import itertools
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connections
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core import admin
+from core.models import (
+    Film, FilmAggregate, FilmNeighbor, Job, ListVersion, PairwiseComparison, PairwiseStat, RankEvent, UserDecadeStat,
+    UserDirectorStat, UserFilm, UserShard, UserTierDay,
+)
+from core.management.commands import check_lists
+from core.management.commands.rebalance_shards import USER_MODELS
+from core.routers import PIN_COOKIE
+from core.services import history, leaderboard, posters, recommendations, stats
+from core.services.jobs import PRIORITY_HIGH, claim, enqueue, handler, requeue_stale, run_job
+from core.services.lists import (
+    ListConflict, append_to_list, bump_list_version, edit_list, list_version, move_to, place_in_tier,
+    rank_scores, remove_from_list, retier, tier_start,
+)
+from core.services.pairwise import add_outcome, head_to_head, net_wins, record_comparison
+from core.services.ratings import bt_fit
+from core.services.singleflight import SingleFlight
+from core.services.taste import correlation, count_inversions
+from core.sharding import hashed_shard, seed_id_ranges, use_user_shard, with_film
+
+_calls = []
+
+
+@handler("test_record")
+def _record(value, fail=False):
+    _calls.append(value)
+    if fail:
+        raise RuntimeError("boom")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        _calls.clear()
+
+    def test_claim_takes_highest_priority_runnable_job_once(self):
+        low = enqueue("test_record", {"value": "low"})
+        high = enqueue("test_record", {"value": "high"}, priority=PRIORITY_HIGH)
+        enqueue("test_record", {"value": "later"}, priority=PRIORITY_HIGH * 2, delay=60)
+
+        job = claim("w1")
+        self.assertEqual(job.pk, high.pk)
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Job.RUNNING, "w1", 1))
+        self.assertEqual(claim("w2").pk, low.pk)
+        self.assertIsNone(claim("w3"))
+
+    def test_claim_by_id_skips_jobs_already_taken(self):
+        job = enqueue("test_record", {"value": 1})
+        self.assertIsNotNone(claim("w1", job_ids=[job.pk]))
+        self.assertIsNone(claim("w2", job_ids=[job.pk]))
+
+    def test_success_deletes_the_job(self):
+        enqueue("test_record", {"value": 1})
+        self.assertTrue(run_job(claim("w1")))
+        self.assertEqual(_calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failure_requeues_with_backoff_until_attempts_run_out(self):
+        job = enqueue("test_record", {"value": 1, "fail": True}, max_attempts=2)
+
+        with self.assertLogs("core.services.jobs", "ERROR"):
+            self.assertFalse(run_job(claim("w1")))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(claim("w1"))  # not due yet
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs("core.services.jobs", "ERROR"):
+            self.assertFalse(run_job(claim("w1")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_unknown_kind_fails(self):
+        enqueue("test_no_such_kind", max_attempts=1)
+        with self.assertLogs("core.services.jobs", "ERROR"):
+            self.assertFalse(run_job(claim("w1")))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_dedup_key_returns_waiting_job_and_raises_its_priority(self):
+        first = enqueue("test_record", {"value": 1}, dedup_key="k")
+        second = enqueue("test_record", {"value": 2}, dedup_key="k", priority=PRIORITY_HIGH)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.get().priority, PRIORITY_HIGH)
+
+    def test_dedup_key_queues_behind_a_running_job(self):
+        running = claim("w1", job_ids=[enqueue("test_record", {"value": 1}, dedup_key="k").pk])
+        queued = enqueue("test_record", {"value": 2}, dedup_key="k")
+        self.assertNotEqual(running.pk, queued.pk)
+
+        # the failed run gives way to the waiting one instead of queueing twice
+        Job.objects.filter(pk=running.pk).update(payload={"value": 1, "fail": True})
+        running.refresh_from_db()
+        with self.assertLogs("core.services.jobs", "ERROR"):
+            run_job(running)
+        self.assertEqual(list(Job.objects.values_list("pk", flat=True)), [queued.pk])
+
+    def test_requeue_stale_puts_back_abandoned_jobs(self):
+        job = claim("w1", job_ids=[enqueue("test_record", {"value": 1}).pk])
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(timedelta(minutes=5)), 1)
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+
+def make_list(user, entries):
+    """
+    Give `user` a list of (title, preference) entries, in order.
+    """
+    return [
+        UserFilm.objects.create(user=user, film=Film.objects.create(title=title), position=i, preference=preference)
+        for i, (title, preference) in enumerate(entries)
+    ]
+
+
+def titles(user):
+    return list(
+        UserFilm.objects.filter(user=user).order_by("position").values_list("film__title", "position", "preference")
+    )
+
+
+class EditListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+
+    def test_write_claims_the_next_version(self):
+        self.assertEqual(edit_list(self.user.id, lambda: "state", lambda state: state.upper()), "STATE")
+        self.assertEqual(list_version(self.user.id), 1)
+        edit_list(self.user.id, lambda: None, lambda state: None)
+        self.assertEqual(list_version(self.user.id), 2)
+
+    def test_retries_on_fresh_data_when_the_list_changed_since_read(self):
+        reads = []
+
+        def read():
+            reads.append(list_version(self.user.id))
+            if len(reads) == 1:
+                bump_list_version(self.user.id)  # another request's edit lands in between
+            return len(reads)
+
+        self.assertEqual(edit_list(self.user.id, read, lambda state: state), 2)
+        self.assertEqual(reads, [0, 1])
+        self.assertEqual(list_version(self.user.id), 2)
+
+    def test_gives_up_with_list_conflict(self):
+        writes = []
+
+        def read():
+            bump_list_version(self.user.id)
+
+        with self.assertRaises(ListConflict):
+            edit_list(self.user.id, read, writes.append, attempts=3)
+        self.assertEqual(writes, [])
+        self.assertEqual(ListVersion.objects.get(user=self.user).version, 3)
+
+
+class PositionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+
+    def test_tier_start(self):
+        a, b, c = make_list(self.user, [("A", "liked"), ("B", "ok"), ("C", "disliked")])
+        self.assertEqual(tier_start(self.user.id, "liked"), 0)
+        self.assertEqual(tier_start(self.user.id, "ok"), 1)
+        self.assertEqual(tier_start(self.user.id, "disliked"), 2)
+        # A leaving its slot pulls the tier boundaries up
+        self.assertEqual(tier_start(self.user.id, "disliked", moving=a), 1)
+        # C is below the boundary, so its leaving doesn't move it
+        self.assertEqual(tier_start(self.user.id, "ok", moving=c), 1)
+
+    def test_move_to_shifts_only_the_rows_between(self):
+        a, b, c, d = make_list(self.user, [("A", "ok"), ("B", "ok"), ("C", "ok"), ("D", "ok")])
+        move_to(d, 1)
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["A", "D", "B", "C"])
+        move_to(a, lambda: 3)
+        self.assertEqual(titles(self.user), [("D", 0, "ok"), ("B", 1, "ok"), ("C", 2, "ok"), ("A", 3, "ok")])
+
+    def test_append_to_list(self):
+        make_list(self.user, [("A", "liked")])
+        film = Film.objects.create(title="B")
+        added = []
+
+        user_film, created = append_to_list(self.user.id, film, on_add=added.append, watched_at=None)
+        self.assertTrue(created)
+        self.assertEqual((user_film.position, added), (1, [user_film]))
+        self.assertEqual(list_version(self.user.id), 1)
+
+        again, created = append_to_list(self.user.id, film, on_add=added.append)
+        self.assertFalse(created)
+        self.assertEqual((again.pk, len(added)), (user_film.pk, 1))
+
+
+class RankingClient:
+    """
+    The add -> pick a tier -> compare loop, through the views, as self.user.
+    """
+    def add(self, title) -> UserFilm:
+        self.client.post(reverse("add_film"), {"title": title})
+        with use_user_shard(self.user.id):
+            return UserFilm.objects.get(user=self.user, film=Film.objects.get(title=title))
+
+    def pick_tier(self, user_film, tier):
+        url = reverse("rank_film", args=[user_film.id])
+        self.client.post(url, {"preference": tier})
+        return self.client.get(url)
+
+    def rank(self, title, tier, beats=()):
+        """
+        Add and place a film, beating the films named in `beats` and losing
+        to every other one it is compared with.
+        """
+        user_film = self.add(title)
+        url = reverse("rank_film", args=[user_film.id])
+        response = self.pick_tier(user_film, tier)
+        while response.status_code == 200 and response.context["comparison"] is not None:
+            opponent = response.context["comparison"].film.title
+            self.client.post(url, {"choice": "new" if opponent in beats else "comparison"})
+            response = self.client.get(url)
+        return user_film
+
+
+class RankFlowTests(RankingClient, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        self.client.force_login(self.user)
+
+    def test_abandoned_search_leaves_the_film_untiered_at_the_bottom(self):
+        self.rank("A", "liked")
+        self.rank("B", "ok")
+        self.rank("C", "disliked")
+
+        d = self.add("D")
+        response = self.pick_tier(d, "liked")
+        self.assertEqual(response.context["comparison"].film.title, "A")
+        # ...and the page is left without answering
+
+        self.rank("E", "ok", beats={"B"})
+        self.assertEqual(titles(self.user), [
+            ("A", 0, "liked"), ("E", 1, "ok"), ("B", 2, "ok"), ("C", 3, "disliked"), ("D", 4, None),
+        ])
+
+        # coming back to D resumes its search
+        response = self.client.get(reverse("rank_film", args=[d.id]))
+        self.assertEqual(response.context["comparison"].film.title, "A")
+        self.client.post(reverse("rank_film", args=[d.id]), {"choice": "new"})
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["D", "A", "E", "B", "C"])
+
+    def test_placement_follows_films_moved_by_another_tab(self):
+        self.rank("B1", "ok")
+        self.rank("B2", "ok")
+        self.rank("B3", "ok")
+
+        x = self.add("X")
+        url = reverse("rank_film", args=[x.id])
+        response = self.pick_tier(x, "ok")
+        self.assertEqual(response.context["comparison"].film.title, "B2")
+        self.client.post(url, {"choice": "comparison"})  # B2 wins
+
+        self.rank("Y", "ok", beats={"B1", "B2", "B3"})  # meanwhile, in another tab
+
+        response = self.client.get(url)
+        self.assertEqual(response.context["comparison"].film.title, "B3")
+        self.client.post(url, {"choice": "new"})  # X wins
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["Y", "B1", "B2", "X", "B3"])
+
+    def test_appends_take_the_next_position(self):
+        for title in ("A", "B", "C"):
+            self.add(title)
+        self.assertEqual([p for _, p, _ in titles(self.user)], [0, 1, 2])
+
+
+class PlaceInTierTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        self.a, self.b1, self.b2, self.b3, self.c, self.x = make_list(self.user, [
+            ("A", "liked"), ("B1", "ok"), ("B2", "ok"), ("B3", "ok"), ("C", "disliked"), ("X", None),
+        ])
+        self.candidates = [self.b1.id, self.b2.id, self.b3.id]
+
+    def test_goes_just_above_the_first_film_it_beat(self):
+        changes = []
+        place_in_tier(self.x, "ok", self.candidates, 1, on_change=lambda uf, old: changes.append((uf.preference, old)))
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["A", "B1", "X", "B2", "B3", "C"])
+        self.assertEqual(changes, [("ok", None)])
+
+    def test_skips_candidates_that_left_the_tier(self):
+        UserFilm.objects.filter(pk=self.b2.pk).update(preference="liked")
+        place_in_tier(self.x, "ok", self.candidates, 1)
+        titles_now = [t for t, _, _ in titles(self.user)]
+        self.assertLess(titles_now.index("X"), titles_now.index("B3"))
+        self.assertGreater(titles_now.index("X"), titles_now.index("B1"))
+
+    def test_goes_below_the_last_film_it_lost_to_when_it_beat_none_still_there(self):
+        self.b3.delete()
+        UserFilm.objects.filter(pk=self.c.pk).update(position=3)
+        UserFilm.objects.filter(pk=self.x.pk).update(position=4)
+        place_in_tier(self.x, "ok", self.candidates, 2)
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["A", "B1", "B2", "X", "C"])
+
+    def test_empty_tier_goes_to_the_tier_start(self):
+        place_in_tier(self.x, "disliked", [], 0)
+        self.assertEqual([t for t, _, _ in titles(self.user)], ["A", "B1", "B2", "B3", "X", "C"])
+
+
+class RetierTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        self.entries = make_list(self.user, [
+            ("A", "liked"), ("B1", "ok"), ("B2", "ok"), ("B3", "ok"), ("C", "disliked"),
+        ])
+        for user_film, elo in zip(self.entries, (1100, 1050, 1000, 950, 900)):
+            UserFilm.objects.filter(pk=user_film.pk).update(elo=elo)
+            user_film.elo = elo
+
+    def order(self):
+        return [t for t, _, _ in titles(self.user)]
+
+    def test_top_and_bottom(self):
+        a, b1, b2, b3, c = self.entries
+        retier(c, "ok", "top")
+        self.assertEqual(self.order(), ["A", "C", "B1", "B2", "B3"])
+        retier(a, "disliked", "bottom")
+        self.assertEqual(titles(self.user)[-1], ("A", 4, "disliked"))
+
+    def test_predicted_goes_below_every_film_with_a_higher_elo(self):
+        a, b1, b2, b3, c = self.entries
+        UserFilm.objects.filter(pk=c.pk).update(elo=1020)
+        retier(c, "ok")
+        self.assertEqual(self.order(), ["A", "B1", "C", "B2", "B3"])
+
+    def test_moving_down_past_the_old_tier(self):
+        a, b1, b2, b3, c = self.entries
+        changes = []
+        retier(b1, "disliked", "top", on_change=lambda uf, old: changes.append((old, uf.preference)))
+        self.assertEqual(titles(self.user), [
+            ("A", 0, "liked"), ("B2", 1, "ok"), ("B3", 2, "ok"), ("B1", 3, "disliked"), ("C", 4, "disliked"),
+        ])
+        self.assertEqual(changes, [("ok", "disliked")])
+
+    def test_into_an_empty_tier(self):
+        a, b1, b2, b3, c = self.entries
+        retier(a, "ok", "top")
+        retier(b3, "liked")
+        self.assertEqual(titles(self.user)[0], ("B3", 0, "liked"))
+
+
+class TasteTests(TestCase):
+    def test_count_inversions_matches_brute_force(self):
+        rng = random.Random(4)
+        for n in (0, 1, 2, 3, 7, 16, 33):
+            seq = [rng.randrange(10) for _ in range(n)]
+            expected = sum(1 for i, j in itertools.combinations(range(n), 2) if seq[i] > seq[j])
+            self.assertEqual(count_inversions(seq), expected, seq)
+        self.assertEqual(count_inversions(range(5, 0, -1)), 10)
+
+    def test_correlation_over_shared_films(self):
+        a = {1: 0, 2: 1, 3: 2, 4: 3, 9: 4}
+        self.assertEqual(correlation(a, {1: 10, 2: 20, 3: 30, 4: 40, 8: 0}), {"tau": 1.0, "rho": 1.0, "overlap": 4})
+        self.assertEqual(correlation(a, {4: 0, 3: 1, 2: 2, 1: 3}), {"tau": -1.0, "rho": -1.0, "overlap": 4})
+        # one adjacent swap out of six pairs
+        self.assertEqual(correlation(a, {2: 0, 1: 1, 3: 2, 4: 3}), {"tau": 0.6667, "rho": 0.8, "overlap": 4})
+
+    def test_correlation_needs_two_shared_films(self):
+        self.assertEqual(correlation({1: 0, 2: 1}, {2: 0, 3: 1}), {"tau": None, "rho": None, "overlap": 1})
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+
+    def current(self):
+        return list(
+            UserFilm.objects.filter(user=self.user).order_by("position").values_list("film_id", "preference")
+        )
+
+    def edit_a_lot(self):
+        """
+        Appends, placements, tier moves and removals; returns the list as it
+        was after each edit, with the time.
+        """
+        snapshots = []
+        rng = random.Random(7)
+        for i in range(12):
+            user_film, _ = append_to_list(self.user.id, Film.objects.create(title=f"F{i}"))
+            snapshots.append((timezone.now(), self.current()))
+            place_in_tier(user_film, rng.choice(["liked", "ok", "disliked"]), [], 0)
+            snapshots.append((timezone.now(), self.current()))
+        for user_film in rng.sample(list(UserFilm.objects.filter(user=self.user)), 4):
+            retier(user_film, rng.choice(["liked", "ok", "disliked"]), "top")
+            snapshots.append((timezone.now(), self.current()))
+        for user_film in rng.sample(list(UserFilm.objects.filter(user=self.user)), 3):
+            remove_from_list(user_film)
+            snapshots.append((timezone.now(), self.current()))
+        return snapshots
+
+    def test_list_at_rebuilds_every_earlier_state(self):
+        with mock.patch.object(history, "KEYFRAME_EVERY", 5):
+            snapshots = self.edit_a_lot()
+
+        events = RankEvent.objects.filter(user=self.user)
+        self.assertEqual(events.filter(keyframe__isnull=False).count(), 1 + (events.count() - 1) // 6)
+        self.assertEqual(history.list_at(self.user.id), snapshots[-1][1])
+        for at, expected in snapshots:
+            self.assertEqual(history.list_at(self.user.id, at), expected)
+
+    def test_replay_visits_every_event(self):
+        snapshots = self.edit_a_lot()
+        replayed = [list(entries) for event, entries in history.replay(self.user.id) if event.keyframe is None]
+        self.assertEqual([[tuple(e) for e in entries] for entries in replayed], [expected for _, expected in snapshots])
+
+    def test_film_series_tracks_position_and_score(self):
+        with mock.patch.object(history, "KEYFRAME_EVERY", 4):
+            snapshots = self.edit_a_lot()
+        for film_id in Film.objects.values_list("id", flat=True):
+            # the first keyframe is the empty list
+            expected = [(None, None)]
+            for at, entries in snapshots:
+                ids = [fid for fid, _ in entries]
+                position = ids.index(film_id) if film_id in ids else None
+                point = (position, None if position is None else rank_scores(entries)[film_id])
+                if point != expected[-1]:
+                    expected.append(point)
+            points = history.film_series(self.user.id, film_id)
+            self.assertEqual([(p["position"], p["score"]) for p in points], expected)
+
+            since = snapshots[len(snapshots) // 2][0]
+            recent = history.film_series(self.user.id, film_id, since=since)
+            self.assertTrue(all(p["at"] >= since for p in recent))
+            self.assertEqual(
+                (recent[-1]["position"], recent[-1]["score"]), (points[-1]["position"], points[-1]["score"]),
+            )
+
+
+class DedupeFilmsTests(TestCase):
+    def setUp(self):
+        self.keeper = Film.objects.create(title="The Matrix", year=1999, tmdb_id=603)
+        self.dup = Film.objects.create(title="the  matrix ", year=1999, director="Lana Wachowski")
+        self.other = Film.objects.create(title="Heat", year=1995)
+        self.ann = User.objects.create_user("ann")
+        self.bob = User.objects.create_user("bob")
+
+    def dedupe(self, *args):
+        out = StringIO()
+        call_command("dedupe_films", *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_entries_and_comparisons_to_the_keeper(self):
+        ann_dup = UserFilm.objects.create(user=self.ann, film=self.dup, position=0, preference="liked")
+        UserFilm.objects.create(user=self.ann, film=self.other, position=1, preference="ok")
+        record_comparison(self.ann, self.dup, self.other)
+        record_comparison(self.ann, self.dup, self.other)
+
+        self.dedupe()
+
+        self.assertFalse(Film.objects.filter(pk=self.dup.pk).exists())
+        self.keeper.refresh_from_db()
+        self.assertEqual(self.keeper.director, "Lana Wachowski")  # backfilled from the duplicate
+        ann_dup.refresh_from_db()
+        self.assertEqual((ann_dup.film_id, ann_dup.tmdb_id, ann_dup.position), (self.keeper.pk, 603, 0))
+        self.assertEqual(head_to_head(self.ann, self.keeper), [{"opponent_id": self.other.pk, "wins": 2, "losses": 0}])
+        self.assertEqual(PairwiseComparison.objects.filter(winner=self.keeper).count(), 2)
+
+    def test_a_user_with_both_keeps_the_keepers_entry(self):
+        make_list(self.bob, [("Alien", "liked")])
+        UserFilm.objects.create(user=self.bob, film=self.dup, position=1, preference="liked")
+        UserFilm.objects.create(user=self.bob, film=self.keeper, position=2, preference="ok")
+        UserFilm.objects.create(user=self.bob, film=self.other, position=3, preference="ok")
+        record_comparison(self.bob, self.dup, self.keeper)
+
+        self.dedupe()
+
+        self.assertEqual(titles(self.bob), [("Alien", 0, "liked"), ("The Matrix", 1, "ok"), ("Heat", 2, "ok")])
+        self.assertFalse(PairwiseStat.objects.exists())  # a film against itself means nothing
+        self.assertFalse(PairwiseComparison.objects.exists())
+
+    def test_dry_run_and_distinct_tmdb_ids(self):
+        Film.objects.create(title="Heat", year=1995, tmdb_id=949)
+        Film.objects.create(title="HEAT", year=1995, tmdb_id=1)
+
+        output = self.dedupe("--dry-run")
+        self.assertIn("skip", output)
+        self.assertIn("would merge duplicates of 1 title(s)", output)
+        self.assertEqual(Film.objects.count(), 5)
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+
+    def snapshot(self):
+        return (
+            sorted(
+                (row.director, row.num_ranked, round(row.score_sum, 6))
+                for row in UserDirectorStat.objects.filter(user=self.user, num_ranked__gt=0)
+            ),
+            sorted(UserDecadeStat.objects.filter(user=self.user, count__gt=0).values_list("decade", "count")),
+            list(
+                UserTierDay.objects.filter(user=self.user).order_by("day")
+                .values_list("day", "liked_count", "ok_count", "disliked_count")
+            ),
+        )
+
+    def test_incremental_rows_match_a_rebuild(self):
+        rng = random.Random(3)
+        directors = ["Varda", "Ozu", None]
+        entries = []
+        for i in range(15):
+            film = Film.objects.create(title=f"F{i}", year=1950 + 7 * i, director=directors[i % 3])
+            user_film, _ = append_to_list(self.user.id, film, on_add=stats.on_added)
+            if i % 4:
+                place_in_tier(user_film, rng.choice(["liked", "ok", "disliked"]), [], 0, on_change=stats.on_tier_set)
+            entries.append(user_film)
+
+        ranked = [uf for uf in entries if uf.preference]
+        for _ in range(10):
+            user_film = rng.choice(ranked)
+            old_elo = user_film.elo
+            user_film.elo += rng.uniform(-30, 30)
+            user_film.save(update_fields=["elo"])
+            stats.on_elo_change(user_film, old_elo)
+        for user_film in rng.sample(ranked, 3):
+            retier(user_film, rng.choice(["liked", "ok", "disliked"]), on_change=stats.on_tier_set)
+        for user_film in rng.sample(entries, 4):
+            user_film.refresh_from_db()
+            remove_from_list(user_film, on_remove=stats.on_removed)
+        # a director found after the films were ranked
+        late = Film.objects.filter(director__isnull=True).first()
+        Film.objects.filter(pk=late.pk).update(director="Akerman")
+        stats.on_director_set(late.pk, "Akerman")
+
+        incremental = self.snapshot()
+        stats.rebuild(self.user.id)
+        self.assertEqual(incremental, self.snapshot())
+        self.assertTrue(incremental[0] and incremental[1] and incremental[2])
+
+    def test_director_found_during_placement_is_credited(self):
+        film = Film.objects.create(title="Cléo", year=1962)
+        user_film, _ = append_to_list(self.user.id, film, on_add=stats.on_added)
+        # the lookup lands while the film is still being placed: nothing ranked to credit yet
+        Film.objects.filter(pk=film.pk).update(director="Varda")
+        stats.on_director_set(film.pk, "Varda")
+
+        place_in_tier(user_film, "liked", [], 0, on_change=stats.on_tier_set)
+        self.assertEqual(
+            list(UserDirectorStat.objects.filter(user=self.user).values_list("director", "num_ranked")), [("Varda", 1)],
+        )
+
+
+class CheckListsTests(TestCase):
+    def setUp(self):
+        self.ann = User.objects.create_user("ann")
+        self.bob = User.objects.create_user("bob")
+
+    def check(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("check_lists", *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_scan_reports_gaps_duplicates_and_inversions(self):
+        make_list(self.bob, [("A", "liked"), ("B", "ok"), ("C", "disliked")])  # fine
+        a, b, c, d = make_list(self.ann, [("A", "liked"), ("B", "ok"), ("C", "ok"), ("D", "disliked")])
+        UserFilm.objects.filter(pk=c.pk).update(position=1)  # duplicate
+        UserFilm.objects.filter(pk=d.pk).update(position=5)  # gap
+        UserFilm.objects.create(user=self.ann, film=Film.objects.create(title="E"), position=6, preference="liked")
+
+        reports = list(check_lists.scan("default"))
+        self.assertEqual(len(reports), 1)
+        report = reports[0]
+        self.assertEqual(
+            (report.user_id, report.gaps, report.duplicates, report.inversions, report.start), (self.ann.id, 1, 1, 1, 1),
+        )
+
+    def test_untiered_films_at_the_bottom_are_fine(self):
+        make_list(self.ann, [("A", "liked"), ("B", "disliked"), ("C", None)])
+        self.assertEqual(list(check_lists.scan("default")), [])
+
+    def test_repair_places_stranded_films_by_their_record(self):
+        make_list(self.ann, [("A", "liked"), ("B", "ok"), ("C", "disliked"), ("D", "liked"), ("E", "ok")])
+        films = dict(Film.objects.values_list("title", "id"))
+        record_comparison(self.ann, Film.objects.get(pk=films["E"]), Film.objects.get(pk=films["B"]))
+
+        out, _ = self.check("--repair")
+        self.assertIn("1 film(s) moved back into their tier without a comparison record", out)  # D
+        self.assertEqual([t for t, _, _ in titles(self.ann)], ["A", "D", "E", "B", "C"])
+        self.assertIn("0 list(s) with position problems", self.check()[0])
+
+    def test_repair_closes_gaps(self):
+        make_list(self.ann, [("A", "liked"), ("B", "ok"), ("C", "ok"), ("D", "disliked")])
+        UserFilm.objects.filter(film__title="B").update(position=4)
+        UserFilm.objects.filter(film__title="C").update(position=6)
+        UserFilm.objects.filter(film__title="D").update(position=9)
+
+        out, _ = self.check("--repair")
+        self.assertIn("moved 3 row(s)", out)
+        self.assertEqual([p for _, p, _ in titles(self.ann)], [0, 1, 2, 3])
+        self.assertEqual(history.list_at(self.ann.id), [
+            (film_id, preference) for film_id, preference in
+            UserFilm.objects.filter(user=self.ann).order_by("position").values_list("film_id", "preference")
+        ])
+
+    def test_contradictions(self):
+        make_list(self.ann, [("A", "ok"), ("B", "ok")])
+        films = dict(Film.objects.values_list("title", "id"))
+        record_comparison(self.ann, Film.objects.get(pk=films["B"]), Film.objects.get(pk=films["A"]))
+
+        out, _ = self.check()
+        self.assertIn(f"film {films['B']} beat film {films['A']} 1-0 but is ranked below it", out)
+
+    def test_a_locked_database_skips_only_that_user(self):
+        for user in (self.ann, self.bob):
+            make_list(user, [("A", "disliked"), ("B", "liked")])
+        repair = check_lists.repair_positions
+
+        def flaky(user_id, start=0):
+            if user_id == self.ann.id:
+                raise OperationalError("database is locked")
+            return repair(user_id, start)
+
+        with mock.patch.object(check_lists, "repair_positions", flaky):
+            out, err = self.check("--repair")
+        self.assertIn(f"user {self.ann.id}: database error (database is locked), skipped", err)
+        self.assertIn("1 list(s) repaired", out)
+        self.assertEqual([t for t, _, _ in titles(self.bob)], ["B", "A"])
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight("test", lock_timeout=2, wait_timeout=2, poll_interval=0.01)
+
+    def wait_for_calls(self, n):
+        deadline = time.monotonic() + 2
+        while self.flight.stats()["calls"] < n and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(self.flight.stats()["calls"], n)
+
+    def run_threads(self, n, fn):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.flight.do("k", fn))) for _ in range(n)]
+        threads[0].start()
+        self.wait_for_calls(1)
+        for thread in threads[1:]:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_threads_share_one_fetch(self):
+        release = threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            release.wait(2)
+            return "value"
+
+        threads, results = self.run_threads(8, fetch)
+        self.wait_for_calls(8)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(self.flight.stats(), {
+            "calls": 8, "fetched": 1, "coalesced_local": 7, "coalesced_remote": 0, "fallbacks": 0,
+        })
+
+    def test_leader_error_is_shared(self):
+        release = threading.Event()
+
+        def fetch():
+            release.wait(2)
+            raise ValueError("upstream down")
+
+        errors = []
+
+        def call():
+            try:
+                self.flight.do("k", fetch)
+            except ValueError as exc:
+                errors.append(exc)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.wait_for_calls(1)
+        follower = threading.Thread(target=call)
+        follower.start()
+        self.wait_for_calls(2)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.flight.stats()["fetched"], 1)
+
+    def test_followers_of_a_hung_leader_fall_back(self):
+        self.flight.lock_timeout = 0.1
+        release = threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            if len(fetches) == 1:  # the leader's
+                release.wait(2)
+                return "late"
+            return "own"
+
+        threads, results = self.run_threads(3, fetch)
+        leader = threads[0]
+        for thread in threads[1:]:
+            thread.join()
+        release.set()
+        leader.join()
+
+        self.assertEqual(sorted(results), ["late", "own", "own"])
+        self.assertEqual(self.flight.stats()["fallbacks"], 2)
+
+    def test_followers_of_a_leader_that_died_fall_back(self):
+        release = threading.Event()
+
+        class Killed(BaseException):
+            pass
+
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            if len(fetches) == 1:  # the leader's
+                release.wait(2)
+                raise Killed
+            return "own"
+
+        with mock.patch("threading.excepthook"):
+            threads, results = self.run_threads(3, fetch)
+            self.wait_for_calls(3)
+            started = time.monotonic()
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertLess(time.monotonic() - started, self.flight.lock_timeout)
+        self.assertEqual(results, ["own", "own"])
+        self.assertEqual(self.flight.stats()["fallbacks"], 2)
+
+    async def test_concurrent_tasks_share_one_fetch(self):
+        fetches = []
+
+        async def fetch():
+            fetches.append(1)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(self.flight.ado("k", fetch) for _ in range(8)))
+
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(self.flight.stats()["coalesced_local"], 7)
+
+    async def test_followers_of_a_cancelled_leader_fall_back(self):
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def fetch():
+            return "own"
+
+        leader = asyncio.create_task(self.flight.ado("k", hang))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(self.flight.ado("k", fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        results = await asyncio.wait_for(asyncio.gather(*followers), self.flight.lock_timeout / 2)
+        self.assertEqual(results, ["own"] * 3)
+        self.assertEqual(self.flight.stats()["fallbacks"], 3)
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+    def test_leader_publishes_its_result_and_releases_the_lock(self):
+        lock_key, result_key = self.flight._cache_keys("k")
+        self.assertEqual(self.flight.do("k", lambda: "value"), "value")
+        self.assertEqual(cache.get(result_key), "value")
+        self.assertIsNone(cache.get(lock_key))
+
+        # a published result is reused, e.g. by another process
+        self.assertEqual(self.flight.do("k", lambda: "again"), "value")
+        self.assertEqual(self.flight.stats()["coalesced_remote"], 1)
+
+    def test_waits_for_another_process_holding_the_lock(self):
+        lock_key, result_key = self.flight._cache_keys("k")
+        cache.add(lock_key, "other-process", 10)
+        threading.Timer(0.05, cache.set, (result_key, "theirs")).start()
+
+        self.assertEqual(self.flight.do("k", lambda: "ours"), "theirs")
+        self.assertEqual(self.flight.stats()["coalesced_remote"], 1)
+        self.assertEqual(self.flight.stats()["fetched"], 0)
+
+    def test_fetches_itself_when_the_other_process_gives_up(self):
+        lock_key, _ = self.flight._cache_keys("k")
+        cache.add(lock_key, "other-process", 10)
+        threading.Timer(0.05, cache.delete, (lock_key,)).start()
+
+        self.assertEqual(self.flight.do("k", lambda: "ours"), "ours")
+        self.assertEqual(self.flight.stats()["fallbacks"], 1)
+
+
+class CoalescingStatsViewTests(TestCase):
+    url = reverse("coalescing_stats")
+
+    def test_staff_only_without_a_token(self):
+        self.client.force_login(User.objects.create_user("ann"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user("ops", is_staff=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"tmdb", "posters"})
+
+    @override_settings(OPS_STATS_TOKEN="s3cret")
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get(self.url, headers={"Authorization": "Bearer s3cret"}).status_code, 200)
+        self.assertEqual(self.client.get(self.url, headers={"Authorization": "Bearer nope"}).status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+def tmdb_image(status=200, content=b"jpeg bytes"):
+    response = mock.Mock(status_code=status, content=content)
+    if status >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status))
+    return response
+
+
+class PosterTests(TestCase):
+    def setUp(self):
+        cache.clear()  # single-flight results
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(POSTER_CACHE_DIR=cache_dir.name))
+        self.get = self.enterContext(mock.patch("core.services.posters.requests.get", return_value=tmdb_image()))
+        Film.objects.create(title="Stalker", poster_path="/stalker.jpg")
+
+    def fetch(self, name="stalker.jpg", width=92, **headers):
+        response = self.client.get(reverse("poster", args=[width, name]), headers=headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_a_miss_is_fetched_once_then_served_from_disk(self):
+        for _ in range(2):
+            response = self.fetch()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"jpeg bytes")
+        self.get.assert_called_once()
+        self.assertTrue(self.get.call_args.args[0].endswith("/w92/stalker.jpg"))
+
+    def test_etag_revalidation(self):
+        etag = self.fetch()["ETag"]
+        response = self.fetch(If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_unknown_widths_and_names_are_not_fetched(self):
+        self.assertEqual(self.fetch(width=100).status_code, 404)
+        self.assertEqual(self.fetch(name="stalker.gif").status_code, 404)
+        self.assertEqual(self.fetch(name="not-ours.jpg").status_code, 404)
+        self.get.assert_not_called()
+
+    def test_a_poster_only_on_the_users_own_list(self):
+        ann = User.objects.create_user("ann")
+        UserFilm.objects.create(user=ann, film=Film.objects.create(title="Solaris"), poster_path="/solaris.jpg")
+        self.assertEqual(self.fetch(name="solaris.jpg").status_code, 404)
+
+        self.client.force_login(ann)
+        self.assertEqual(self.fetch(name="solaris.jpg").status_code, 200)
+
+    def test_upstream_404(self):
+        self.get.return_value = tmdb_image(404)
+        self.assertEqual(self.fetch().status_code, 404)
+
+    def test_upstream_unreachable(self):
+        self.get.side_effect = requests.ConnectionError("unreachable")
+        self.assertEqual(self.fetch().status_code, 502)
+        self.assertFalse(posters.cache_path(92, "stalker.jpg").exists())
+
+    def test_warm_posters_skips_cached_files(self):
+        ann = User.objects.create_user("ann")
+        make_list(ann, [("A", None), ("B", None), ("C", None)])
+        UserFilm.objects.filter(film__title="A").update(poster_path="/a.jpg")
+        UserFilm.objects.filter(film__title="B").update(poster_path="/b.jpg")
+        cached = posters.cache_path(92, "a.jpg")
+        cached.parent.mkdir(parents=True)
+        cached.write_bytes(b"old")
+
+        out = StringIO()
+        call_command("warm_posters", "ann", stdout=out)
+        self.assertIn("1 fetched, 1 already cached, 0 failed (2 poster(s))", out.getvalue())
+        self.get.assert_called_once()
+        self.assertTrue(self.get.call_args.args[0].endswith("/w92/b.jpg"))
+        self.assertEqual(cached.read_bytes(), b"old")
+
+
+@override_settings(USER_SHARDS=["shard0", "shard1"])
+class ShardingTests(RankingClient, TestCase):
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # as after `migrate` (see CoreConfig); has to happen outside the
+        # test transactions, where SQLite ignores the pragma
+        for alias in ("shard0", "shard1"):
+            connections[alias].disable_constraint_checking()
+        super().setUpClass()
+
+    def _should_check_constraints(self, connection):
+        return connection.alias == "default" and super()._should_check_constraints(connection)
+
+    def user_on(self, alias) -> User:
+        """
+        A new user whose id hashes to `alias`.
+        """
+        while True:
+            user = User.objects.create_user(f"user{User.objects.count()}")
+            if hashed_shard(user.id) == alias:
+                return user
+
+    def sign_in(self, user):
+        self.user = user
+        self.client.force_login(user)
+
+    def titles(self, user) -> list[str]:
+        with use_user_shard(user.id):
+            return [
+                user_film.film.title
+                for user_film in with_film(UserFilm.objects.filter(user=user).order_by("position"))
+            ]
+
+    def rows(self, user, alias) -> dict:
+        return {
+            model.__name__: list(model.objects.using(alias).filter(user_id=user.id).order_by("pk").values())
+            for model in USER_MODELS
+        }
+
+    def test_list_data_goes_to_the_users_shard(self):
+        ann, bob = self.user_on("shard0"), self.user_on("shard1")
+        for user in (ann, bob):
+            self.sign_in(user)
+            self.rank(f"{user.username} 1", "liked")
+            self.rank(f"{user.username} 2", "liked", beats={f"{user.username} 1"})
+
+        self.assertEqual(dict(UserShard.objects.values_list("user_id", "alias")), {ann.id: "shard0", bob.id: "shard1"})
+        for alias, owner in (("shard0", ann), ("shard1", bob)):
+            self.assertEqual(set(UserFilm.objects.using(alias).values_list("user_id", flat=True)), {owner.id})
+            self.assertEqual(set(PairwiseComparison.objects.using(alias).values_list("user_id", flat=True)), {owner.id})
+        self.assertFalse(UserFilm.objects.using("default").exists())
+        self.assertEqual(Film.objects.using("default").count(), 4)
+
+        self.assertEqual(self.titles(ann), [f"{ann.username} 2", f"{ann.username} 1"])
+        with self.assertRaisesMessage(RuntimeError, "No user shard selected"):
+            UserFilm.objects.count()
+
+    def test_seeded_id_ranges_are_disjoint(self):
+        for alias in ("shard0", "shard1"):
+            seed_id_ranges(alias)
+
+        ids = {}
+        for alias in ("shard0", "shard1"):
+            user = self.user_on(alias)
+            with use_user_shard(user.id):
+                ids[alias] = make_list(user, [("A", "ok"), ("B", "ok")])[0].pk
+        self.assertTrue(2**40 < ids["shard0"] < 2 * 2**40 < ids["shard1"] < 3 * 2**40)
+
+    def test_rebalance_moves_a_user_with_everything_intact(self):
+        ann = self.user_on("shard0")
+        UserShard.objects.create(user=ann, alias="shard1")  # e.g. placed under a different ORION_SHARDS
+        self.sign_in(ann)
+        self.rank("A", "liked")
+        self.rank("B", "ok")
+        self.rank("C", "liked", beats={"A"})
+
+        before = self.rows(ann, "shard1")
+        for model in (UserFilm, ListVersion, PairwiseComparison, PairwiseStat, RankEvent, UserTierDay):
+            self.assertTrue(before[model.__name__], model.__name__)
+        self.assertFalse(any(self.rows(ann, "shard0").values()))
+
+        out = StringIO()
+        call_command("rebalance_shards", stdout=out)
+        self.assertIn(f"user {ann.id}: moved", out.getvalue())
+
+        self.assertEqual(UserShard.objects.get(user=ann).alias, "shard0")
+        self.assertEqual(self.rows(ann, "shard0"), before)
+        self.assertFalse(any(self.rows(ann, "shard1").values()))
+
+        # and the list carries on from where it was
+        self.rank("D", "ok", beats={"B"})
+        self.assertEqual(self.titles(ann), ["C", "A", "D", "B"])
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    replica1 mirrors "default", so which connection ran a query is all that
+    tells them apart. Committed data, since the two don't share transactions.
+    """
+    databases = {"default", "replica1"}
+
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        self.client.force_login(self.user)
+        make_list(self.user, [("A", "liked"), ("B", "ok")])
+
+    def queries(self, method, url, **kwargs) -> dict:
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica1"]) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.response = response
+        return {"default": len(primary), "replica1": len(replica)}
+
+    def test_read_replica_views_read_from_the_replica(self):
+        used = self.queries("get", reverse("film_list"))
+        self.assertEqual(self.response.status_code, 200)
+        self.assertEqual(len(self.response.context["user_films"]), 2)
+        self.assertGreater(used["replica1"], 0)
+
+    def test_other_views_and_writes_use_the_primary(self):
+        user_film = UserFilm.objects.get(film__title="A")
+        self.assertEqual(self.queries("get", reverse("film_history", args=[user_film.id]))["replica1"], 0)
+        self.assertEqual(self.queries("post", reverse("add_film"), data={"title": "C"})["replica1"], 0)
+        self.assertTrue(UserFilm.objects.filter(film__title="C").exists())
+
+    def test_a_successful_write_pins_the_client_to_the_primary(self):
+        self.queries("post", reverse("add_film"), data={"title": "C"})
+        self.assertEqual(self.response.status_code, 302)
+        self.assertGreater(float(self.response.cookies[PIN_COOKIE].value), time.time())
+
+        used = self.queries("get", reverse("film_list"))
+        self.assertEqual(used["replica1"], 0)
+        self.assertEqual(len(self.response.context["user_films"]), 3)
+
+    def test_a_failed_write_does_not_pin(self):
+        self.queries("post", reverse("rank_film", args=[10**6]), data={"preference": "liked"})
+        self.assertEqual(self.response.status_code, 404)
+        self.assertNotIn(PIN_COOKIE, self.response.cookies)
+        self.assertGreater(self.queries("get", reverse("film_list"))["replica1"], 0)
+
+    def test_expired_or_malformed_pins_are_ignored(self):
+        for value in (str(time.time() - 1), "not-a-time"):
+            self.client.cookies[PIN_COOKIE] = value
+            self.assertGreater(self.queries("get", reverse("film_list"))["replica1"], 0)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(name) for name in ("ann", "bob", "cat")]
+
+    def film(self, title) -> Film:
+        return Film.objects.get_or_create(title=title)[0]
+
+    def rank(self, user, entries):
+        for i, (title, preference) in enumerate(entries):
+            UserFilm.objects.create(user=user, film=self.film(title), position=i, preference=preference)
+
+    def neighbors(self) -> dict:
+        title = dict(Film.objects.values_list("id", "title"))
+        found = {}
+        for film_id, neighbor_id, score in FilmNeighbor.objects.order_by("film_id", "-score").values_list(
+            "film_id", "neighbor_id", "score",
+        ):
+            found.setdefault(title[film_id], []).append((title[neighbor_id], round(score, 6)))
+        return found
+
+    def expected_score(self, a, b) -> float:
+        """
+        Cosine between two film columns, from the tier-banded scores.
+        """
+        columns = {a: {}, b: {}}
+        for user in User.objects.all():
+            entries = UserFilm.objects.filter(user=user, preference__isnull=False).order_by("position")
+            scores = rank_scores(entries.values_list("film__title", "preference"))
+            for title in columns:
+                if title in scores:
+                    columns[title][user.id] = (scores[title] - 5) / 5
+        dot = sum(w * columns[b].get(user_id, 0) for user_id, w in columns[a].items())
+        norm = lambda column: sum(w * w for w in column.values()) ** 0.5
+        return dot / (norm(columns[a]) * norm(columns[b]))
+
+    def test_build_keeps_the_top_k_with_a_head_to_head_bonus(self):
+        ann, bob, cat = self.users
+        self.rank(ann, [("A", "liked"), ("B", "liked"), ("C", "ok"), ("D", "disliked")])
+        self.rank(bob, [("B", "liked"), ("A", "liked"), ("D", "ok"), ("C", "disliked")])
+        self.rank(cat, [("A", "liked"), ("C", "liked"), ("B", "ok")])
+        # ann and bob split A vs B evenly: closeness (1 - 0) * 2 / (2 + 2)
+        record_comparison(ann, self.film("A"), self.film("B"))
+        record_comparison(bob, self.film("B"), self.film("A"))
+
+        with mock.patch.object(recommendations, "TOP_K", 1):
+            self.assertEqual(recommendations.build(), (4, 0))
+        found = self.neighbors()
+
+        ab = round(self.expected_score("A", "B") + recommendations.H2H_WEIGHT * 0.5, 6)
+        ac = round(self.expected_score("A", "C"), 6)
+        # D is only ever disliked next to the others: no positive neighbor
+        self.assertEqual(found, {"A": [("B", ab)], "B": [("A", ab)], "C": [("A", ac)]})
+        # cat's mid-tier B scores 5, which is no opinion either way
+        self.assertEqual(FilmNeighbor.objects.get(film__title="A").support, 2)
+
+        recommendations.build()
+        self.assertEqual(self.neighbors()["A"], [("B", ab), ("C", ac)])
+
+    def test_partial_build_updates_the_lists_it_displaces(self):
+        ann, bob, cat = self.users
+        self.rank(ann, [("A", "liked"), ("B", "liked"), ("C", "ok")])
+        self.rank(bob, [("B", "liked"), ("A", "liked"), ("C", "liked")])
+        self.rank(cat, [("A", "liked"), ("C", "liked"), ("B", "ok")])
+
+        with mock.patch.object(recommendations, "TOP_K", 1):
+            recommendations.build()
+            before = self.neighbors()
+            # two newcomers rate X and C alike, so X becomes C's best neighbor
+            for name in ("dan", "eve"):
+                self.rank(User.objects.create_user(name), [("C", "liked"), ("X", "liked"), ("B", "disliked")])
+
+            self.assertEqual(recommendations.build([self.film("X").id]), (1, 1))
+            partial = self.neighbors()
+            recommendations.build()
+            full = self.neighbors()
+
+        self.assertEqual(partial["X"], full["X"])
+        self.assertEqual(partial["C"], full["C"])
+        self.assertEqual(partial["C"][0][0], "X")
+        # lists that don't involve X wait for the next full build
+        self.assertEqual((partial["A"], partial["B"]), (before["A"], before["B"]))
+
+    def test_recommend_for_skips_owned_films_and_explains_picks(self):
+        ann = self.users[0]
+        self.rank(ann, [("A", "liked"), ("B", "liked"), ("E", "disliked")])
+        for film, neighbor, score in [
+            ("A", "C", 0.5), ("B", "C", 0.9), ("A", "D", 0.4), ("A", "B", 0.9), ("B", "E", 0.95), ("E", "F", 1.0),
+        ]:
+            FilmNeighbor.objects.create(film=self.film(film), neighbor=self.film(neighbor), score=score)
+
+        picks = recommendations.recommend_for(ann)
+
+        # seeds are weighted 1 / (1 + 0.1 * rank): C gets 0.5 from A and 0.9 / 1.1 from B
+        self.assertEqual(
+            [(pick["film"].title, pick["score"], pick["because"].title) for pick in picks],
+            [("C", round(0.5 + 0.9 / 1.1, 3), "B"), ("D", 0.4, "A")],
+        )
+        self.assertEqual(recommendations.recommend_for(self.users[1]), [])
+
+
+class PairwiseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        self.a, self.b, self.c = (Film.objects.create(title=title) for title in "ABC")
+
+    def test_add_outcome_keeps_one_ordered_row_per_pair(self):
+        add_outcome(self.user.id, self.b.id, self.a.id)
+        add_outcome(self.user.id, self.a.id, self.b.id, n=2)
+        add_outcome(self.user.id, self.b.id, self.a.id)
+
+        self.assertEqual(
+            list(PairwiseStat.objects.values_list("film_a_id", "film_b_id", "wins_a", "wins_b")),
+            [(self.a.id, self.b.id, 2, 2)],
+        )
+
+    def test_add_outcome_folds_into_a_row_created_concurrently(self):
+        update = QuerySet.update
+        updates = []
+
+        def racing_update(queryset, **fields):
+            updates.append(fields)
+            if len(updates) == 1:
+                # another request inserts the pair right after this update missed it
+                PairwiseStat.objects.bulk_create([
+                    PairwiseStat(user=self.user, film_a=self.a, film_b=self.b, wins_a=3),
+                ])
+                return 0
+            return update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            add_outcome(self.user.id, self.b.id, self.a.id)
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(list(PairwiseStat.objects.values_list("wins_a", "wins_b")), [(3, 1)])
+
+    def test_record_comparison_logs_and_compacts_together(self):
+        record_comparison(self.user, self.a, self.b)
+        with mock.patch("core.services.pairwise.add_outcome", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                record_comparison(self.user, self.a, self.b)
+
+        self.assertEqual(PairwiseComparison.objects.count(), 1)
+        self.assertEqual(list(PairwiseStat.objects.values_list("wins_a", "wins_b")), [(1, 0)])
+
+    def test_net_wins_and_head_to_head(self):
+        for winner, loser in [(self.a, self.b), (self.a, self.b), (self.b, self.a), (self.c, self.a)]:
+            record_comparison(self.user, winner, loser)
+
+        self.assertEqual(net_wins(self.user.id, [self.a.id]), {self.a.id: {self.b.id: 1, self.c.id: -1}})
+        self.assertEqual(net_wins(self.user.id, [self.b.id, self.c.id]), {
+            self.b.id: {self.a.id: -1}, self.c.id: {self.a.id: 1},
+        })
+        self.assertCountEqual(head_to_head(self.user, self.a), [
+            {"opponent_id": self.b.id, "wins": 2, "losses": 1},
+            {"opponent_id": self.c.id, "wins": 0, "losses": 1},
+        ])
+        self.assertEqual(head_to_head(self.user, Film.objects.create(title="D")), [])
+
+    def test_film_history_includes_the_head_to_head_record(self):
+        for winner, loser in [(self.a, self.b), (self.b, self.a), (self.a, self.b), (self.a, self.c)]:
+            record_comparison(self.user, winner, loser)
+        user_film = UserFilm.objects.create(user=self.user, film=self.a, preference="liked")
+        self.client.force_login(self.user)
+
+        data = self.client.get(reverse("film_history", args=[user_film.id])).json()
+        self.assertEqual(data["head_to_head"], [
+            {"opponent_id": self.b.id, "wins": 2, "losses": 1, "title": "B"},
+            {"opponent_id": self.c.id, "wins": 1, "losses": 0, "title": "C"},
+        ])
+
+
+class BradleyTerryTests(TestCase):
+    def test_orders_by_strength_and_centres_on_zero(self):
+        strengths = bt_fit([("a", "b", 3), ("b", "c", 3), ("a", "c", 1), ("b", "a", 1)])
+        self.assertGreater(strengths["a"], strengths["b"])
+        self.assertGreater(strengths["b"], strengths["c"])
+        self.assertAlmostEqual(sum(strengths.values()), 0)
+
+    def test_converges_to_the_fixed_point(self):
+        outcomes = [("a", "b", 5), ("b", "a", 2), ("b", "c", 4), ("c", "a", 1)]
+        strengths = bt_fit(outcomes)
+        exact = bt_fit(outcomes, iterations=10_000, tol=1e-12)
+        for item in exact:
+            self.assertAlmostEqual(strengths[item], exact[item], places=4)
+
+    def test_even_records_tie_and_unbeaten_items_stay_finite(self):
+        even = bt_fit([("a", "b", 2), ("b", "a", 2)])
+        self.assertAlmostEqual(even["a"], 0)
+        self.assertAlmostEqual(even["b"], 0)
+
+        unbeaten = bt_fit([("a", "b", 10)])
+        self.assertTrue(0 < unbeaten["a"] < 10)
+        self.assertEqual(bt_fit([("a", "a", 1), ("a", "b", 0)]), {})
+
+
+class ArchiveComparisonsTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.dir = Path(archive_dir.name)
+
+        self.user = User.objects.create_user("ann")
+        a, b = Film.objects.create(title="A"), Film.objects.create(title="B")
+        self.old = [record_comparison(self.user, a, b).id for _ in range(3)]
+        PairwiseComparison.objects.update(created_at=timezone.now() - timedelta(days=100))
+        self.new = record_comparison(self.user, b, a).id
+
+    def archive(self, *args):
+        call_command("archive_comparisons", "--older-than", "30", "--dir", str(self.dir), *args, stdout=StringIO())
+
+    def archived_ids(self) -> list[int]:
+        [path] = self.dir.glob("comparisons-*.jsonl.gz")
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            return [json.loads(line)["id"] for line in fh]
+
+    def test_moves_old_rows_and_keeps_totals(self):
+        self.archive("--batch-size", "2")
+        self.assertEqual(self.archived_ids(), self.old)
+        self.assertEqual(list(PairwiseComparison.objects.values_list("id", flat=True)), [self.new])
+        self.assertEqual(list(PairwiseStat.objects.values_list("wins_a", "wins_b")), [(3, 1)])
+
+    def test_each_batch_is_written_before_it_is_deleted(self):
+        delete = QuerySet.delete
+        deletes = []
+
+        def flaky_delete(queryset):
+            deletes.append(1)
+            if len(deletes) == 2:
+                raise OperationalError("database is locked")
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, "delete", flaky_delete), self.assertRaises(OperationalError):
+            self.archive("--batch-size", "2")
+
+        # the second batch is in the file, and still in the table
+        self.assertEqual(self.archived_ids(), self.old)
+        left = PairwiseComparison.objects.order_by("id").values_list("id", flat=True)
+        self.assertEqual(list(left), self.old[2:] + [self.new])
+
+    @override_settings(COMPARISON_ARCHIVE_AFTER_DAYS=None)
+    def test_needs_an_age(self):
+        with self.assertRaisesMessage(CommandError, "--older-than"):
+            call_command("archive_comparisons", "--dir", str(self.dir))
+        self.assertEqual(PairwiseComparison.objects.count(), 4)
+
+
+class LeaderboardTests(RankingClient, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def aggregates(self) -> dict:
+        return {
+            title: (num_ranked, round(score_sum, 6), liked, ok, disliked)
+            for title, num_ranked, score_sum, liked, ok, disliked in FilmAggregate.objects.values_list(
+                "film__title", "num_ranked", "score_sum", "liked_count", "ok_count", "disliked_count",
+            )
+        }
+
+    def test_incremental_totals_match_a_rebuild(self):
+        for name in ("ann", "bob"):
+            self.user = User.objects.create_user(name)
+            self.client.force_login(self.user)
+            self.rank("A", "liked")
+            self.rank("B", "ok")
+            self.rank("C", "liked", beats={"A"} if name == "ann" else ())
+            self.rank("D", "disliked")
+
+        c = UserFilm.objects.get(user=self.user, film__title="C")
+        self.client.post(reverse("retier_user_film", args=[c.id]), {"preference": "ok"})
+        d = UserFilm.objects.get(user=self.user, film__title="D")
+        self.client.post(reverse("delete_user_film", args=[d.id]))
+
+        incremental = self.aggregates()
+        self.assertEqual(incremental["C"][2:], (1, 1, 0))
+        self.assertEqual(incremental["D"][0], 1)
+
+        leaderboard.rebuild()
+        self.assertEqual(self.aggregates(), incremental)
+
+    def test_pages_are_cached_until_invalidated(self):
+        film = Film.objects.create(title="A")
+        FilmAggregate.objects.create(film=film, num_ranked=1, score_sum=7.0, liked_count=1)
+
+        first = leaderboard.page(1)
+        self.assertEqual([entry["title"] for entry in first["entries"]], ["A"])
+
+        FilmAggregate.objects.update(num_ranked=2, score_sum=15.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.page(1), first)
+
+        leaderboard.invalidate_pages()
+        self.assertEqual(leaderboard.page(1)["entries"][0]["num_ranked"], 2)
+
+
+SEARCH_RESULTS = [
+    {"tmdb_id": 11, "title": "Star Wars", "year": 1977, "poster_path": "/sw.jpg"},
+    {"tmdb_id": 12, "title": "Finding Nemo", "year": 2003, "poster_path": None},
+]
+
+
+class TMDBViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ann")
+        make_list(self.user, [("Alien", "liked"), ("Heat", "ok")])
+        UserFilm.objects.create(
+            user=self.user, film=Film.objects.create(title="Star Wars", tmdb_id=11), tmdb_id=11,
+            position=2, preference="disliked",
+        )
+
+        self.search = self.enterContext(mock.patch(
+            "core.views.asearch_movies", new_callable=mock.AsyncMock,
+            side_effect=lambda *args, **kwargs: [dict(r) for r in SEARCH_RESULTS],
+        ))
+        self.director = self.enterContext(mock.patch(
+            "core.views.aget_director", new_callable=mock.AsyncMock, side_effect=lambda tmdb_id: f"director {tmdb_id}",
+        ))
+
+    async def test_anonymous_requests_are_sent_to_login(self):
+        for method, url in [
+            ("get", reverse("film_search") + "?q=star"),
+            ("get", reverse("tmdb_search") + "?q=star"),
+            ("post", reverse("add_tmdb_film", args=[12])),
+        ]:
+            response = await getattr(self.async_client, method)(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response["Location"].startswith(settings.LOGIN_URL), url)
+        self.search.assert_not_awaited()
+
+    async def test_film_search_flags_owned_results(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("film_search"), {"q": "star"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(r["tmdb_id"], r["owned"], r["preference"], r["director"]) for r in response.context["results"]],
+            [(11, True, "disliked", "director 11"), (12, False, None, "director 12")],
+        )
+        self.search.assert_awaited_once_with("star")
+
+    async def test_tmdb_search_returns_json(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("tmdb_search"), {"q": "star", "year": "1977"})
+
+        self.assertEqual(response.json(), {"results": SEARCH_RESULTS})
+        self.search.assert_awaited_once_with("star", year=1977)
+
+    async def test_add_tmdb_film_creates_the_film_once_and_appends_it(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse("add_tmdb_film", args=[12])
+        data = {"title": "Finding Nemo", "year": "2003", "poster_path": "/nemo.jpg"}
+
+        first = await self.async_client.post(url, data)
+        second = await self.async_client.post(url, data)
+
+        user_film = await UserFilm.objects.aget(user=self.user, tmdb_id=12)
+        self.assertEqual(first["Location"], reverse("rank_film", args=[user_film.id]))
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual((user_film.position, user_film.preference, user_film.poster_path), (3, None, "/nemo.jpg"))
+        self.assertEqual(await Film.objects.filter(tmdb_id=12).acount(), 1)
+        self.assertEqual(await UserFilm.objects.filter(user=self.user).acount(), 4)
+
+
+class FilmColumnsTests(TestCase):
+    """
+    UserFilm.tmdb_id and poster_path mirror the film on every write path.
+    """
+    def setUp(self):
+        self.ann = User.objects.create_user("ann")
+        self.bob = User.objects.create_user("bob")
+        self.client.force_login(self.ann)
+
+    def columns(self, user, film):
+        return tuple(UserFilm.objects.filter(user=user, film=film).values_list("tmdb_id", "poster_path").get())
+
+    def test_form_add(self):
+        self.client.post(reverse("add_film"), {"title": "The Matrix", "tmdb_id": 603, "poster_path": "/m.jpg"})
+        film = Film.objects.get(tmdb_id=603)
+        self.assertEqual(self.columns(self.ann, film), (603, "/m.jpg"))
+
+        # an entry from before the columns were kept is fixed when it's added again
+        UserFilm.objects.filter(film=film).update(tmdb_id=None, poster_path=None)
+        self.client.post(reverse("add_film"), {"title": "The Matrix", "tmdb_id": 603})
+        self.assertEqual(self.columns(self.ann, film), (603, "/m.jpg"))
+
+    def test_tmdb_add_backfills_everyone_with_the_film(self):
+        film = Film.objects.create(title="Heat", tmdb_id=949)
+        UserFilm.objects.create(user=self.bob, film=film, tmdb_id=949)
+
+        self.client.post(reverse("add_tmdb_film", args=[949]), {"title": "Heat", "poster_path": "/heat.jpg"})
+        self.assertEqual(self.columns(self.ann, film), (949, "/heat.jpg"))
+        self.assertEqual(self.columns(self.bob, film), (949, "/heat.jpg"))
+
+    def test_dedupe_merge(self):
+        keeper = Film.objects.create(title="Alien", year=1979, tmdb_id=348)
+        dup = Film.objects.create(title="alien", year=1979, poster_path="/alien.jpg")
+        UserFilm.objects.create(user=self.ann, film=dup, poster_path="/alien.jpg")
+        UserFilm.objects.create(user=self.bob, film=keeper, tmdb_id=348)
+
+        call_command("dedupe_films", stdout=StringIO())
+        self.assertEqual(self.columns(self.ann, keeper), (348, "/alien.jpg"))
+        self.assertEqual(self.columns(self.bob, keeper), (348, "/alien.jpg"))
+
+    def test_owned_tmdb(self):
+        make_list(self.ann, [("A", "liked"), ("B", None), ("C", "ok")])
+        make_list(self.bob, [("D", "ok")])
+        for tmdb_id, title in ((11, "A"), (12, "B"), (13, "D")):
+            UserFilm.objects.filter(film__title=title).update(tmdb_id=tmdb_id)
+
+        owned = UserFilm.objects.owned_tmdb(self.ann, iter([11, 12, 13, 14]))
+        self.assertCountEqual(owned, [(11, "liked"), (12, None)])
+        self.assertEqual(list(UserFilm.objects.owned_tmdb(self.ann, [])), [])
+
+
+class UserDataAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.ann = User.objects.create_user("ann")
+        self.bob = User.objects.create_user("bob")
+        make_list(self.ann, [("The Matrix", "liked"), ("Heat", "ok"), ("Matrix Reloaded", "ok")])
+        make_list(self.bob, [("Alien", "liked"), ("Aliens", "ok"), ("Mattress Store", None), ("Solaris", "ok")])
+        self.enterContext(mock.patch.object(admin.UserFilmAdmin, "list_per_page", 3))
+
+    def changelist(self, model="userfilm", **params):
+        response = self.client.get(reverse(f"admin:core_{model}_changelist"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def titles(self, cl):
+        return [row.film.title for row in cl.result_list]
+
+    def test_keyset_paging(self):
+        newest = list(UserFilm.objects.order_by("-pk").values_list("pk", flat=True))
+
+        cl = self.changelist()
+        self.assertEqual([row.pk for row in cl.result_list], newest[:3])
+        self.assertIn(f"after={newest[2]}", cl.next_after_url)
+
+        cl = self.changelist(after=newest[2])
+        self.assertEqual([row.pk for row in cl.result_list], newest[3:6])
+        cl = self.changelist(after=newest[5])
+        self.assertEqual([row.pk for row in cl.result_list], newest[6:])
+        self.assertIsNone(cl.next_after_url)
+
+    def test_unfiltered_lists_use_the_estimated_count(self):
+        with mock.patch("core.admin.estimated_rows", return_value=2_500_000) as estimate:
+            self.assertEqual(self.changelist().paginator.count, 2_500_000)
+            estimate.assert_called_once()
+            estimate.reset_mock()
+
+            self.assertEqual(self.changelist(user="ann").paginator.count, 3)
+            estimate.assert_not_called()
+
+        with mock.patch("core.admin.estimated_rows", return_value=50):
+            self.assertEqual(self.changelist().paginator.count, 7)  # small enough to count
+
+    def test_username_filter(self):
+        self.assertEqual(self.titles(self.changelist(user="ann")), ["Matrix Reloaded", "Heat", "The Matrix"])
+        self.assertEqual(self.titles(self.changelist(user="nobody")), [])
+
+    def test_search_by_title_prefix_or_username(self):
+        self.assertEqual(self.titles(self.changelist(q="matrix")), ["Matrix Reloaded"])
+        self.assertEqual(self.titles(self.changelist(q="the mat")), ["The Matrix"])
+        self.assertEqual(self.titles(self.changelist(q="alien")), ["Aliens", "Alien"])
+        self.assertEqual(self.titles(self.changelist(q="bob")), ["Solaris", "Mattress Store", "Aliens"])
+
+        with mock.patch.object(admin, "SEARCH_FILMS", 1):
+            self.assertEqual(self.titles(self.changelist(q="alien")), ["Alien"])
+
+    def test_comparison_search_matches_winner_or_loser(self):
+        films = {film.title: film for film in Film.objects.all()}
+        record_comparison(self.ann, films["The Matrix"], films["Heat"])
+        record_comparison(self.ann, films["Heat"], films["Matrix Reloaded"])
+        record_comparison(self.bob, films["Alien"], films["Solaris"])
+
+        cl = self.changelist("pairwisecomparison", q="heat")
+        self.assertEqual(
+            [(row.winner.title, row.loser.title) for row in cl.result_list],
+            [("Heat", "Matrix Reloaded"), ("The Matrix", "Heat")],
+        )
@@ -2,77 +2,58 @@ from django.shortcuts import render
 from django.contrib import messages
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
-from django.db import transaction, models
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET, require_POST
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.urls import reverse
-from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from collections import defaultdict
+import asyncio
+
+import requests
+from asgiref.sync import sync_to_async
 
 
 from .forms import SignUpForm, LoginForm, AddFilmForm
-from .models import UserFilm, Film, PairwiseComparison
-from .services.tmdb import search_movies, get_director
+from .routers import read_replica
+from .sharding import current_db, with_film
+from .models import UserFilm, Film
+from .services.tmdb import asearch_movies, aget_director
 from .services.ratings import elo_update, elo_to_10
+from .services.lists import (
+    BANDS, TIER_ORDER, rank_scores, append_to_list, place_in_tier, remove_from_list, retier,
+    sync_film_columns,
+)
+from .services.pairwise import forget_film, head_to_head, record_comparison
+from .services import history, leaderboard, posters, rank_state, recommendations, stats, taste, tmdb
+from .jobs import schedule_director_lookup, schedule_list_upkeep
 
-PREF_ORDER = ("liked", "ok", "disliked")
+PREF_ORDER = TIER_ORDER
 
 def _tier_queryset(request, user_film, tier: str):
-    return (
+    return with_film(
         UserFilm.objects
         .filter(user=request.user, preference=tier)
         .exclude(id=user_film.id)
         .order_by("position")
-        .select_related("film")
-    )
-
-
-def _tier_start(user, tier: str) -> int:
-    idx = PREF_ORDER.index(tier)
-    above = PREF_ORDER[:idx]
-    if not above:
-        return 0
-
-    # the tier starts right after the last item in tiers above
-    last_pos = (
-        UserFilm.objects
-        .filter(user=user, preference__in=above)
-        .aggregate(Max("position"))
-        .get("position__max")
     )
-    return (last_pos + 1) if last_pos is not None else 0
 
-def normalize_positions(user):
-    """
-    Make positions contiguous 0..n-1 and enforce tier order.
-    Rank is truth.
-    """
-    pref_rank = {"liked": 0, "ok": 1, "disliked": 2}
-
-    qs = list(
-        UserFilm.objects
-        .filter(user=user)
-        .select_related("film")
-    )
 
-    # enforce tier order, then preserve existing relative order within tier by position
-    qs.sort(key=lambda uf: (pref_rank.get(uf.preference, 1), uf.position))
+def _candidate(request, state, index: int):
+    return with_film(
+        UserFilm.objects.filter(user=request.user, id=state["candidates"][index])
+    ).first()
 
-    with transaction.atomic():
-        for i, uf in enumerate(qs):
-            if uf.position != i:
-                UserFilm.objects.filter(pk=uf.pk).update(position=i)
 
 def clamp01(x: float) -> float:
     return max(0.0, min(1.0, x))
 
-BANDS = {
-    "liked":    (6.67, 10.00),
-    "ok":       (3.33, 6.67),
-    "disliked": (0.00, 3.33),
-}
-
 def tier_banded_score(elo: float, tier: str, min_elo: float, max_elo: float) -> float:
     lo, hi = BANDS[tier]
     if max_elo <= min_elo:
@@ -127,37 +108,110 @@ def logout_view(request):
     return redirect("landing")
 
 @login_required
+@read_replica
 def film_list(request):
-    user_films = list(
+    user_films = list(with_film(
         UserFilm.objects
         .filter(user=request.user)
-        .select_related("film")
         .order_by("position")
-    )
+    ))
 
     # Compute rank-based tier-banded scores (Beli-like)
-    tiers = {"liked": [], "ok": [], "disliked": []}
+    scores = rank_scores((uf.id, uf.preference) for uf in user_films)
     for uf in user_films:
-        tier = uf.preference if uf.preference in tiers else "ok"
-        tiers[tier].append(uf)
+        uf.display_score10 = scores[uf.id]
 
-    for tier, items in tiers.items():
-        band_lo, band_hi = BANDS[tier]
-        n = len(items)
+    return render(request, "core/film_list.html", {"user_films": user_films})
 
-        if n == 1:
-            items[0].display_score10 = round((band_lo + band_hi) / 2.0, 2)
-            continue
-        if n == 0:
-            continue
 
-        # best in tier (earlier in list) gets band_hi, worst gets band_lo
-        for idx, uf in enumerate(items):
-            t = idx / (n - 1)  # 0 for best -> 1 for worst
-            score = band_hi - t * (band_hi - band_lo)
-            uf.display_score10 = round(score, 2)
+@login_required
+@read_replica
+def recommended_films(request):
+    return render(request, "core/recommendations.html", {
+        "recommendations": recommendations.recommend_for(request.user),
+    })
+
+
+@login_required
+def taste_match(request, username):
+    other = get_object_or_404(User, username=username)
+    match = taste.taste_match(request.user, other) if other != request.user else None
+
+    return render(request, "core/taste.html", {
+        "other": other,
+        "match": match,
+        "similar_users": taste.similar_users(request.user),
+    })
 
-    return render(request, "core/film_list.html", {"user_films": user_films})
+
+@login_required
+def user_stats(request):
+    tier_days = stats.tier_history(request.user.id)
+    for day in tier_days:
+        day.total = day.liked_count + day.ok_count + day.disliked_count
+
+    decades = stats.decade_counts(request.user.id)
+    return render(request, "core/stats.html", {
+        "directors": stats.top_directors(request.user.id),
+        "decades": decades,
+        "decade_peak": max((count for _, count in decades), default=0),
+        "tier_days": tier_days,
+    })
+
+
+@login_required
+def film_history(request, user_film_id):
+    """
+    JSON series of one film's position and score on the user's list, for charts,
+    and its head-to-head record against every film it was compared with.
+    """
+    uf = get_object_or_404(UserFilm, id=user_film_id, user=request.user)
+    points = history.film_series(request.user.id, uf.film_id)
+    record = head_to_head(request.user, uf.film)
+    titles = dict(Film.objects.filter(id__in=[r["opponent_id"] for r in record]).values_list("id", "title"))
+    return JsonResponse({
+        "film_id": uf.film_id,
+        "points": [
+            {"at": p["at"].isoformat(), "rank": None if p["position"] is None else p["position"] + 1, "score": p["score"]}
+            for p in points
+        ],
+        "head_to_head": sorted(
+            ({**r, "title": titles.get(r["opponent_id"])} for r in record),
+            key=lambda r: (-(r["wins"] + r["losses"]), r["opponent_id"]),
+        ),
+    })
+
+
+@login_required
+def list_history(request):
+    """
+    JSON: the user's list as it was at ?at=<ISO datetime> (default: now).
+    """
+    at = None
+    if request.GET.get("at"):
+        at = parse_datetime(request.GET["at"])
+        if at is None:
+            return HttpResponseBadRequest("Invalid 'at' datetime.")
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+
+    entries = history.list_at(request.user.id, at)
+    titles = dict(Film.objects.filter(id__in=[film_id for film_id, _ in entries]).values_list("id", "title"))
+    return JsonResponse({
+        "at": (at or timezone.now()).isoformat(),
+        "films": [
+            {"rank": i + 1, "film_id": film_id, "title": titles.get(film_id), "preference": preference}
+            for i, (film_id, preference) in enumerate(entries)
+        ],
+    })
+
+
+@read_replica
+def top_films(request):
+    page_str = request.GET.get("page", "1")
+    number = int(page_str) if page_str.isdigit() and int(page_str) > 0 else 1
+
+    return render(request, "core/leaderboard.html", {"page": leaderboard.page(number)})
 
 
 @login_required
@@ -166,6 +220,7 @@ def add_film(request):
         form = AddFilmForm(request.user, request.POST)
         if form.is_valid():
             user_film = form.save()
+            schedule_director_lookup(user_film.film)
             user_film_count = UserFilm.objects.filter(user = request.user).count()
             messages.success(
                 request,
@@ -184,58 +239,60 @@ def add_film(request):
 def rank_film(request, user_film_id):
     user_film = get_object_or_404(UserFilm, id=user_film_id, user=request.user)
 
+    def tier_changed(uf, old_tier):
+        leaderboard.on_tier_set(uf, old_tier)
+        stats.on_tier_set(uf, old_tier)
+
     # ---- 1) Preference step (qualifier) ----
     if request.method == "POST":
         pref_value = request.POST.get("preference")
         if pref_value in PREF_ORDER:
-            user_film.preference = pref_value
-            user_film.save(update_fields=["preference"])
-
-            # initialize ranking state (binary search within tier by POSITION)
-            tier_qs = _tier_queryset(request, user_film, user_film.preference)
-            request.session["rank_state"] = {
-                "target_uf_id": user_film.id,
-                "tier": user_film.preference,
-                "lo": 0,
-                "hi": tier_qs.count(),  # number of candidates in the tier
-            }
+            # the tier is only saved once the film is placed in it, so an
+            # abandoned search leaves the film untiered at the bottom
+            tier_qs = _tier_queryset(request, user_film, pref_value)
+            rank_state.start(user_film, pref_value, tier_qs.values_list("id", flat=True))
             return redirect("rank_film", user_film_id=user_film.id)
 
     # ---- 2) Comparison step ----
-    state = request.session.get("rank_state")
+    state = rank_state.load(user_film)
     comparison = None
 
-    # Only run placement if user has preference AND session is for this film
-    if user_film.preference and state and state.get("target_uf_id") == user_film.id:
+    # Only run placement if a search is under way for this film
+    if state:
         tier = state["tier"]
         lo = state["lo"]
         hi = state["hi"]
+        n = len(state["candidates"])
+
+        # If tier empty, insert at tier boundary immediately
+        if n == 0:
+            place_in_tier(user_film, tier, [], 0, on_change=tier_changed)
+            schedule_list_upkeep(request.user)
 
-        tier_qs = _tier_queryset(request, user_film, tier)
-        n = tier_qs.count()
+            rank_state.clear(user_film)
+            return redirect("film_list")
 
-        # Safety clamp in case list changed
-        lo = max(0, min(lo, n))
-        hi = max(0, min(hi, n))
+        if lo < hi:
+            mid = (lo + hi) // 2
+            comparison = _candidate(request, state, mid)
+            if comparison is None:
+                # the snapshot went stale (film removed in another tab); start over
+                rank_state.clear(user_film)
+                return redirect("rank_film", user_film_id=user_film.id)
 
         if request.method == "POST":
             choice = request.POST.get("choice")
 
             # Only proceed if we have candidates and are mid-search
-            if choice in ("new", "comparison") and n > 0 and lo < hi:
-                mid = (lo + hi) // 2
-                comp = tier_qs[mid]
+            if choice in ("new", "comparison") and comparison is not None:
+                comp = comparison
 
                 winner_uf = user_film if choice == "new" else comp
                 loser_uf  = comp if choice == "new" else user_film
 
-                with transaction.atomic():
+                with transaction.atomic(using=current_db()):
                     # record outcome
-                    PairwiseComparison.objects.create(
-                        user=request.user,
-                        winner=winner_uf.film,
-                        loser=loser_uf.film,
-                    )
+                    record_comparison(request.user, winner_uf.film, loser_uf.film)
 
                     # Elo update (optional for now, but keep it for later BT/Elo use)
                     locked = (
@@ -245,9 +302,14 @@ def rank_film(request, user_film_id):
                     locked_map = {uf.id: uf for uf in locked}
                     w = locked_map[winner_uf.id]
                     l = locked_map[loser_uf.id]
+                    old_w, old_l = w.elo, l.elo
                     w.elo, l.elo = elo_update(w.elo, l.elo, k=24.0)
                     w.save(update_fields=["elo"])
                     l.save(update_fields=["elo"])
+                    leaderboard.on_elo_change(w, old_w)
+                    leaderboard.on_elo_change(l, old_l)
+                    stats.on_elo_change(w, old_w)
+                    stats.on_elo_change(l, old_l)
 
                 # Update bounds for binary search (rank truth)
                 if choice == "new":
@@ -256,65 +318,29 @@ def rank_film(request, user_film_id):
                     lo = mid + 1
 
                 state["lo"], state["hi"] = lo, hi
-                request.session["rank_state"] = state
 
                 # If finished, finalize insertion
                 if lo >= hi:
-                    insert_index_in_tier = lo  # 0..n
-                    tier_start = _tier_start(request.user, tier)
-                    insert_pos = tier_start + insert_index_in_tier
-
-                    with transaction.atomic():
-                        # Shift everything at/after insert_pos down by 1
-                        UserFilm.objects.filter(
-                            user=request.user,
-                            position__gte=insert_pos
-                        ).exclude(id=user_film.id).update(position=models.F("position") + 1)
+                    # lo is 0..n: just above candidates[lo], wherever it is by now
+                    place_in_tier(user_film, tier, state["candidates"], lo, on_change=tier_changed)
 
-                        # Place new film
-                        user_film.position = insert_pos
-                        user_film.save(update_fields=["position"])
+                    # rating refits run off the request path
+                    schedule_list_upkeep(request.user)
 
-                        # Normalize to remove gaps and enforce tier ordering
-                        normalize_positions(request.user)
-
-                    request.session.pop("rank_state", None)
+                    rank_state.clear(user_film)
                     return redirect("film_list")
 
+                rank_state.save(user_film, state)
                 return redirect("rank_film", user_film_id=user_film.id)
 
-        # If not posting a choice, render the current comparison
-        if n > 0 and lo < hi:
-            mid = (lo + hi) // 2
-            comparison = tier_qs[mid]
-
-        # If tier empty, insert at tier boundary immediately
-        elif n == 0:
-            tier_start = _tier_start(request.user, tier)
-            insert_pos = tier_start
-
-            with transaction.atomic():
-                UserFilm.objects.filter(
-                    user=request.user,
-                    position__gte=insert_pos
-                ).exclude(id=user_film.id).update(position=models.F("position") + 1)
-
-                user_film.position = insert_pos
-                user_film.save(update_fields=["position"])
-
-                normalize_positions(request.user)
-
-            request.session.pop("rank_state", None)
-            return redirect("film_list")
-
     return render(
         request,
         "core/rank_film.html",
-        {"user_film": user_film, "comparison": comparison},
+        {"user_film": user_film, "comparison": comparison, "ranking": state is not None},
     )
 
 @login_required
-def tmdb_search(request):
+async def tmdb_search(request):
     q = request.GET.get("q", "").strip()
     year_str = request.GET.get("year", "").strip()
 
@@ -322,35 +348,50 @@ def tmdb_search(request):
     if year_str.isdigit():
         year = int(year_str)
 
-    results = search_movies(q, year=year)
+    results = await asearch_movies(q, year=year)
     return JsonResponse({"results": results})
 
+@require_GET
+def coalescing_stats(request):
+    """
+    How often concurrent TMDB and poster fetches were shared instead of
+    repeated, for this server process since it started. For staff, or
+    scripts sending settings.OPS_STATS_TOKEN as a bearer token.
+    """
+    token = settings.OPS_STATS_TOKEN
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not (request.user.is_staff or (token and constant_time_compare(supplied, token))):
+        raise PermissionDenied
+    return JsonResponse({"tmdb": tmdb.coalescing_stats(), "posters": posters.coalescing_stats()})
+
 @login_required
-def film_search(request):
+@read_replica
+async def film_search(request):
+    user = await request.auser()
     q = request.GET.get("q", "").strip()
 
-    results = search_movies(q) if q else []
+    results = await asearch_movies(q) if q else []
 
-    user_films = (
-        UserFilm.objects
-        .filter(user=request.user, film__tmdb_id__isnull=False)
-        .select_related("film")
-    )
-    owned_by_tmdb = {uf.film.tmdb_id: uf for uf in user_films}
+    # only ask about the (at most `limit`) tmdb ids on this page
+    owned = UserFilm.objects.owned_tmdb(user, (r["tmdb_id"] for r in results))
+    pref_by_tmdb = {tmdb_id: preference async for tmdb_id, preference in owned}
+
+    # director lookups are independent, so wait on TMDB for all of them at once
+    directors = await asyncio.gather(*(aget_director(r["tmdb_id"]) for r in results))
 
-    for r in results:
-        uf = owned_by_tmdb.get(r["tmdb_id"])
-        r["owned"] = bool(uf)
-        r["preference"] = uf.preference if uf else None
-        r["director"] = get_director(r["tmdb_id"])
+    for r, director in zip(results, directors):
+        r["owned"] = r["tmdb_id"] in pref_by_tmdb
+        r["preference"] = pref_by_tmdb.get(r["tmdb_id"])
+        r["director"] = director
 
-    return render(request, "core/film_search.html", {
+    # templates touch request.user (sync ORM), so render off the event loop
+    return await sync_to_async(render)(request, "core/film_search.html", {
         "q": q,
         "results": results,
     })
 
 @login_required
-def add_tmdb_film(request, tmdb_id: int):
+async def add_tmdb_film(request, tmdb_id: int):
     if request.method != "POST":
         return HttpResponseBadRequest("POST required")
 
@@ -361,72 +402,125 @@ def add_tmdb_film(request, tmdb_id: int):
     year = int(year_str) if year_str.isdigit() else None
     if not title:
         return HttpResponseBadRequest("Missing title")
-    
-    print(get_director(tmdb_id))
 
     # 1) Create/get the Film (correct model)
-    film, created = Film.objects.get_or_create(
+    user = await request.auser()
+
+    film, created = await Film.objects.aget_or_create(
         tmdb_id=tmdb_id,
         defaults={
             "title": title,
             "year": year,
             "poster_path": poster_path,
-            "director": get_director(tmdb_id),
         }
     )
 
-    if not created and not film.director:
-        film.director = get_director(tmdb_id)
-        # optional: also backfill year/poster if missing
+    if not created:
+        # backfill year/poster if missing
+        backfill = []
         if not film.year and year:
             film.year = year
+            backfill.append("year")
         if not film.poster_path and poster_path:
             film.poster_path = poster_path
-        film.save()
+            backfill.append("poster_path")
+        if backfill:
+            await film.asave(update_fields=backfill)
+            await sync_to_async(sync_film_columns)(film)
+
+    # director comes from a separate TMDB call; fetch it in the background
+    await sync_to_async(schedule_director_lookup)(film)
 
     # 2) Create/get UserFilm for THIS user (since rank_film expects user_film_id)
     # Put it at end for now; rank_film will move it if needed
-    max_pos = (
-        UserFilm.objects
-        .filter(user=request.user)
-        .aggregate(Max("position"))
-        .get("position__max")
+    user_film, created = await sync_to_async(append_to_list)(
+        user.id,
+        film,
+        on_add=stats.on_added,
+        tmdb_id=film.tmdb_id,
+        poster_path=film.poster_path,
     )
-    next_pos = (max_pos or 0) + 1
 
-    user_film, created = UserFilm.objects.get_or_create(
-        user=request.user,
-        film=film,
-        defaults={"position": next_pos},
-    )
+    if not created and (
+        user_film.tmdb_id != film.tmdb_id
+        or (not user_film.poster_path and film.poster_path)
+    ):
+        # keep the denormalized columns in sync for rows added before they were maintained
+        user_film.tmdb_id = film.tmdb_id
+        user_film.poster_path = user_film.poster_path or film.poster_path
+        await user_film.asave(update_fields=["tmdb_id", "poster_path"])
 
     # 3) Redirect using the correct keyword arg name
     return redirect("rank_film", user_film_id=user_film.id)
 
 @require_POST
 @login_required
-def delete_user_film(request, user_film_id):
+def retier_user_film(request, user_film_id):
     uf = get_object_or_404(UserFilm, id=user_film_id, user=request.user)
+    tier = request.POST.get("preference")
+    placement = request.POST.get("placement", "predicted")
+    if tier not in PREF_ORDER or placement not in ("predicted", "top", "bottom"):
+        return HttpResponseBadRequest("Invalid tier or placement.")
 
-    with transaction.atomic():
-        deleted_pos = uf.position
-        film = uf.film
+    if uf.preference is None:
+        # never placed: go through the comparison flow instead
+        return redirect("rank_film", user_film_id=uf.id)
+
+    def tier_changed(uf, old_tier):
+        leaderboard.on_tier_set(uf, old_tier)
+        stats.on_tier_set(uf, old_tier)
+
+    if uf.preference != tier:
+        retier(uf, tier, placement, on_change=tier_changed)
+        schedule_list_upkeep(request.user)
+        messages.success(request, f"Moved '{uf.film.title}' to {tier}.")
+    return redirect("film_list")
+
+
+@require_POST
+@login_required
+def delete_user_film(request, user_film_id):
+    uf = get_object_or_404(UserFilm, id=user_film_id, user=request.user)
 
-        # Delete comparisons for this user that involve this film
-        PairwiseComparison.objects.filter(
-            user=request.user
-        ).filter(
-            models.Q(winner=film) | models.Q(loser=film)
-        ).delete()
+    film = uf.film
 
-        # Delete the UserFilm row
-        uf.delete()
+    def forget(uf):
+        # Delete comparisons for this user that involve this film,
+        # and the row's share of the site-wide totals
+        forget_film(request.user, film)
+        leaderboard.on_removed(uf)
+        stats.on_removed(uf)
 
-        # Close the gap in positions
-        UserFilm.objects.filter(
-            user=request.user,
-            position__gt=deleted_pos
-        ).update(position=models.F("position") - 1)
+    # deletes the row and closes the gap in positions
+    remove_from_list(uf, on_remove=forget)
 
     messages.success(request, f"Removed '{film.title}' from your list.")
-    return redirect("film_list")
\ No newline at end of file
+    return redirect("film_list")
+
+
+POSTER_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@require_GET
+def poster(request, width, name):
+    if not posters.is_valid(width, name):
+        raise Http404("Unknown poster size or name.")
+    if not posters.cache_path(width, name).exists() and not posters.is_stored(name, request.user):
+        raise Http404("No such poster.")
+
+    try:
+        path = posters.get(width, name)
+    except requests.RequestException:
+        return HttpResponse("Poster service unavailable.", status=502)
+    if path is None:
+        raise Http404("No such poster.")
+
+    etag = posters.etag(path)
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(open(path, "rb"))
+    response["ETag"] = etag
+    response["Cache-Control"] = POSTER_CACHE_CONTROL
+    return response
+
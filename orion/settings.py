@@ -12,11 +12,34 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+TESTING = sys.argv[1:2] == ['test']
+
 TMDB_API_KEY = os.environ.get("TMDB_API_KEY")
+# Overridable so `manage.py loadtest` can point a dev server at its stub.
+TMDB_API_BASE_URL = os.environ.get("TMDB_API_BASE_URL", "https://api.themoviedb.org/3")
+
+# Poster thumbnails are fetched from here once and then served from
+# POSTER_CACHE_DIR (point it at a local stub server in tests).
+TMDB_IMAGE_BASE_URL = os.environ.get("TMDB_IMAGE_BASE_URL", "https://image.tmdb.org/t/p")
+POSTER_CACHE_DIR = Path(os.environ.get("ORION_POSTER_CACHE_DIR", BASE_DIR / "poster_cache"))
+
+# Run background jobs inline (after commit) instead of via `manage.py run_workers`.
+# Handy for local development without a worker process.
+JOBS_EAGER = os.environ.get("ORION_JOBS_EAGER", "") == "1"
+
+# Lets scripts read /ops/ counters without a staff login, by sending
+# "Authorization: Bearer <token>". Unset = staff only.
+OPS_STATS_TOKEN = os.environ.get("ORION_OPS_TOKEN", "")
+
+# `manage.py archive_comparisons` moves raw comparison rows older than this many
+# days into gzipped files under COMPARISON_ARCHIVE_DIR. None = keep everything.
+COMPARISON_ARCHIVE_AFTER_DAYS = None
+COMPARISON_ARCHIVE_DIR = BASE_DIR / "archive"
 
 
 # Quick-start development settings - unsuitable for production
@@ -46,10 +69,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.routers.replica_pinning_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.sharding.user_shard_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,10 +102,93 @@ WSGI_APPLICATION = 'orion.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# ORION_DB_PROFILE=production switches SQLite to WAL with a busy timeout and
+# relaxed fsyncs, and keeps connections open between requests. It works the
+# same against a local file, so the production profile can be tried locally.
+DB_PROFILE = os.environ.get('ORION_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION_OPTIONS = {
+    # wait up to 20s for the write lock instead of failing with "database is locked"
+    'timeout': 20,
+    # take the write lock at BEGIN so transactions don't deadlock upgrading from a read lock
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=20000;'
+        'PRAGMA temp_store=MEMORY;'
+        'PRAGMA cache_size=-20000;'
+    ),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('ORION_CONN_MAX_AGE', 60 if DB_PROFILE == 'production' else 0)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': SQLITE_PRODUCTION_OPTIONS if DB_PROFILE == 'production' else {},
+    }
+}
+
+# Read replicas, e.g. ORION_DB_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+# (LiteFS / Litestream copies of the primary). Only views marked with
+# core.routers.read_replica read from them.
+DATABASE_REPLICAS = []
+for i, path in enumerate(p for p in os.environ.get('ORION_DB_REPLICAS', '').split(',') if p):
+    alias = f'replica{i + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': path,
+        # the replica's journal mode belongs to whatever keeps it in sync
+        'OPTIONS': {'timeout': 20, 'init_command': 'PRAGMA query_only=1;'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+if TESTING:
+    # tests read from 'default' only; the routing tests turn replicas on with
+    # override_settings(DATABASE_REPLICAS=['replica1'])
+    DATABASES.setdefault('replica1', {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}})
+    DATABASE_REPLICAS = []
+
+# Opt-in user sharding, e.g. ORION_SHARDS=4: each user's list and comparisons
+# live in one of shard0..shard3 under ORION_SHARD_DIR; films, accounts and
+# everything else stay in 'default'. See core/sharding.py.
+SHARD_DIR = Path(os.environ.get('ORION_SHARD_DIR', BASE_DIR / 'shards'))
+USER_SHARDS = []
+for i in range(max(int(os.environ.get('ORION_SHARDS', '0')), 2 if TESTING else 0)):
+    alias = f'shard{i}'
+    options = DATABASES['default']['OPTIONS']
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': SHARD_DIR / f'{alias}.sqlite3',
+        # foreign keys point at users/films in the catalog database, which
+        # SQLite can't see from here
+        'OPTIONS': {**options, 'init_command': options.get('init_command', '') + 'PRAGMA foreign_keys=OFF;'},
+    }
+    USER_SHARDS.append(alias)
+if TESTING:
+    # tests always get two (in-memory) shard databases but run unsharded;
+    # the sharding tests switch it on with override_settings(USER_SHARDS=...)
+    USER_SHARDS = []
+elif USER_SHARDS:
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+
+DATABASE_ROUTERS = ['core.sharding.UserShardRouter', 'core.routers.PrimaryReplicaRouter']
+
+# After a successful write, keep that client on the primary for this long.
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Cross-process features (TMDB request coalescing) need a shared backend,
+# e.g. ORION_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('ORION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('ORION_CACHE_LOCATION', 'orion'),
     }
 }
 
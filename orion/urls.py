@@ -28,10 +28,19 @@ urlpatterns = [
     path("logout/", core_views.logout_view, name="account_logout"),
 
     path("films/", core_views.film_list, name="film_list"),
+    path("films/top/", core_views.top_films, name="top_films"),
+    path("films/recommended/", core_views.recommended_films, name="recommended_films"),
+    path("stats/", core_views.user_stats, name="user_stats"),
+    path("users/<str:username>/taste/", core_views.taste_match, name="taste_match"),
     path("films/add/", core_views.add_film, name="add_film"),
     path("films/rank/<int:user_film_id>", core_views.rank_film, name="rank_film"),
     path("api/tmdb/search/", core_views.tmdb_search, name="tmdb_search"),
     path("films/search/", core_views.film_search, name="film_search"),
     path("films/add/<int:tmdb_id>/", core_views.add_tmdb_film, name="add_tmdb_film"),
+    path("films/<int:user_film_id>/history/", core_views.film_history, name="film_history"),
+    path("films/history/", core_views.list_history, name="list_history"),
+    path("films/<int:user_film_id>/tier/", core_views.retier_user_film, name="retier_user_film"),
     path("films/<int:user_film_id>/delete/", core_views.delete_user_film, name="delete_user_film"),
+    path("posters/w<int:width>/<str:name>", core_views.poster, name="poster"),
+    path("ops/coalescing/", core_views.coalescing_stats, name="coalescing_stats"),
 ]